@@ -0,0 +1,72 @@
+"""
+Measure .3w body encryption and decryption speed with different
+numbers of worker threads.
+
+    python benchmarks/bench_crypt.py --size 128 --workers 1 2 4 8
+"""
+import os
+import sys
+import time
+import shutil
+import logging
+from tempfile import mkdtemp
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from threedub.gcode import GCodeFile
+from threedub.davinci import ThreeWFile, ThreeWReader
+
+
+def make_gcode(size):
+    lines = ["; filename = bench.3w", "; print_time = 3600", "; machine = daVinciJR10"]
+    length = 0
+    n = 0
+    while length < size:
+        line = "G1 X{:.3f} Y{:.3f} E{:.5f}".format(n % 200 / 2.0, n % 150 / 2.0, n * 0.01)
+        lines.append(line)
+        length += len(line) + 1
+        n += 1
+    return GCodeFile.from_string("\n".join(lines) + "\n")
+
+
+def bench_encrypt(gcode, path, workers):
+    start = time.time()
+    ThreeWFile(gcode, workers).write(path)
+    return time.time() - start
+
+
+def bench_decrypt(path, workers):
+    start = time.time()
+    with ThreeWReader(path, workers=workers) as reader:
+        for chunk in reader.chunks():
+            pass
+    return time.time() - start
+
+
+def main(argv=None):
+    ap = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("-s", "--size", type=float, default=128.0, help="Body size in MB")
+    ap.add_argument("-w", "--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count()], help="Worker counts to time")
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    size = int(args.size * 1024 * 1024)
+    gcode = make_gcode(size)
+    tmp = mkdtemp()
+    try:
+        path = os.path.join(tmp, "bench.3w")
+        base = None
+        for workers in sorted(set(args.workers)):
+            enc = bench_encrypt(gcode, path, workers)
+            dec = bench_decrypt(path, workers)
+            base = base or (enc, dec)
+            print("{:3d} workers: encrypt {:.2f}s ({:.1f} MB/s, x{:.2f}), decrypt {:.2f}s ({:.1f} MB/s, x{:.2f})".format(
+                workers, enc, args.size / enc, base[0] / enc, dec, args.size / dec, base[1] / dec))
+    finally:
+        shutil.rmtree(tmp)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""
+Time each stage of a conversion on synthetic G-code and compare
+against stored baselines.
+
+    python benchmarks/bench_pipeline.py --lines 1000000
+    python benchmarks/bench_pipeline.py --lines 1000000 --save
+
+Stages are timed separately for each slicer flavor: parse
+(GCodeFile.from_string), translate (GCodeTranslator.translate),
+encrypt (ThreeWFile.encrypt), decrypt (ThreeWFile.from_string) and
+write (GCodeFile.write). Times are stored as seconds per million
+lines, so runs of different sizes compare. Baselines depend on the
+machine, so none are committed: record them with --save on the
+machine that checks them, usually before making a change. The host
+and line count are saved with them. A stage slower than its baseline by more than the tolerance is a
+regression and makes the run exit with status 1.
+"""
+import os
+import sys
+import json
+import socket
+import time
+import shutil
+import logging
+from tempfile import mkdtemp
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from threedub.gcode import GCodeFile
+from threedub.davinci import ThreeWFile
+from threedub.translator import GCodeTranslator
+from gcodegen import Flavors, generate_text
+
+Stages = ("parse", "translate", "encrypt", "decrypt", "write")
+BaselineFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+
+def best_of(repeat, func):
+    """
+    Return the fastest time of repeat calls to func, and the
+    result of the last call.
+    """
+    best = None
+    for n in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_flavor(flavor, lines, repeat, tmp):
+    """
+    Return the time of each stage for one flavor in seconds.
+    """
+    text = generate_text(flavor, lines)
+    path = os.path.join(tmp, "{}.gcode".format(flavor))
+    times = {}
+    times["parse"], gcode = best_of(repeat, lambda: GCodeFile.from_string(text))
+
+    def translate():
+        # Translation changes the file; start from a fresh parse each time
+        copy = GCodeFile.from_string(text)
+        start = time.perf_counter()
+        GCodeTranslator("davincijr", flavor).translate(copy, filename=path)
+        return time.perf_counter() - start, copy
+    results = [translate() for n in range(repeat)]
+    times["translate"] = min(elapsed for elapsed, copy in results)
+    gcode = results[-1][1]
+
+    twfile = ThreeWFile(gcode)
+    times["encrypt"], data = best_of(repeat, twfile.encrypt)
+    times["decrypt"], roundtrip = best_of(repeat, lambda: ThreeWFile.from_string(data))
+    times["write"], result = best_of(repeat, lambda: gcode.write(path))
+    return times
+
+
+def compare(results, baselines, tolerance):
+    """
+    Return a list of (key, seconds, baseline) for stages that
+    got slower than their baseline by more than tolerance.
+    """
+    regressions = []
+    for key, seconds in sorted(results.items()):
+        baseline = baselines.get(key)
+        if baseline and seconds > baseline * (1 + tolerance):
+            regressions.append((key, seconds, baseline))
+    return regressions
+
+
+def main(argv=None):
+    ap = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("-n", "--lines", type=int, default=1000000, help="Move lines per synthetic file (default: 1000000)")
+    ap.add_argument("-f", "--flavors", nargs="+", default=list(Flavors), choices=Flavors, help="Slicer flavors to run")
+    ap.add_argument("-r", "--repeat", type=int, default=3, help="Runs per stage; the fastest counts (default: 3)")
+    ap.add_argument("-b", "--baselines", default=BaselineFile, help="Baseline file (default: benchmarks/baselines.json)")
+    ap.add_argument("-t", "--tolerance", type=float, default=0.25, help="Allowed slowdown before failing (default: 0.25)")
+    ap.add_argument("--save", action="store_true", help="Store these results as the new baselines")
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            saved = json.load(f)
+        baselines = saved.get("times", {})
+        if saved.get("host") != socket.gethostname() or saved.get("lines") != args.lines:
+            print("Baselines were saved on {} with {} lines".format(saved.get("host"), saved.get("lines")))
+    elif not args.save:
+        print("No baselines in {}; run with --save first".format(args.baselines))
+
+    results = {}
+    tmp = mkdtemp()
+    try:
+        for flavor in args.flavors:
+            times = bench_flavor(flavor, args.lines, args.repeat, tmp)
+            for stage in Stages:
+                key = "{}/{}".format(flavor, stage)
+                # Seconds per million lines
+                results[key] = round(times[stage] * 1e6 / args.lines, 4)
+                baseline = baselines.get(key)
+                print("{:18s} {:8.3f}s  {:8.3f}s/Mline{}".format(
+                    key, times[stage], results[key],
+                    "  (baseline {:.3f}, {:+.0%})".format(baseline, results[key] / baseline - 1) if baseline else ""))
+    finally:
+        shutil.rmtree(tmp)
+
+    if args.save:
+        baselines.update(results)
+        with open(args.baselines, "w") as f:
+            json.dump({"host": socket.gethostname(), "lines": args.lines, "times": baselines},
+                      f, indent=2, sort_keys=True)
+            f.write("\n")
+        print("Baselines saved to {}".format(args.baselines))
+        return 0
+
+    regressions = compare(results, baselines, args.tolerance)
+    for key, seconds, baseline in regressions:
+        print("REGRESSION {}: {:.3f}s/Mline, baseline {:.3f}s/Mline ({:+.0%})".format(
+            key, seconds, baseline, seconds / baseline - 1))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+Measure upload throughput and command round-trip latency of the
+printer protocol against the simulated printer.
+
+    python benchmarks/bench_serial.py --size 1 --baudrate 115200
+"""
+import os
+import sys
+import time
+import logging
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from threedub.simulator import SimulatedPrinter
+from threedub.printers import DaVinciJr10
+
+
+def bench_queries(printer, count):
+    times = []
+    for n in range(count):
+        start = time.time()
+        printer.query_cmd("j", expect="$")
+        times.append(time.time() - start)
+    return times
+
+
+def bench_upload(printer, size):
+    data = os.urandom(size)
+    chunks = (data[n:n + printer.BlockSize] for n in range(0, size, printer.BlockSize))
+    start = time.time()
+    printer.print_stream("bench.3w", size, chunks)
+    return time.time() - start
+
+
+def main(argv=None):
+    ap = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("-s", "--size", type=float, default=1.0, help="Upload size in MB")
+    ap.add_argument("-q", "--queries", type=int, default=5, help="Number of status queries to time")
+    ap.add_argument("-l", "--latency", type=float, default=0.0, help="Simulated response latency in seconds")
+    ap.add_argument("-b", "--baudrate", type=int, default=None, help="Simulated link speed (default: unthrottled)")
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    with SimulatedPrinter(args.latency, args.baudrate) as sim:
+        printer = DaVinciJr10(sim.device)
+        times = bench_queries(printer, args.queries)
+        print("query round trip: min {:.3f}s, mean {:.3f}s, max {:.3f}s".format(
+            min(times), sum(times) / len(times), max(times)))
+        size = int(args.size * 1024 * 1024)
+        elapsed = bench_upload(printer, size)
+        print("upload: {} bytes in {:.2f}s, {:.1f} KB/s".format(size, elapsed, size / elapsed / 1024.0))
+        if len(sim.uploads[-1].data) != size:
+            print("upload incomplete: {} of {} bytes".format(len(sim.uploads[-1].data), size))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
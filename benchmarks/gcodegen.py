@@ -0,0 +1,180 @@
+"""
+Generate large synthetic G-code files in the style of Cura, Slic3r
+and XYZware output, like the tube_*.gcode test files at any size.
+
+    python benchmarks/gcodegen.py --flavor cura --lines 1000000 big_cura.gcode
+"""
+import math
+import random
+import sys
+from argparse import ArgumentParser
+
+Flavors = ("cura", "slic3r", "xyz")
+
+CuraHead = """\
+M109 S195.000000
+;Sliced at: Thu 16-06-2016 08:13:31
+;Basic settings: Layer height: 0.25 Walls: 0.8 Fill: 15
+;Print time: {minutes} minutes
+;Filament used: {meters:.3f}m 1.0g
+;Filament cost: None
+G21 ; set units to millimeters
+M107
+G90 ; use absolute coordinates
+G92 E0
+M82 ; use absolute distances for extrusion
+
+;Layer count: {layers}
+"""
+
+CuraTail = """\
+M107
+G1 F3000 E{extrusion:.5f}
+G28 X0
+M84     ; disable motors
+"""
+
+Slic3rHead = """\
+; generated by Slic3r 1.2.9 on 2016-05-21 at 14:48:19
+
+; external perimeters extrusion width = 0.40mm
+; perimeters extrusion width = 0.67mm
+; infill extrusion width = 0.67mm
+
+M107
+M140 S90 ; Bed (no wait)
+G90 ; set absolute coordinates
+G28 ; home all axis
+M190 S90 ; Bed (wait)
+M109 S230 ; Extruder (wait)
+G21 ; set units to millimeters
+M82 ; use absolute distances for extrusion
+G92 E0
+"""
+
+Slic3rTail = """\
+M107
+G28 X0
+M84 ; Disable motors
+
+; filament used = {millimeters:.1f}mm (1.4cm3)
+
+; avoid_crossing_perimeters = 0
+; bed_temperature = 90
+; fill_density = 10%
+; layer_height = 0.25
+; perimeters = 3
+"""
+
+XYZHead = """\
+; filename = synthetic.gcode
+; print_time = {seconds}
+; machine = daVinciJR10
+; filamentid = 50,50
+; layer_height = 0.25
+; fill_density = 0.10
+; total_layers = {layers}
+; version = 15062609
+; total_filament = {millimeters:.1f}mm (1.4cm3)
+; nozzle_diameter = 0.40
+; extruder_filament = 1.00:0.00
+; dimension = 60.00:60.00:{height:.2f}
+; extruder = 1
+
+
+M107
+M140 S90 ; Bed (no wait)
+G90 ; set absolute coordinates
+G28 ; home all axis
+G92 E0
+"""
+
+XYZTail = """\
+M107
+G28 X0
+M84 ; Disable motors
+"""
+
+
+def moves(lines, seed=0):
+    """
+    Yield lines of layered moves: circles of extruding G1 moves
+    with a G0 travel and a Z step between layers.
+    """
+    rng = random.Random(seed)
+    per_layer = 400
+    layer = 0
+    extrusion = 0.0
+    n = 0
+    while n < lines:
+        z = 0.3 + layer * 0.25
+        yield ";LAYER:{}".format(layer)
+        yield "G0 F2700 X{:.3f} Y{:.3f} Z{:.3f}".format(70.0, 70.0, z)
+        n += 2
+        radius = 10.0 + rng.random() * 5.0
+        for step in range(per_layer):
+            if n >= lines:
+                break
+            angle = step * 2 * math.pi / per_layer
+            extrusion += 0.0125
+            if step == 0:
+                yield "G1 F900 X{:.3f} Y{:.3f} E{:.5f}".format(
+                    60.0 + radius * math.cos(angle), 60.0 + radius * math.sin(angle), extrusion)
+            else:
+                yield "G1 X{:.3f} Y{:.3f} E{:.5f}".format(
+                    60.0 + radius * math.cos(angle), 60.0 + radius * math.sin(angle), extrusion)
+            n += 1
+        layer += 1
+
+
+def generate(flavor, lines, seed=0):
+    """
+    Yield the lines of a synthetic file with about lines
+    statements in the given flavor.
+    """
+    if flavor not in Flavors:
+        raise ValueError("Unknown flavor: {}".format(flavor))
+    layers = max(lines // 402, 1)
+    millimeters = lines * 0.0125
+    values = {
+        "layers": layers,
+        "minutes": layers,
+        "seconds": layers * 60,
+        "meters": millimeters / 1000.0,
+        "millimeters": millimeters,
+        "extrusion": millimeters,
+        "height": 0.3 + layers * 0.25,
+    }
+    head, tail = {
+        "cura": (CuraHead, CuraTail),
+        "slic3r": (Slic3rHead, Slic3rTail),
+        "xyz": (XYZHead, XYZTail),
+    }[flavor]
+    for line in head.format(**values).splitlines():
+        yield line
+    for line in moves(lines, seed):
+        yield line
+    for line in tail.format(**values).splitlines():
+        yield line
+
+
+def generate_text(flavor, lines, seed=0):
+    return "\n".join(generate(flavor, lines, seed)) + "\n"
+
+
+def main(argv=None):
+    ap = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("outfile", help="Output file")
+    ap.add_argument("-f", "--flavor", default="cura", choices=Flavors, help="Slicer to imitate")
+    ap.add_argument("-n", "--lines", type=int, default=1000000, help="Number of move lines")
+    ap.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = ap.parse_args(argv)
+    with open(args.outfile, "w") as f:
+        for line in generate(args.flavor, args.lines, args.seed):
+            f.write(line)
+            f.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
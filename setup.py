@@ -9,11 +9,15 @@ setup(
         "pycrypto",
         "Padding",
     ],
+    extras_require={
+        "analysis": ["numpy"],
+    },
     tests_require=["nose"],
     test_suite="nose.collector",
     entry_points={
         "console_scripts": [
             "threedub = threedub.main:threedub",
+            "threedub-sim = threedub.simulator:main",
         ]
     },
 )
@@ -0,0 +1,60 @@
+import os
+from unittest import TestCase, skipIf, mock
+from threedub.gcode import GCodeFile
+from threedub.slicers import Cura
+from threedub.translator import GCodeTranslator
+from threedub.analysis import ToolpathAnalyzer, analyze, load_numpy
+
+Here = os.path.dirname(os.path.abspath(__file__))
+TestFiles = os.path.join(Here, "files")
+
+@skipIf(load_numpy() is None, "numpy not installed")
+class AnalysisTests(TestCase):
+    def test_cura_tube(self):
+        # Cura reports 28 layers, 11 minutes and 0.399m of filament
+        meta = analyze(GCodeFile.from_file(os.path.join(TestFiles, "tube_cura.gcode")))
+        self.assertEqual(meta["total_layers"], 28)
+        self.assertAlmostEqual(meta["print_time"], 660, delta=60)
+        self.assertAlmostEqual(float(meta["total_filament"]), 399, delta=10)
+        width, depth, height = [float(v) for v in meta["dimension"].split(":")]
+        self.assertAlmostEqual(width, 30, delta=1)
+        self.assertAlmostEqual(height, 6.75, delta=0.1)
+
+    def test_pieces(self):
+        text = "G92 E0\nG1 F600 X0 Y0 Z0.2\nG1 X10 E1\nG1 Y10 E2 ; comment\nG92 E0\nG1 Z0.4\nG1 X0 E1\n"
+        whole = ToolpathAnalyzer()
+        whole.feed(text)
+        pieces = ToolpathAnalyzer()
+        lines = text.splitlines()
+        pieces.feed("\n".join(lines[:3]))
+        pieces.feed("\n".join(lines[3:]))
+        self.assertEqual(whole.metadata(), pieces.metadata())
+        meta = whole.metadata()
+        self.assertEqual(meta["total_layers"], 2)
+        self.assertEqual(meta["total_filament"], "3.0")
+        self.assertEqual(meta["dimension"], "10.00:10.00:0.20")
+        # 30mm of XY moves at 10mm/s, plus the Z moves
+        self.assertEqual(meta["print_time"], 3)
+
+    def test_malformed_numbers(self):
+        text = "G92 E0\nG1 F600 X0 Y0 Z0.2\nG1 X. E0.5\nG1 X10 Y1.2.3 E1\nG1 Y10 E2\n"
+        meta = analyze(GCodeFile.from_string(text))
+        self.assertEqual(meta["total_filament"], "2.0")
+        self.assertEqual(meta["dimension"], "10.00:10.00:0.00")
+
+    def test_lines(self):
+        # Indented lines, G00/G01, words in comments and other codes
+        text = "G92 E0\n  G01 X10 Y0 Z0.2 E1 ; X99\nG00 X0 Y10\nG28 X50\nG10 X50\nG1 Y0 E2 ;Y99\n"
+        meta = analyze(GCodeFile.from_string(text))
+        self.assertEqual(meta["total_filament"], "2.0")
+        self.assertEqual(meta["dimension"], "10.00:10.00:0.20")
+
+    def test_skipped(self):
+        values = {"print_time": 60, "total_layers": 2, "total_filament": "5", "dimension": "1:1:1"}
+        path = os.path.join(TestFiles, "tube_cura.gcode")
+        with mock.patch.object(Cura, "metadata", return_value=values), \
+                mock.patch("threedub.analysis.analyze_pieces") as analyze_pieces:
+            translator = GCodeTranslator("davincijr", "auto")
+            self.assertEqual(translator.header_values(path, "tube.gcode")["print_time"], 60)
+            translator.translate(GCodeFile.from_file(path), "tube.gcode")
+        analyze_pieces.assert_not_called()
@@ -0,0 +1,70 @@
+import os
+import asyncio
+from unittest import TestCase, mock
+from threedub.gcode import GCodeFile
+from threedub.davinci import ThreeWFile
+from threedub.asyncprinters import AsyncDaVinciJr10
+from threedub.printers import PrinterError
+from threedub.simulator import SimulatedPrinter
+
+FilesDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "files")
+
+class AsyncPrinterTests(TestCase):
+    def setUp(self):
+        self.sims = [SimulatedPrinter(), SimulatedPrinter()]
+        for sim in self.sims:
+            sim.start()
+
+    def tearDown(self):
+        for sim in self.sims:
+            sim.stop()
+
+    def test_status(self):
+        async def run():
+            async with AsyncDaVinciJr10(self.sims[0].device) as printer:
+                status = await printer.status()
+                events = printer.status_events(interval=0)
+                first = await events.__anext__()
+                second = await events.__anext__()
+                await events.aclose()
+            return status, first, second
+        status, first, second = asyncio.run(run())
+        self.assertIn("Serial number: 3F10XPUS5TH1234", status)
+        self.assertEqual(first.instances["j"].value, ["9511", "0"])
+        self.assertEqual(second.instances["i"].value, "3F10XPUS5TH1234")
+
+    def test_device_closed(self):
+        async def run():
+            async with AsyncDaVinciJr10(self.sims[0].device) as printer:
+                conn = printer.conn
+                pending = asyncio.ensure_future(conn.readline(timeout=10))
+                await asyncio.sleep(0)
+                # A read at end of file returns nothing
+                with mock.patch("threedub.asyncprinters.os.read", return_value=b""):
+                    conn._readable()
+                with self.assertRaises(PrinterError):
+                    await asyncio.wait_for(pending, 1)
+                with self.assertRaises(PrinterError):
+                    await conn.readline()
+                self.assertFalse(asyncio.get_running_loop().remove_reader(conn._fd))
+        asyncio.run(run())
+
+    def test_concurrent(self):
+        twfile = ThreeWFile(GCodeFile.from_file(os.path.join(FilesDir, "tube_cura.gcode")))
+        data = twfile.encrypt()
+
+        async def run(sim):
+            async with AsyncDaVinciJr10(sim.device) as printer:
+                # Commands from concurrent tasks share the connection in turn
+                await asyncio.gather(
+                    printer.print_data("tube_cura.3w", data),
+                    printer.unlock_filament(),
+                    printer.status(),
+                )
+
+        async def farm():
+            await asyncio.gather(*(run(sim) for sim in self.sims))
+        asyncio.run(farm())
+        for sim in self.sims:
+            self.assertEqual(bytes(sim.uploads[0].data), data)
+            self.assertEqual(sim.config, ["pda:[1591]", "pdb:[4387]", "pdc:[7264]", "pde:[8046]"])
@@ -0,0 +1,49 @@
+import os
+import shutil
+from unittest import TestCase
+from tempfile import mkdtemp
+from threedub.main import threedub
+from threedub.cache import ConversionCache
+
+Here = os.path.dirname(os.path.abspath(__file__))
+TestFiles = os.path.join(Here, "files")
+
+class BatchTests(TestCase):
+    Names = ["cura", "slic3r", "nohead"]
+
+    def setUp(self):
+        self.tmp = mkdtemp()
+        self.out = os.path.join(self.tmp, "out")
+        self.files = [os.path.join(TestFiles, "tube_" + name + ".gcode") for name in self.Names]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_batch(self):
+        self.assertEqual(threedub(["-b"] + self.files + ["-j", "2", "--output-dir", self.out, "--no-cache"]), 0)
+        for name in self.Names:
+            self.assertTrue(os.path.exists(os.path.join(self.out, "tube_" + name + ".3w")))
+
+    def test_batch_cache(self):
+        cache_dir = os.path.join(self.tmp, "cache")
+        options = ["-j", "2", "--output-dir", self.out, "--cache-dir", cache_dir]
+        self.assertEqual(threedub(["-b"] + self.files + options), 0)
+        stats = ConversionCache(cache_dir).stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (0, 3))
+        shutil.rmtree(self.out)
+        self.assertEqual(threedub(["-b"] + self.files + options), 0)
+        stats = ConversionCache(cache_dir).stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (3, 3))
+        for name in self.Names:
+            self.assertTrue(os.path.exists(os.path.join(self.out, "tube_" + name + ".3w")))
+
+    def test_batch_same_names(self):
+        for sub in ["a", "b"]:
+            os.makedirs(os.path.join(self.tmp, "in", sub))
+            shutil.copy(self.files[0], os.path.join(self.tmp, "in", sub, "part.gcode"))
+        shutil.copy(self.files[0], os.path.join(self.tmp, "in", "b", "part.3w"))
+        inputs = os.path.join(self.tmp, "in")
+        self.assertEqual(threedub(["-b", inputs, "-j", "1", "--output-dir", self.out, "--no-cache"]), 1)
+        self.assertTrue(os.path.exists(os.path.join(self.out, "a", "part.3w")))
+        self.assertFalse(os.path.exists(os.path.join(self.out, "b", "part.3w")))
+        self.assertFalse(os.path.exists(os.path.join(self.out, "part.3w")))
@@ -0,0 +1,82 @@
+import os
+import time
+import shutil
+from unittest import TestCase, mock
+from tempfile import mkdtemp
+from concurrent.futures import ProcessPoolExecutor
+from threedub.cache import ConversionCache
+
+FilesDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "files")
+
+def lookups(directory, count):
+    cache = ConversionCache(directory)
+    for n in range(count):
+        cache.fetch("aa11", os.path.join(os.path.dirname(directory), "out{}".format(os.getpid())))
+
+class CacheTests(TestCase):
+    def setUp(self):
+        self.tmp = mkdtemp()
+        self.cache = ConversionCache(os.path.join(self.tmp, "cache"), max_size=1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write(self, name, size):
+        path = os.path.join(self.tmp, name)
+        with open(path, "wb") as f:
+            f.write(b"x" * size)
+        return path
+
+    def test_keys(self):
+        infile = os.path.join(FilesDir, "tube_cura.gcode")
+        key = ConversionCache.key(infile, "davincijr", "auto", "tube_cura.3w")
+        self.assertEqual(key, ConversionCache.key(infile, "davincijr", "auto", "tube_cura.3w"))
+        self.assertNotEqual(key, ConversionCache.key(infile, "davincijr", "cura", "tube_cura.3w"))
+        self.assertNotEqual(key, ConversionCache.key(infile, "davincijr", "auto", "other.3w"))
+
+    def test_fetch_store(self):
+        dest = os.path.join(self.tmp, "out")
+        self.assertFalse(self.cache.fetch("aa11", dest))
+        self.cache.store("aa11", self.write("a", 400))
+        self.assertTrue(self.cache.fetch("aa11", dest))
+        self.assertEqual(os.path.getsize(dest), 400)
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (1, 1, 1))
+
+    def test_shared_stats(self):
+        self.cache.store("aa11", self.write("a", 400))
+        with mock.patch.object(ConversionCache, "entries", side_effect=AssertionError):
+            self.cache.fetch("aa11", os.path.join(self.tmp, "out"))
+            self.cache.fetch("bb22", os.path.join(self.tmp, "out"))
+        with ProcessPoolExecutor(4) as pool:
+            for done in [pool.submit(lookups, self.cache.directory, 50) for n in range(4)]:
+                done.result()
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (201, 1))
+
+    def test_evict_least_recent(self):
+        self.cache.store("aa11", self.write("a", 400))
+        self.cache.store("bb22", self.write("b", 400))
+        # Make the first entry the most recently used
+        past = time.time() - 60
+        os.utime(self.cache.entry_path("bb22"), (past, past))
+        self.cache.fetch("aa11", os.path.join(self.tmp, "out"))
+        self.cache.store("cc33", self.write("c", 400))
+        self.assertTrue(os.path.exists(self.cache.entry_path("aa11")))
+        self.assertFalse(os.path.exists(self.cache.entry_path("bb22")))
+        self.assertTrue(os.path.exists(self.cache.entry_path("cc33")))
+
+    def test_entry_removed_while_listing(self):
+        self.cache.store("aa11", self.write("a", 400))
+        self.cache.store("bb22", self.write("b", 400))
+        scandir = os.scandir
+        def listing(path):
+            entries = list(scandir(path))
+            # Another process evicts an entry after it was listed
+            gone = self.cache.entry_path("aa11")
+            if os.path.exists(gone) and any(entry.path == gone for entry in entries):
+                os.unlink(gone)
+            return iter(entries)
+        with mock.patch("os.scandir", listing):
+            entries = self.cache.entries()
+        self.assertEqual([path for mtime, size, path in entries], [self.cache.entry_path("bb22")])
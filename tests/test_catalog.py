@@ -0,0 +1,51 @@
+import os
+import shutil
+from unittest import TestCase
+from tempfile import mkdtemp
+from threedub.gcode import GCodeFile
+from threedub.davinci import ThreeWFile
+from threedub.translator import GCodeTranslator
+from threedub.catalog import Catalog
+
+Here = os.path.dirname(os.path.abspath(__file__))
+TestFiles = os.path.join(Here, "files")
+
+class CatalogTests(TestCase):
+    def setUp(self):
+        self.tmp = mkdtemp()
+        self.library = os.path.join(self.tmp, "library")
+        os.makedirs(os.path.join(self.library, "sub"))
+        for name in ("tube_cura.gcode", "tube_slic3r.gcode"):
+            shutil.copy(os.path.join(TestFiles, name), self.library)
+        gcode = GCodeFile.from_file(os.path.join(TestFiles, "tube_xyz.gcode"))
+        GCodeTranslator("davincijr", "auto").translate(gcode, filename="tube_xyz.3w")
+        ThreeWFile(gcode).write(os.path.join(self.library, "sub", "tube_xyz.3w"))
+        self.catalog = Catalog(os.path.join(self.tmp, "catalog.db"))
+
+    def tearDown(self):
+        self.catalog.close()
+        shutil.rmtree(self.tmp)
+
+    def test_scan(self):
+        self.assertEqual(self.catalog.scan([self.library]), (3, 0, 0))
+        self.assertEqual(self.catalog.scan([self.library]), (0, 3, 0))
+        path = os.path.join(self.library, "tube_cura.gcode")
+        with open(path, "a") as f:
+            f.write("G28\n")
+        os.remove(os.path.join(self.library, "tube_slic3r.gcode"))
+        self.assertEqual(self.catalog.scan([self.library]), (1, 1, 1))
+        self.assertEqual(sorted(os.path.basename(p) for p, values in self.catalog.find()), ["tube_cura.gcode", "tube_xyz.3w"])
+
+    def test_find(self):
+        self.catalog.scan([self.library])
+        results = self.catalog.find([("machine", "=", "daVinciJR10")])
+        self.assertEqual(len(results), 1)
+        path, values = results[0]
+        self.assertEqual(path, os.path.join(self.library, "sub", "tube_xyz.3w"))
+        self.assertEqual(values["filename"], "tube_xyz.3w")
+        results = self.catalog.find([Catalog.parse_condition("total_filament<500")])
+        self.assertEqual([os.path.basename(p) for p, values in results], ["tube_cura.gcode"])
+        results = self.catalog.find([Catalog.parse_condition("filename~slic3r")])
+        self.assertEqual([os.path.basename(p) for p, values in results], ["tube_slic3r.gcode"])
+        with self.assertRaises(ValueError):
+            Catalog.parse_condition("total_filament")
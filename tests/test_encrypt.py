@@ -1,11 +1,13 @@
 import os
-from unittest import TestCase
+from unittest import TestCase, mock
+import shutil
+from tempfile import TemporaryFile, mkdtemp
 import threedub.models
 import threedub.slicers
 from threedub.translator import GCodeTranslator
 from threedub.gcode import GCodeFile
 from threedub.bases import Slicer
-from threedub.davinci import ThreeWFile
+from threedub.davinci import ThreeWFile, ThreeWReader, ThreeWHeader
 
 Here = os.path.dirname(os.path.abspath(__file__))
 TestFiles = os.path.join(Here, "files")
@@ -37,3 +39,115 @@ class EncryptTests(TestCase):
         self.assertEqual(twfile.gcode.header_text, roundtrip.gcode.header_text)
         self.assertEqual(len(twfile.gcode.gcode), len(roundtrip.gcode.gcode))
         
+    def test_encrypt_to_file(self):
+        gcode = GCodeFile.from_file(os.path.join(TestFiles, "tube_cura.gcode"))
+        GCodeTranslator("davincijr", "auto").translate(gcode, filename="tube_cura.gcode")
+        twfile = ThreeWFile(gcode)
+        twfile.ChunkSize = 4096
+        with TemporaryFile() as f:
+            size = twfile.encrypt_to(f)
+            f.seek(0)
+            data = f.read()
+        self.assertEqual(size, len(data))
+        self.assertEqual(data, twfile.encrypt())
+        roundtrip = ThreeWFile.from_string(data)
+        self.assertEqual(twfile.gcode.header_text, roundtrip.gcode.header_text)
+
+    def test_reader_lines(self):
+        gcode = GCodeFile.from_file(os.path.join(TestFiles, "tube_xyz.gcode"))
+        twfile = ThreeWFile(gcode)
+        tmp = mkdtemp()
+        try:
+            path = os.path.join(tmp, "tube_xyz.3w")
+            twfile.write(path)
+            with ThreeWReader(path, chunk_size=1000) as reader:
+                lines = list(reader.lines())
+            self.assertEqual(gcode.text.splitlines(), lines)
+            roundtrip = ThreeWFile.from_file(path)
+            self.assertEqual(lines, roundtrip.gcode.text.splitlines())
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_header(self):
+        gcode = GCodeFile.from_file(os.path.join(TestFiles, "tube_cura.gcode"))
+        GCodeTranslator("davincijr", "auto").translate(gcode, filename="tube_cura.3w")
+        tmp = mkdtemp()
+        try:
+            path = os.path.join(tmp, "tube_cura.3w")
+            ThreeWFile(gcode).write(path)
+            header = ThreeWHeader.from_file(path)
+            self.assertEqual(header.text, gcode.header_text)
+            self.assertEqual(header.values["filename"], "tube_cura.3w")
+            self.assertEqual(header.values["machine"], "daVinciJR10")
+            self.assertTrue(header.verify(path))
+            with open(path, "r+b") as f:
+                f.seek(ThreeWFile.HeaderSize + 100)
+                f.write(b"x")
+            self.assertFalse(header.verify(path))
+            with self.assertRaises(ValueError):
+                ThreeWHeader.from_file(os.path.join(TestFiles, "tube_cura.gcode"))
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_probe_slicers(self):
+        for slicer in Slicer.implementations():
+            path = os.path.join(TestFiles, self.SlicerFiles[slicer.name])
+            translator = GCodeTranslator("davincijr", "auto")
+            found, meta = translator.probe(path)
+            full = GCodeFile.from_file(path)
+            self.assertEqual(found.name, slicer.name)
+            self.assertEqual(dict(meta), dict(translator.metadata(full, slicer())))
+
+    def test_translate_probed(self):
+        path = os.path.join(TestFiles, "tube_slic3r.gcode")
+        translator = GCodeTranslator("davincijr", "auto")
+        expected = GCodeFile.from_file(path)
+        translator.translate(expected, filename="tube_slic3r.3w")
+        slicer, found = translator.probe_values(path)
+        gcode = GCodeFile.from_file(path)
+        with mock.patch.object(translator, "find_slicer") as find_slicer:
+            translator.translate(gcode, filename="tube_slic3r.3w", found=found)
+        self.assertFalse(find_slicer.called)
+        self.assertEqual(gcode.text, expected.text)
+
+    def test_parallel(self):
+        gcode = GCodeFile.from_file(os.path.join(TestFiles, "tube_cura.gcode"))
+        twfile = ThreeWFile(gcode)
+        parallel = ThreeWFile(gcode, workers=4)
+        parallel.SegmentSize = 4096
+        data = twfile.encrypt()
+        self.assertEqual(parallel.encrypt(), data)
+        roundtrip = ThreeWFile.from_string(data, workers=4)
+        self.assertEqual(ThreeWFile.from_string(data).gcode.text, roundtrip.gcode.text)
+        tmp = mkdtemp()
+        try:
+            path = os.path.join(tmp, "tube_cura.3w")
+            twfile.write(path)
+            with ThreeWReader(path, chunk_size=1000, workers=3) as reader:
+                lines = list(reader.lines())
+            self.assertEqual(gcode.text.splitlines(), lines)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_stream_translate(self):
+        for slicerfile in self.SlicerFiles.values():
+            path = os.path.join(TestFiles, slicerfile)
+            gcode = GCodeFile.from_file(path)
+            translator = GCodeTranslator("davincijr", "auto")
+            translator.translate(gcode, filename=slicerfile)
+            stream = translator.stream(path, translator.header_values(path, slicerfile))
+            self.assertEqual(ThreeWFile(stream).encrypt(), ThreeWFile(gcode).encrypt())
+
+    def test_stream_translate_3w(self):
+        tmp = mkdtemp()
+        try:
+            for slicerfile in ("tube_cura.gcode",):
+                path = os.path.join(tmp, slicerfile.replace(".gcode", ".3w"))
+                ThreeWFile(GCodeFile.from_file(os.path.join(TestFiles, slicerfile))).write(path)
+                translator = GCodeTranslator("davincijr", "auto")
+                gcode = ThreeWFile.from_file(path).gcode
+                translator.translate(gcode, filename=slicerfile)
+                stream = translator.stream(path, translator.header_values(path, slicerfile))
+                self.assertEqual(ThreeWFile(stream).encrypt(), ThreeWFile(gcode).encrypt())
+        finally:
+            shutil.rmtree(tmp)
@@ -0,0 +1,89 @@
+import os
+import time
+import shutil
+from tempfile import mkdtemp
+from threading import Thread
+from unittest import TestCase
+from threedub.gcode import GCodeFile
+from threedub.davinci import ThreeWFile
+from threedub.farm import PrintFarm
+from threedub.simulator import SimulatedPrinter
+
+FilesDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "files")
+
+class FarmTests(TestCase):
+    def setUp(self):
+        self.sims = [SimulatedPrinter(print_time=0.3), SimulatedPrinter(print_time=0.3)]
+        for sim in self.sims:
+            sim.start()
+
+    def tearDown(self):
+        for sim in self.sims:
+            sim.stop()
+
+    def test_farm(self):
+        data = ThreeWFile(GCodeFile.from_file(os.path.join(FilesDir, "tube_cura.gcode"))).encrypt()
+        farm = PrintFarm([sim.device for sim in self.sims], poll_interval=0.05)
+        for n in range(3):
+            farm.submit("job{}.3w".format(n), data)
+        jobs = farm.run()
+        self.assertFalse([job.error for job in jobs if job.error])
+        # Both printers start a job, and the first to finish gets the third
+        self.assertEqual(set(job.device for job in jobs[:2]), set(sim.device for sim in self.sims))
+        self.assertGreaterEqual(jobs[2].queue_wait, 0.3)
+        self.assertEqual(sum(len(sim.uploads) for sim in self.sims), 3)
+        for sim in self.sims:
+            for upload in sim.uploads:
+                self.assertEqual(bytes(upload.data), data)
+        stats = farm.stats()
+        self.assertEqual(sum(s["jobs"] for s in stats), 3)
+        self.assertEqual(sum(s["bytes"] for s in stats), 3 * len(data))
+
+    def test_busy_printer(self):
+        data = ThreeWFile(GCodeFile.from_file(os.path.join(FilesDir, "tube_cura.gcode"))).encrypt()
+        # The second printer stays busy for the whole run
+        self.sims[1]._printing_until = time.time() + 3600
+        farm = PrintFarm([sim.device for sim in self.sims], poll_interval=0.05)
+        farm.submit("job.3w", data)
+        runner = Thread(target=farm.run, daemon=True)
+        runner.start()
+        runner.join(10)
+        self.assertFalse(runner.is_alive())
+        self.assertEqual(farm.jobs[0].device, self.sims[0].device)
+        self.assertFalse(self.sims[1].uploads)
+
+    def test_settle(self):
+        data = ThreeWFile(GCodeFile.from_file(os.path.join(FilesDir, "tube_cura.gcode"))).encrypt()
+        # A printer still reporting idle after each upload
+        sim = SimulatedPrinter()
+        sim.start()
+        try:
+            farm = PrintFarm([sim.device], poll_interval=0.05, settle_time=0.3)
+            for n in range(2):
+                farm.submit("job{}.3w".format(n), data)
+            jobs = farm.run()
+        finally:
+            sim.stop()
+        self.assertFalse([job.error for job in jobs if job.error])
+        self.assertGreaterEqual(jobs[1].started - jobs[0].finished, 0.3)
+
+    def test_lazy_jobs(self):
+        tmp = mkdtemp()
+        try:
+            path = os.path.join(tmp, "tube_cura.3w")
+            ThreeWFile(GCodeFile.from_file(os.path.join(FilesDir, "tube_cura.gcode"))).write(path)
+            farm = PrintFarm([sim.device for sim in self.sims], poll_interval=0.05)
+            farm.submit(path)
+            farm.submit(os.path.join(FilesDir, "tube_slic3r.gcode"), options=["-m", "davincijr", "-s", "auto"])
+            self.assertEqual([job.data for job in farm.jobs], [None, None])
+            jobs = farm.run()
+            self.assertFalse([job.error for job in jobs if job.error])
+            uploads = dict((upload.filename, bytes(upload.data)) for sim in self.sims for upload in sim.uploads)
+            with open(path, "rb") as f:
+                self.assertEqual(uploads[os.path.join(tmp, "tube_cura.gcode")], f.read())
+            converted = ThreeWFile.from_string(uploads[os.path.join(FilesDir, "tube_slic3r.gcode")])
+            self.assertTrue(converted.gcode.header_text.startswith(
+                "; filename = {}\n".format(os.path.join(FilesDir, "tube_slic3r.3w"))))
+            self.assertEqual(jobs[1].size, len(uploads[os.path.join(FilesDir, "tube_slic3r.gcode")]))
+        finally:
+            shutil.rmtree(tmp)
@@ -0,0 +1,72 @@
+import os
+from unittest import TestCase
+from threedub.gcode import GCodeFile, GCodeStream, GCodeComment, GCodeStatement, GCodeBlankLine
+
+Here = os.path.dirname(os.path.abspath(__file__))
+TestFiles = os.path.join(Here, "files")
+
+class GCodeFileTests(TestCase):
+    Sample = "; header = 1\nG28\n\n  G1 X1 Y2  \n;LAYER:0\nM107\n"
+
+    def test_views(self):
+        gcode = GCodeFile.from_string(self.Sample)
+        self.assertEqual(len(gcode.statements), 6)
+        self.assertEqual([str(s) for s in gcode.headers], ["; header = 1", ";LAYER:0"])
+        self.assertEqual([str(s) for s in gcode.gcode], ["G28", "", "G1 X1 Y2", "M107"])
+        self.assertIsInstance(gcode.statements[0], GCodeComment)
+        self.assertIsInstance(gcode.statements[2], GCodeBlankLine)
+        self.assertIsInstance(gcode.statements[-1], GCodeStatement)
+        self.assertEqual(gcode.text, os.linesep.join(["; header = 1", "G28", "", "G1 X1 Y2", ";LAYER:0", "M107"]))
+
+    def test_assign_statements(self):
+        gcode = GCodeFile.from_string(self.Sample)
+        gcode.statements = [GCodeComment("; new")] + list(gcode.gcode)
+        self.assertEqual(gcode.header_text, "; new")
+        self.assertEqual(len(gcode.statements), 5)
+        self.assertEqual(str(gcode.statements[3]), "G1 X1 Y2")
+
+    def test_from_file(self):
+        path = os.path.join(TestFiles, "tube_cura.gcode")
+        gcode = GCodeFile.from_file(path)
+        with open(path) as f:
+            lines = [line.strip() for line in f]
+        self.assertEqual(gcode.text, os.linesep.join(lines))
+
+    def test_header_index(self):
+        gcode = GCodeFile.from_string("; a = 1\n; b: 2\nG28\n; a = 3\n")
+        self.assertEqual(gcode.header_values("="), {"a": "3"})
+        self.assertEqual(gcode.header_values(":"), {"b": "2"})
+        self.assertIs(gcode.header_values("="), gcode.header_values("="))
+        gcode.statements = [GCodeComment("; c = 4")] + list(gcode.gcode)
+        self.assertEqual(gcode.header_values("="), {"c": "4"})
+        self.assertEqual(gcode.header_text, "; c = 4")
+
+    def test_items(self):
+        gcode = GCodeFile.from_string(self.Sample)
+        items = list(gcode.items)
+        self.assertEqual(items[:3], [(GCodeFile.Comment, "; header = 1"), (GCodeFile.Statement, "G28"), (GCodeFile.Blank, "")])
+        gcode.items = [(kind, text.replace("G28", "G29")) for kind, text in items]
+        self.assertEqual(str(gcode.statements[1]), "G29")
+        self.assertEqual(gcode.header_text, os.linesep.join(["; header = 1", ";LAYER:0"]))
+
+    def test_replace_headers(self):
+        gcode = GCodeFile.from_string(self.Sample)
+        gcode.replace_headers(["; a = 1", "; b = 2"])
+        self.assertEqual(list(gcode.items), list(GCodeFile.from_string("; a = 1\n; b = 2\nG28\n\nG1 X1 Y2\nM107\n").items))
+        self.assertEqual(gcode.header_values("="), {"a": "1", "b": "2"})
+
+    def test_rewrite(self):
+        gcode = GCodeFile.from_string(self.Sample)
+        gcode.rewrite(lambda text: (text.replace("G28", "G29"), False))
+        self.assertEqual(gcode.line_text(1), "G29")
+        gcode.rewrite(lambda text: (text.replace("G29\n", "").replace("M107", " ; M107"), True))
+        self.assertEqual(list(gcode.items)[-2:], [(GCodeFile.Comment, ";LAYER:0"), (GCodeFile.Comment, "; M107")])
+        self.assertEqual(len(gcode), 5)
+
+    def test_stream(self):
+        path = os.path.join(TestFiles, "tube_cura.gcode")
+        gcode = GCodeFile.from_file(path)
+        stream = GCodeStream.from_file(path)
+        self.assertEqual("".join(stream.text_chunks(1000)), gcode.text)
+        self.assertEqual(stream.header_text, gcode.header_text)
+        self.assertEqual(stream.lines, len(gcode))
@@ -0,0 +1,70 @@
+from unittest import TestCase
+from threedub.gcode import GCodeFile
+from threedub.optimize import GCodeOptimizer
+from threedub.rewrite import format_number
+
+class GCodeOptimizerTests(TestCase):
+    def optimize(self, text, tolerance=0.01):
+        self.optimizer = GCodeOptimizer(tolerance)
+        gcode = GCodeFile.from_string(text)
+        return [text for kind, text in self.optimizer.stage(gcode.items)]
+
+    def test_comments(self):
+        lines = self.optimize("; filename = a.gcode\n; print_time = 1\n\nM109 S195.000000 ; wait\n;LAYER:0\nG28\n")
+        self.assertEqual(lines, ["; filename = a.gcode", "; print_time = 1", "M109 S195", "G28"])
+
+    def test_repeated_words(self):
+        lines = self.optimize("\n".join([
+            "G1 F900 X0.000 Y0.000 Z0.300",
+            "G1 F900 Z0.300 X1.500 Y2.0",
+            "G1 F900 Z0.3",
+            "G1 F1200 X2 Y0 Z0.55",
+        ]))
+        self.assertEqual(lines, ["G1 F900 X0 Y0 Z0.3", "G1 X1.5 Y2", "G1 F1200 X2 Y0 Z0.55"])
+
+    def test_merge(self):
+        lines = self.optimize("\n".join([
+            "G92 E0",
+            "G1 F900 X0 Y0",
+            "G1 X1 Y1 E1",
+            "G1 X2 Y2.005 E2",
+            "G1 X3 Y3 E3",
+            "G1 X4 Y3 E4",
+        ]))
+        self.assertEqual(lines, ["G92 E0", "G1 F900 X0 Y0", "G1 X3 Y3 E3", "G1 X4 Y3 E4"])
+        self.assertEqual(self.optimizer.merged, 2)
+
+    def test_no_merge(self):
+        moves = [
+            "G1 X0 Y0 E0",
+            # Off the line
+            "G1 X1 Y1.1 E1",
+            "G1 X2 Y2 E2",
+            # Uneven extrusion
+            "G1 X3 Y3 E4",
+            "G1 X4 Y4 E5",
+            # Backwards
+            "G1 X3.5 Y3.5 E5.5",
+        ]
+        self.assertEqual(self.optimize("\n".join(moves)), moves)
+
+    def test_relative(self):
+        moves = ["G91", "G1 X1 Y1", "G1 X1 Y1", "G90", "M83", "G1 X3 Y3 E1", "G1 X4 Y4 E1"]
+        self.assertEqual(self.optimize("\n".join(moves)), moves)
+
+    def test_summary(self):
+        text = "; a\nG1 X0 Y0\nG1 X1 Y0\nG1 X2 Y0\n"
+        lines = self.optimize(text)
+        self.assertEqual(lines, ["; a", "G1 X0 Y0", "G1 X2 Y0"])
+        self.assertEqual(self.optimizer.bytes_in, len(text))
+        self.assertEqual(self.optimizer.bytes_out, len("\n".join(lines)) + 1)
+        self.assertEqual((self.optimizer.lines_in, self.optimizer.lines_out), (4, 3))
+
+    def test_unknown_codes(self):
+        moves = ["G92 E0", "G1 X0 Y0", "G2 X10 Y0 I5 J0", "G1 X5 Y0 E0.5", "G1 X20 Y0 E2"]
+        self.assertEqual(self.optimize("\n".join(moves)), moves)
+
+    def test_precision(self):
+        self.assertEqual(self.optimize("G1 X10.500 E0.12345678\nM104 S200.0"), ["G1 X10.5 E0.12345678", "M104 S200"])
+        self.assertEqual([format_number(v) for v in (0.1 + 0.2, 1e-7, -0.0, 1e16, 100.0)],
+                         ["0.3", "0.0000001", "0", "10000000000000000", "100"])
@@ -0,0 +1,140 @@
+import os
+import time
+import threading
+import shutil
+from tempfile import mkdtemp
+from unittest import TestCase
+from threedub.gcode import GCodeFile
+from threedub.davinci import ThreeWFile
+from threedub.printers import DaVinciJr10, SerialConnection, ChunkFramer, UploadError
+from threedub.simulator import SimulatedPrinter
+
+FilesDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "files")
+
+class PrinterTests(TestCase):
+    def setUp(self):
+        self.sim = SimulatedPrinter()
+        self.sim.start()
+        self.printer = DaVinciJr10(self.sim.device)
+        self.tmp = mkdtemp()
+
+    def tearDown(self):
+        self.sim.stop()
+        shutil.rmtree(self.tmp)
+
+    def test_status(self):
+        status = self.printer.status()
+        self.assertIn("Serial number: 3F10XPUS5TH1234", status)
+        self.assertIn("Printer status status: 9511", status)
+        self.assertIn("XYZv3/query=a", self.sim.commands)
+
+    def test_upload(self):
+        twfile = ThreeWFile(GCodeFile.from_file(os.path.join(FilesDir, "tube_cura.gcode")))
+        size, chunks = twfile.stream()
+        self.printer.print_stream("tube_cura.3w", size, chunks)
+        upload = self.sim.uploads[0]
+        self.assertEqual(upload.filename, "tube_cura.gcode")
+        self.assertEqual(upload.size, size)
+        self.assertEqual(bytes(upload.data), twfile.encrypt())
+        # The finish command has no response to wait for
+        deadline = time.time() + 2
+        while self.sim.commands[-1] != "XYZv3/uploadDidFinish" and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.sim.commands[-1], "XYZv3/uploadDidFinish")
+
+    def test_session(self):
+        with self.printer.session() as conn:
+            ser = conn.ser
+            self.printer.unlock_filament()
+            status = self.printer.status()
+            self.assertIs(self.printer.connect(), conn)
+            self.assertIs(conn.ser, ser)
+            self.assertTrue(ser.isOpen())
+        self.assertFalse(ser.isOpen())
+        self.assertIn("Serial number: 3F10XPUS5TH1234", status)
+        self.assertEqual(self.sim.config, ["pda:[1591]", "pdb:[4387]", "pdc:[7264]", "pde:[8046]"])
+
+    def test_reader(self):
+        lines = []
+        with SerialConnection(self.sim.device, lines.append) as conn:
+            start = time.time()
+            conn.writeline("XYZv3/query=i")
+            while (not lines or lines[-1] != "$\n") and time.time() < start + 2:
+                time.sleep(0.001)
+            elapsed = time.time() - start
+        self.assertEqual(lines, ["i:3F10XPUS5TH1234\n", "$\n"])
+        self.assertLess(elapsed, 0.1)
+
+    def test_chunk_retry(self):
+        data = os.urandom(5 * self.printer.BlockSize)
+        self.printer.ChunkTimeout = 0.1
+        self.printer.RetryBackoff = 0.01
+        self.sim.drop_acks = [2, 2, 4]
+        self.printer.print_data("retry.3w", data)
+        self.assertEqual(bytes(self.sim.uploads[0].data), data)
+        self.assertEqual(self.sim.drop_acks, [])
+
+    def test_resume(self):
+        data = os.urandom(5 * self.printer.BlockSize)
+        self.printer.ChunkTimeout = 0.1
+        self.printer.RetryBackoff = 0.01
+        self.printer.ChunkRetries = 1
+        self.sim.drop_acks = [3, 3]
+        chunks = lambda: (data[n:n + self.printer.BlockSize] for n in range(0, len(data), self.printer.BlockSize))
+        with self.assertRaises(UploadError) as cm:
+            self.printer.print_stream("resume.3w", len(data), chunks())
+        state = cm.exception.state
+        self.assertEqual(state.chunk, 3)
+        self.assertEqual(state.sent, 3 * self.printer.BlockSize)
+        self.printer.print_stream("resume.3w", len(data), chunks(), state=state)
+        self.assertTrue(state.finished)
+        self.assertEqual(len(self.sim.uploads), 1)
+        self.assertEqual(bytes(self.sim.uploads[0].data), data)
+
+    def test_producer_stopped(self):
+        data = os.urandom(8 * self.printer.BlockSize)
+        self.printer.ChunkTimeout = 0.1
+        self.printer.RetryBackoff = 0.01
+        self.printer.ChunkRetries = 0
+        self.printer.QueueSize = 1
+        self.sim.drop_acks = [1]
+        chunks = (data[n:n + self.printer.BlockSize] for n in range(0, len(data), self.printer.BlockSize))
+        with self.assertRaises(UploadError):
+            self.printer.print_stream("stop.3w", len(data), chunks)
+        self.assertNotIn("upload-producer", [t.name for t in threading.enumerate()])
+        # The producer closed the source when the upload stopped
+        with self.assertRaises(StopIteration):
+            next(chunks)
+
+    def test_upload_file(self):
+        path = os.path.join(self.tmp, "file.3w")
+        data = os.urandom(3 * self.printer.BlockSize + 100)
+        with open(path, "wb") as f:
+            f.write(data)
+        self.printer.print_data(path)
+        self.assertEqual(self.sim.uploads[0].filename, os.path.join(self.tmp, "file.gcode"))
+        self.assertEqual(bytes(self.sim.uploads[0].data), data)
+        self.assertEqual(self.sim.uploads[0].chunks, 4)
+
+    def test_stream_file_chunks(self):
+        path = os.path.join(self.tmp, "file.3w")
+        data = os.urandom(8 * self.printer.BlockSize + 100)
+        with open(path, "wb") as f:
+            f.write(data)
+        self.printer.print_stream("file.3w", len(data), self.printer.file_chunks(path))
+        self.assertEqual(bytes(self.sim.uploads[0].data), data)
+
+    def test_file_chunks_closed_early(self):
+        path = os.path.join(self.tmp, "file.3w")
+        with open(path, "wb") as f:
+            f.write(os.urandom(3 * self.printer.BlockSize))
+        chunks = self.printer.file_chunks(path)
+        next(chunks)
+        self.assertEqual(len(next(chunks)), self.printer.BlockSize)
+        # As when an upload fails partway
+        chunks.close()
+
+    def test_framer(self):
+        framer = ChunkFramer(8)
+        self.assertEqual(bytes(framer.frame(1, b"abcdefgh")), b"\0\0\0\x01\0\0\0\x08abcdefgh\0\0\0\0")
+        self.assertEqual(bytes(framer.frame(2, memoryview(b"xyz"))), b"\0\0\0\x02\0\0\0\x08xyz\0\0\0\0")
@@ -0,0 +1,82 @@
+from unittest import TestCase
+from threedub.gcode import GCodeFile
+from threedub.rewrite import Rule, RuleSet
+from threedub.models import DaVinciJr10
+
+class RuleSetTests(TestCase):
+    Sample = "\n".join([
+        "; G0 X1 F9000",
+        "M140 S90 ; Bed",
+        "M104 S250",
+        "M109 S180",
+        "G0 F9000 X1 Y2",
+        "G1 X2 F600 ; F9000",
+        "G28 X0",
+        "",
+    ])
+
+    def setUp(self):
+        self.rules = RuleSet([
+            Rule.replace_code("G0", "G1"),
+            Rule.strip_codes(["M140", "M190"]),
+            Rule.clamp(["M104", "M109"], "S", 190, 210),
+            Rule.clamp(["G0", "G1"], "F", high=3000.0),
+        ])
+
+    def test_apply(self):
+        self.assertEqual(self.rules.apply(self.Sample), "\n".join([
+            "; G0 X1 F9000",
+            "M104 S210",
+            "M109 S190",
+            "G1 F3000 X1 Y2",
+            "G1 X2 F600 ; F9000",
+            "G28 X0",
+            "",
+        ]))
+
+    def test_stage(self):
+        gcode = GCodeFile.from_string(self.Sample)
+        self.rules.LineBatch = 2
+        items = list(self.rules.stage(gcode.items))
+        self.assertEqual(items[0], (GCodeFile.Comment, "; G0 X1 F9000"))
+        self.assertEqual(items[3], (GCodeFile.Statement, "G1 F3000 X1 Y2"))
+        self.assertEqual(len(items), 6)
+
+    def test_stage_keeps_lines(self):
+        items = list(GCodeFile.from_string(self.Sample).items)
+        output = list(self.rules.stage(items))
+        self.assertIs(output[0], items[0])
+        self.assertIs(output[-1], items[-1])
+        rules = RuleSet([Rule(r"^M104[^\n]*\n", "M104"), Rule(r"^(?=G28)", "; home\n")])
+        self.assertEqual(list(rules.stage(items)), list(GCodeFile.classify(rules.apply(self.Sample).split("\n")[:-1])))
+
+    def test_file(self):
+        gcode = GCodeFile.from_string(self.Sample)
+        gcode.rewrite(self.rules.rewrite)
+        self.assertEqual(list(gcode.items), list(self.rules.stage(GCodeFile.from_string(self.Sample).items)))
+        gcode = GCodeFile.from_string(self.Sample)
+        gcode.rewrite(RuleSet([Rule.replace_code("G0", "G1")]).rewrite)
+        self.assertEqual(gcode.line_text(4), "G1 F9000 X1 Y2")
+
+    def test_line_start(self):
+        self.assertTrue(RuleSet([Rule.replace_code("G0", "G1"), Rule.strip_codes(["M140"])]).line_start)
+        self.assertFalse(RuleSet([Rule.replace_code("G0", "G1"), Rule.clamp(["G1"], "F", high=3000.0)]).line_start)
+        self.assertFalse(Rule(r"^G0|G1", "").line_start)
+        self.assertTrue(Rule(r"^(?:G0|G1)[|]", "").line_start)
+
+    def test_clamps_on_same_word(self):
+        rules = RuleSet([
+            Rule.clamp(["M104", "M109"], "S", 190, 210),
+            Rule.clamp(["M140", "M190"], "S", high=60),
+        ])
+        self.assertEqual(rules.apply("M104 S250\nM140 S90 ; bed\nM190 S50\nM109 S100\n"),
+                         "M104 S210\nM140 S60 ; bed\nM190 S50\nM109 S190\n")
+
+    def test_empty(self):
+        items = [(GCodeFile.Statement, "G0 X1")]
+        self.assertEqual(list(RuleSet([]).stage(items)), items)
+
+    def test_model_rules(self):
+        gcode = GCodeFile.from_string("G0 X1\nG00 X1\nG1 X2\n")
+        items = list(DaVinciJr10().translate_gcode(gcode.items, {}))
+        self.assertEqual([text for kind, text in items], ["G1 X1", "G00 X1", "G1 X2"])
@@ -0,0 +1,104 @@
+import io
+import os
+import json
+import time
+import shutil
+import tracemalloc
+from unittest import TestCase
+from tempfile import mkdtemp
+from contextlib import redirect_stderr
+from threedub.timings import Timings
+from threedub.main import threedub
+
+FilesDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "files")
+
+class TimingsTests(TestCase):
+    def setUp(self):
+        self.tmp = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        tracemalloc.stop()
+
+    def test_stages(self):
+        timings = Timings(memory=True)
+        with timings.stage("build", lines=1000) as stage:
+            data = [str(n) for n in range(1000)]
+            stage.bytes = sum(len(s) for s in data)
+        self.assertEqual([s.name for s in timings.stages], ["build"])
+        self.assertGreater(timings.stages[0].wall, 0)
+        self.assertGreater(timings.stages[0].peak_memory, 0)
+        self.assertEqual(timings.stages[0].bytes, 2890)
+
+    def test_nested_peak(self):
+        timings = Timings(memory=True)
+        with timings.stage("outer"):
+            data = bytearray(1024 * 1024)
+            del data
+            with timings.stage("inner"):
+                pass
+        stages = dict((s.name, s) for s in timings.stages)
+        self.assertGreaterEqual(stages["outer"].peak_memory, 1024 * 1024)
+        self.assertLess(stages["inner"].peak_memory, 1024 * 1024)
+
+    def test_memory_optional(self):
+        timings = Timings()
+        with timings.stage("build"):
+            pass
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertIsNone(timings.stages[0].peak_memory)
+
+    def test_timed(self):
+        timings = Timings()
+        def produce():
+            for n in range(3):
+                time.sleep(0.01)
+                yield n
+        items = timings.timed("double", (n * 2 for n in timings.timed("produce", produce())))
+        with timings.stage("consume"):
+            self.assertEqual(list(items), [0, 2, 4])
+        stages = dict((s.name, s) for s in timings.stages)
+        self.assertEqual([s.name for s in timings.stages], ["produce", "double", "consume"])
+        self.assertEqual(stages["produce"].lines, 3)
+        self.assertGreaterEqual(stages["produce"].wall, 0.03)
+        # The sleeps only count in the step that makes them
+        self.assertLess(stages["double"].wall, 0.01)
+        self.assertLess(stages["consume"].wall, 0.01)
+
+    def test_disabled(self):
+        timings = Timings(enabled=False)
+        with timings.stage("build"):
+            pass
+        self.assertEqual(timings.stages, [])
+
+    def test_cli(self):
+        outfile = os.path.join(self.tmp, "tube_cura.3w")
+        report = os.path.join(self.tmp, "timings.json")
+        start = time.perf_counter()
+        threedub([os.path.join(FilesDir, "tube_cura.gcode"), outfile, "--timings-json", report])
+        elapsed = time.perf_counter() - start
+        with open(report) as f:
+            data = json.load(f)
+        stages = dict((stage["name"], stage) for stage in data["stages"])
+        self.assertEqual([stage["name"] for stage in data["stages"]],
+                         ["detect", "analyze", "read", "translate_headers", "translate_gcode", "format", "encrypt", "write"])
+        self.assertEqual(stages["write"]["bytes"], os.path.getsize(outfile))
+        self.assertEqual(stages["encrypt"]["bytes"], os.path.getsize(outfile) - 0x2000)
+        self.assertGreater(stages["read"]["lines"], 6000)
+        # Each step is counted once
+        self.assertLess(data["wall"], elapsed)
+        self.assertEqual(stages["analyze"]["bytes"], os.path.getsize(os.path.join(FilesDir, "tube_cura.gcode")))
+
+    def test_cli_flag_before_input(self):
+        infile = os.path.join(self.tmp, "tube_cura.gcode")
+        outfile = os.path.join(self.tmp, "out.3w")
+        shutil.copy(os.path.join(FilesDir, "tube_cura.gcode"), infile)
+        with open(infile, "rb") as f:
+            original = f.read()
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            threedub(["--timings", infile, outfile])
+        with open(infile, "rb") as f:
+            self.assertEqual(f.read(), original)
+        self.assertTrue(os.path.exists(outfile))
+        self.assertIn("total", stderr.getvalue())
@@ -0,0 +1,273 @@
+import logging
+
+# Imported on first use by load_numpy; it's slow to import
+numpy = None
+
+log = logging.getLogger(__name__)
+
+
+def load_numpy():
+    """
+    Import numpy, or return None if it isn't installed.
+    """
+    global numpy
+    if numpy is None:
+        try:
+            import numpy as module
+        except ImportError:
+            return None
+        numpy = module
+    return numpy
+
+
+class ToolpathAnalyzer(object):
+    """
+    Estimate print dimensions, layers, filament and time from the
+    G0/G1 moves of a file.
+
+    Text is fed in pieces of whole lines. Each piece is scanned as
+    bytes in one pass of numpy operations, which pick out the
+    command of each line and the value of each X, Y, Z, E and F
+    word into float arrays, without a Python loop over lines or
+    words. Only running totals are kept between pieces. Requires
+    numpy.
+    """
+    Axes = "XYZEF"
+    # Header values the analysis provides
+    Fields = ("print_time", "total_layers", "total_filament", "dimension")
+    # Commands read from the start of lines; other lines are ignored
+    Move = 1
+    SetPosition = 2
+    AbsoluteE = 3
+    RelativeE = 4
+    # Byte classes; those from Space on end a word
+    Other, Letter, Digit, Space, Comment, LineEnd = range(6)
+    # Longest word value read, in characters; longer ones are unset
+    MaxNumber = 32
+    # Feed rate assumed until the file sets one, in mm/min
+    DefaultFeed = 3000.0
+
+    def __init__(self):
+        if load_numpy() is None:
+            raise ImportError("Toolpath analysis requires numpy")
+        # X, Y, Z, E, F at the end of the previous piece
+        self.position = numpy.array([0.0, 0.0, 0.0, 0.0, self.DefaultFeed])
+        self.relative_e = False
+        self.low = numpy.full(3, numpy.inf)
+        self.high = numpy.full(3, -numpy.inf)
+        self.layers = set()
+        self.filament = 0.0
+        self.seconds = 0.0
+        self.moves = 0
+
+        self.classes = numpy.zeros(256, numpy.uint8)
+        self.axis = numpy.zeros(256, numpy.intp)
+        for n, letter in enumerate(self.Axes.encode()):
+            self.classes[letter] = self.Letter
+            self.axis[letter] = n
+        for char in b"0123456789.":
+            self.classes[char] = self.Digit
+        for char in b" \t\r":
+            self.classes[char] = self.Space
+        self.classes[ord(";")] = self.Comment
+        self.classes[ord("\n")] = self.LineEnd
+        self.class_table = self.classes.tobytes()
+
+    def parse(self, data):
+        """
+        Return the command of each line of data that has one, and an
+        array of its X, Y, Z, E and F values, NaN where the line
+        doesn't set them or the value is malformed.
+        """
+        size = len(data) + 1
+        # Padded so that reads past the end stop on newlines
+        data += b"\n" * (self.MaxNumber + 4)
+        b = numpy.frombuffer(data, dtype=numpy.uint8)
+        classes = numpy.frombuffer(data.translate(self.class_table), dtype=numpy.uint8)
+        ends = numpy.flatnonzero(classes[:size] == self.LineEnd)
+        starts = numpy.concatenate(([0], ends[:-1] + 1))
+        indented = classes[starts] == self.Space
+        while indented.any():
+            starts[indented] += 1
+            indented = classes[starts] == self.Space
+
+        # G0, G1, G00, G01, G92, M82 and M83, not followed by a digit
+        c0, c1, c2, c3 = [b[starts + n] for n in range(4)]
+        ends2 = classes[starts + 2] != self.Digit
+        ends3 = classes[starts + 3] != self.Digit
+        g = c0 == ord("G")
+        g0 = g & (c1 == ord("0"))
+        m8 = (c0 == ord("M")) & (c1 == ord("8")) & ends3
+        commands = numpy.select([
+            (g0 & ends2) | (g & (c1 == ord("1")) & ends2) | (g0 & ((c2 == ord("0")) | (c2 == ord("1"))) & ends3),
+            g & (c1 == ord("9")) & (c2 == ord("2")) & ends3,
+            m8 & (c2 == ord("2")),
+            m8 & (c2 == ord("3")),
+        ], [self.Move, self.SetPosition, self.AbsoluteE, self.RelativeE], 0)
+
+        # Words: an axis letter after a space, on a line with a
+        # command, before any comment
+        words = numpy.flatnonzero(classes == self.Letter)
+        words = words[classes[words - 1] == self.Space]
+        rows = numpy.searchsorted(ends, words)
+        keep = commands[rows] != 0
+        comments = numpy.flatnonzero(classes == self.Comment)
+        if len(comments):
+            before = numpy.searchsorted(comments, words) - 1
+            keep &= (before < 0) | (comments[before] < starts[rows])
+        words, rows = words[keep], rows[keep]
+
+        has_command = commands != 0
+        raw = numpy.full((int(has_command.sum()), len(self.Axes)), numpy.nan)
+        if len(words):
+            index = numpy.cumsum(has_command) - 1
+            raw[index[rows], self.axis[b[words]]] = self.numbers(b, classes, words + 1)
+        return commands[has_command], raw
+
+    def numbers(self, b, classes, begins):
+        """
+        Return the values of the numbers starting at begins in the
+        bytes b, NaN for malformed ones such as "." or "1.2.3".
+        """
+        stops = numpy.flatnonzero(classes >= self.Space)
+        lengths = stops[numpy.searchsorted(stops, begins)] - begins
+        width = max(min(int(lengths.max()), self.MaxNumber), 1)
+        chars = numpy.lib.stride_tricks.sliding_window_view(b, width)[begins]
+        chars[numpy.arange(width) >= lengths[:, None]] = 0
+        texts = chars.view("S{}".format(width)).ravel()
+        ok = (lengths > 0) & (lengths <= self.MaxNumber)
+        try:
+            values = texts.astype(float)
+            values[~ok] = numpy.nan
+            return values
+        except ValueError:
+            pass
+        # Only digits and one point, after an optional sign
+        digits = (chars >= ord("0")) & (chars <= ord("9"))
+        signs = (chars == ord("+")) | (chars == ord("-"))
+        ok &= ((digits | signs | (chars == ord(".")) | (chars == 0)).all(axis=1)
+               & ~signs[:, 1:].any(axis=1) & digits.any(axis=1)
+               & ((chars == ord(".")).sum(axis=1) <= 1))
+        values = numpy.full(len(texts), numpy.nan)
+        values[ok] = texts[ok].astype(float)
+        return values
+
+    def feed(self, text):
+        """
+        Analyze a piece of text or bytes made of whole lines.
+        """
+        if isinstance(text, str):
+            text = text.encode("utf-8")
+        commands, raw = self.parse(text)
+        nrows = len(commands)
+        if not nrows:
+            return
+
+        # Extrusion mode in effect for each row
+        mode = numpy.where(commands == self.RelativeE, 1.0,
+                           numpy.where(commands == self.AbsoluteE, 0.0, numpy.nan))
+        relative = self._fill(mode, float(self.relative_e)).astype(bool)
+        is_move = commands == self.Move
+
+        # Modal positions, starting from the end of the previous piece
+        pos = numpy.empty((nrows + 1, len(self.Axes)))
+        pos[0] = self.position
+        pos[1:] = raw
+        for n in range(len(self.Axes)):
+            pos[:, n] = self._fill(pos[:, n], pos[0, n])
+
+        delta = numpy.diff(pos[:, :4], axis=0)
+        extrude = numpy.where(relative, numpy.nan_to_num(raw[:, 3]), delta[:, 3])
+        extrude[~is_move] = 0.0
+        distance = numpy.sqrt((delta[:, :3]**2).sum(axis=1))
+        distance[~is_move] = 0.0
+        # Moves that only extrude or retract still take time
+        travel = numpy.where(distance > 0, distance, numpy.abs(extrude))
+        feed = pos[1:, 4]
+        feed[feed <= 0] = self.DefaultFeed
+        self.seconds += float((travel / (feed / 60.0)).sum())
+        self.filament += float(extrude.sum())
+
+        printing = is_move & (extrude > 0) & (distance > 0)
+        if printing.any():
+            ends = pos[1:, :3][printing]
+            starts = pos[:-1, :3][printing]
+            self.low = numpy.minimum(self.low, numpy.minimum(ends.min(axis=0), starts.min(axis=0)))
+            self.high = numpy.maximum(self.high, numpy.maximum(ends.max(axis=0), starts.max(axis=0)))
+            self.layers.update(numpy.unique(numpy.round(ends[:, 2], 3)).tolist())
+
+        self.position = pos[-1]
+        self.relative_e = bool(relative[-1])
+        self.moves += int(is_move.sum())
+
+    @staticmethod
+    def _fill(values, first):
+        """
+        Forward-fill NaN values, using first before any value is set.
+        """
+        values = values.copy()
+        if numpy.isnan(values[0]):
+            values[0] = first
+        valid = numpy.where(~numpy.isnan(values), numpy.arange(len(values)), 0)
+        numpy.maximum.accumulate(valid, out=valid)
+        return values[valid]
+
+    def metadata(self):
+        """
+        Return header values for a model translator.
+        """
+        if not self.layers:
+            return {}
+        size = self.high - self.low
+        return {
+            "print_time": int(round(self.seconds)),
+            "total_layers": len(self.layers),
+            "total_filament": "{:.1f}".format(self.filament),
+            "dimension": "{:.2f}:{:.2f}:{:.2f}".format(*size),
+        }
+
+
+def analyze(gcode):
+    """
+    Return the toolpath header values of a GCodeFile, or an empty
+    dict if numpy isn't available.
+    """
+    return analyze_pieces(gcode.line_chunks())
+
+
+def line_pieces(chunks, size=0x100000):
+    """
+    Regroup bytes split anywhere, such as the blocks of a file, into
+    pieces of whole lines of at least size bytes, but for the last.
+    """
+    parts = []
+    length = 0
+    for chunk in chunks:
+        parts.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            data = b"".join(parts)
+            cut = data.rfind(b"\n") + 1
+            if cut:
+                yield data[:cut]
+                data = data[cut:]
+            parts = [data]
+            length = len(data)
+    data = b"".join(parts)
+    if data:
+        yield data
+
+
+def analyze_pieces(pieces):
+    """
+    Return the toolpath header values of an iterable of pieces of
+    whole lines, as text or bytes, or an empty dict if numpy isn't
+    available.
+    """
+    if load_numpy() is None:
+        log.debug("numpy not installed; skipping toolpath analysis")
+        return {}
+    analyzer = ToolpathAnalyzer()
+    for piece in pieces:
+        analyzer.feed(piece)
+    return analyzer.metadata()
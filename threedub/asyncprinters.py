@@ -0,0 +1,261 @@
+import os
+import asyncio
+import logging
+from .printers import DaVinciJr10, SerialConnection, ChunkFramer, PrinterError, XYZStatus
+
+log = logging.getLogger(__name__)
+
+
+class AsyncSerialConnection(object):
+    """
+    Non-blocking serial transport for asyncio.
+
+    The port is opened and configured like SerialConnection, then
+    read and written through the event loop with add_reader and
+    add_writer, so no thread is tied up waiting on the device.
+    POSIX only: the Windows proactor loop can't watch serial ports.
+    """
+    # Seconds to wait for a line, like the serial read timeout
+    Timeout = 2
+    # Seconds of silence that end a drain after opening
+    DrainQuiet = SerialConnection.DrainQuiet
+
+    def __init__(self, device):
+        self.device = device
+        self.ser = None
+        self._fd = None
+        self._buf = bytearray()
+        self._data = asyncio.Event()
+        # Set once the device can no longer be read
+        self._error = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc, msg, tb):
+        if exc:
+            log.error("Exiting with exception: {} {}".format(exc, msg))
+        self.close()
+
+    async def open(self):
+        conn = SerialConnection(self.device)
+        conn.open()
+        self.ser = conn.ser
+        self._fd = self.ser.fileno()
+        os.set_blocking(self._fd, False)
+        asyncio.get_running_loop().add_reader(self._fd, self._readable)
+        await self.drain()
+
+    def close(self):
+        log.debug("Close called")
+        if self._fd is not None:
+            asyncio.get_running_loop().remove_reader(self._fd)
+            self._fd = None
+        if self.ser and self.ser.isOpen():
+            self.ser.close()
+
+    def _readable(self):
+        try:
+            data = os.read(self._fd, 0x10000)
+        except BlockingIOError:
+            return
+        except OSError:
+            log.exception("Failed to read from serial device")
+            self._fail("Failed to read from {}".format(self.device))
+            return
+        if not data:
+            # The device went away; it would stay readable forever
+            self._fail("{} was closed".format(self.device))
+            return
+        self._buf += data
+        self._data.set()
+
+    def _fail(self, message):
+        """
+        Stop reading, and make pending and later reads raise
+        PrinterError once the data already read is used up.
+        """
+        asyncio.get_running_loop().remove_reader(self._fd)
+        self._error = PrinterError(message)
+        self._data.set()
+
+    async def drain(self, quiet=DrainQuiet):
+        """
+        Discard input until nothing has arrived for quiet seconds.
+        """
+        log.debug("Drain...")
+        while True:
+            del self._buf[:]
+            if self._error:
+                raise self._error
+            self._data.clear()
+            try:
+                await asyncio.wait_for(self._data.wait(), quiet)
+            except asyncio.TimeoutError:
+                return
+
+    async def write(self, data):
+        log.debug(">>> {} bytes".format(len(data)))
+        if isinstance(data, str):
+            data = data.encode("ascii")
+        view = memoryview(data)
+        loop = asyncio.get_running_loop()
+        while view:
+            try:
+                view = view[os.write(self._fd, view):]
+            except BlockingIOError:
+                pass
+            if view:
+                writable = loop.create_future()
+                loop.add_writer(self._fd, writable.set_result, None)
+                try:
+                    await writable
+                finally:
+                    loop.remove_writer(self._fd)
+
+    async def writeline(self, data):
+        await self.write(data+"\n")
+
+    async def readline(self, timeout=Timeout):
+        """
+        Return the next line, or what arrived so far if no line
+        ending came within timeout seconds.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        pos = self._buf.find(b"\n")
+        while pos < 0:
+            if self._error:
+                raise self._error
+            self._data.clear()
+            try:
+                await asyncio.wait_for(self._data.wait(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                pos = len(self._buf) - 1
+                break
+            pos = self._buf.find(b"\n")
+        line = self._buf[:pos+1].decode("utf-8", "replace")
+        del self._buf[:pos+1]
+        return line
+
+    async def readlines(self, expect=None):
+        buf = ""
+        line = None
+        while line is None or line:
+            line = await self.readline()
+            log.debug("read line {!r}...".format(line))
+            if line:
+                buf += line
+                if line.strip() == expect:
+                    log.debug("Token found")
+                    break
+                elif line.strip() == "E0":
+                    return buf
+        return buf
+
+    async def wait_for_ok(self, expect="ok"):
+        log.debug("waiting for ok")
+        resp = await self.readlines(expect=expect)
+        if not resp or resp.strip() != "ok":
+            raise PrinterError("Expected token not found: {}".format(expect))
+
+
+class AsyncDaVinciJr10(object):
+    """
+    asyncio interface to a Da Vinci Jr. 1.0
+
+    Uses the command set of DaVinciJr10 over one AsyncSerialConnection,
+    opened with "async with". Commands from concurrent tasks take
+    turns on the connection; each printer has its own, so one event
+    loop can drive several printers at once.
+    """
+    def __init__(self, device="/dev/ttyACM0"):
+        self.device = device
+        self.printer = DaVinciJr10(device)
+        self.conn = None
+        self.lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc, msg, tb):
+        self.close()
+
+    async def connect(self):
+        if not self.conn:
+            conn = AsyncSerialConnection(self.device)
+            await conn.open()
+            self.conn = conn
+        return self.conn
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    async def query_cmd(self, code, expect=None):
+        async with self.lock:
+            await self.conn.writeline(self.printer.QueryCmd.format(code))
+            return await self.conn.readlines(expect=expect)
+
+    async def config_cmd(self, value):
+        async with self.lock:
+            await self.conn.writeline(self.printer.ConfigCmd.format(value))
+            return await self.conn.readlines(expect="ok")
+
+    async def action_cmd(self, action):
+        async with self.lock:
+            await self.conn.writeline(self.printer.ActionCmd.format(action))
+
+    async def status(self, raw=False):
+        status = await self.query_cmd("a", expect="$")
+        return self.printer.parse_status(status, raw)
+
+    async def status_events(self, interval=1.0, code="a"):
+        """
+        Query the printer every interval seconds and yield each
+        response as a parsed XYZStatus.
+        """
+        while True:
+            status = XYZStatus()
+            status.parse(await self.query_cmd(code, expect="$"))
+            yield status
+            await asyncio.sleep(interval)
+
+    async def unlock_filament(self):
+        for value in ("pda:[1591]", "pdb:[4387]", "pdc:[7264]", "pde:[8046]"):
+            await self.config_cmd(value)
+
+    async def print_data(self, filename, data=None, savetosd=False):
+        """
+        Print the given data or file.
+        """
+        if not data and os.path.exists(filename):
+            size = os.path.getsize(filename)
+            chunks = self.printer.file_chunks(filename)
+        else:
+            size = len(data)
+            view = memoryview(data)
+            blocksize = self.printer.BlockSize
+            chunks = (view[start:start+blocksize] for start in range(0, size, blocksize))
+        await self.print_stream(filename, size, chunks, savetosd)
+
+    async def print_stream(self, filename, size, chunks, savetosd=False):
+        """
+        Print size bytes of data produced by the iterable chunks,
+        such as the generator from ThreeWFile.stream.
+        """
+        cmd = self.printer.upload_cmd(filename, size, savetosd)[0]
+        framer = ChunkFramer(self.printer.BlockSize)
+        async with self.lock:
+            await self.conn.writeline(cmd)
+            await self.conn.wait_for_ok()
+            for n, chunk in enumerate(chunks):
+                log.debug("Sending file chunk {}".format(n))
+                await self.conn.write(framer.frame(n, chunk))
+                # Expect "ok\n"
+                await self.conn.wait_for_ok()
+            # Send finish; expect no response
+            await self.conn.write(self.printer.UploadDidFinishCmd)
@@ -1,26 +1,74 @@
-class ModelTranslator(object):
-    model = ""
-    description = ""
+import importlib
+from contextlib import contextmanager
+
+
+class Plugin(object):
+    """
+    Base for the extension points below. Their direct subclasses
+    register themselves when defined, and implementations() imports
+    plugin_module first, so the module is only loaded when needed.
+    """
+    plugin_module = None
+    _registry = None
+
+    def __init_subclass__(cls, **kwargs):
+        super(Plugin, cls).__init_subclass__(**kwargs)
+        if Plugin in cls.__bases__:
+            cls._registry = []
+            return
+        for base in cls.__bases__:
+            registry = vars(base).get("_registry")
+            if registry is not None:
+                registry.append(cls)
 
     @classmethod
     def implementations(cls):
-        return [c for c in cls.__subclasses__() if c is not cls]
+        if cls.plugin_module:
+            importlib.import_module(cls.plugin_module, __package__)
+        return list(vars(cls).get("_registry") or [])
+
+
+class ModelTranslator(Plugin):
+    plugin_module = ".models"
+    model = ""
+    description = ""
+
+    def stages(self):
+        """
+        Return the translation stages, in order. Each is called
+        with an iterable of (kind, text) lines and the header
+        values, and returns an iterable of translated lines.
+        """
+        return []
+
+    def translate_lines(self, lines, data):
+        """
+        Chain the stages over lines, one line at a time.
+        """
+        for stage in self.stages():
+            lines = stage(lines, data)
+        return lines
 
     def translate(self, gcode, data):
-        pass
+        gcode.items = self.translate_lines(gcode.items, data)
 
 
-class Slicer(object):
+class Slicer(Plugin):
+    plugin_module = ".slicers"
     name = ""
     description = ""
-
-    @classmethod
-    def implementations(cls):
-        return [c for c in cls.__subclasses__() if c is not cls]
+    separator = "="
 
     def detect(self, gcode):
         return True
 
+    def header_values(self, gcode):
+        """
+        Return all header values that could
+        be extracted from the file.
+        """
+        return gcode.header_values(self.separator)
+
     def metadata(self, gcode):
         """
         Return all translated header values that could
@@ -28,10 +76,10 @@ class Slicer(object):
         """
         pass
 
-class PrinterInterface(object):
-    @classmethod
-    def implementations(cls):
-        return [c for c in cls.__subclasses__() if c is not cls]
+class PrinterInterface(Plugin):
+    plugin_module = ".printers"
+    # Bytes of data per upload chunk
+    BlockSize = 8192
 
     @classmethod
     def model_handler(cls, model):
@@ -40,6 +88,14 @@ class PrinterInterface(object):
                 return subcls
         return None
 
+    @contextmanager
+    def session(self):
+        """
+        Share one printer connection between the commands
+        in the with block
+        """
+        yield None
+
     def status(cls):
         """
         Get printer status
@@ -59,3 +115,8 @@ class PrinterInterface(object):
         """
         pass
 
+    def print_stream(self, filename, size, chunks):
+        """
+        Print size bytes of data produced by the iterable chunks
+        """
+        self.print_data(filename, b"".join(chunks))
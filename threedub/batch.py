@@ -0,0 +1,130 @@
+import logging
+import os
+import glob
+import time
+from collections import namedtuple, Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .filepath import FilePath
+
+log = logging.getLogger(__name__)
+
+BatchResult = namedtuple("BatchResult", ["infile", "outfile", "error", "size", "seconds"])
+
+
+def expand_inputs(paths):
+    """
+    Expand files, directories and glob patterns into a sorted list
+    of gcode and 3w files. Directories are searched recursively.
+    """
+    found = set()
+    for path in paths:
+        matches = glob.glob(path, recursive=True) if glob.has_magic(path) else [path]
+        for match in matches:
+            if os.path.isdir(match):
+                for root, dirs, files in os.walk(match):
+                    for name in files:
+                        if os.path.splitext(name)[1] in FilePath.Types:
+                            found.add(os.path.join(root, name))
+            elif os.path.isfile(match):
+                found.add(match)
+            else:
+                log.warning("No input files found for '{}'".format(match))
+    return sorted(found)
+
+
+def output_path(name, outdir, output_format):
+    outpath = FilePath(os.path.join(outdir, name))
+    outpath.file_type = output_format or FilePath.XYZ3wFile
+    return outpath.path
+
+
+def output_paths(infiles, outdir, output_format):
+    """
+    Return the output path for each input file. Inputs are placed
+    in outdir by name, or under their directories relative to the
+    inputs' common directory when two of them share a name.
+    """
+    outfiles = [output_path(os.path.basename(infile), outdir, output_format) for infile in infiles]
+    if len(set(outfiles)) < len(outfiles):
+        common = os.path.commonpath([os.path.dirname(os.path.abspath(infile)) for infile in infiles])
+        outfiles = [output_path(os.path.relpath(os.path.abspath(infile), common), outdir, output_format)
+                    for infile in infiles]
+    return outfiles
+
+
+def convert_file(infile, outfile, options):
+    """
+    Convert one file as the threedub command would with the given
+    extra options. Runs in a worker process.
+    """
+    from .main import build_argparse, convert, open_cache, make_optimizer
+    start = time.time()
+    try:
+        if os.path.abspath(infile) == os.path.abspath(outfile):
+            raise ValueError("Output file would overwrite input file")
+        args = build_argparse().parse_args(options + [infile, outfile])
+        convert(args, open_cache(args), optimizer=make_optimizer(args))
+        error = None
+    except Exception as e:
+        log.debug("Converting {} failed".format(infile), exc_info=True)
+        error = str(e) or e.__class__.__name__
+    return BatchResult(infile, outfile, error, os.path.getsize(infile), time.time() - start)
+
+
+def run_batch(paths, outdir=".", jobs=None, output_format=None, options=None):
+    """
+    Convert many files in a pool of worker processes, printing
+    each result as it finishes and a throughput summary.
+    Returns the list of BatchResults.
+    """
+    options = list(options or [])
+    if output_format:
+        options += ["-f", output_format]
+    infiles = expand_inputs(paths)
+    if outdir and not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    outfiles = output_paths(infiles, outdir, output_format)
+    # Inputs differing only in type, such as part.gcode and part.3w
+    clashes = [outfile for outfile, count in Counter(outfiles).items() if count > 1]
+    work = []
+    results = []
+    for infile, outfile in zip(infiles, outfiles):
+        if outfile in clashes:
+            error = "Output file {} would be written for several inputs".format(outfile)
+            results.append(BatchResult(infile, outfile, error, os.path.getsize(infile), 0.0))
+            report(results[-1])
+            continue
+        if not os.path.isdir(os.path.dirname(outfile) or "."):
+            os.makedirs(os.path.dirname(outfile))
+        work.append((infile, outfile, options))
+    log.debug("Converting {} files with {} workers".format(len(work), jobs or os.cpu_count()))
+
+    start = time.time()
+    if jobs == 1:
+        for item in work:
+            results.append(convert_file(*item))
+            report(results[-1])
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(convert_file, *item) for item in work]
+            for future in as_completed(futures):
+                results.append(future.result())
+                report(results[-1])
+    summary(results, time.time() - start)
+    return results
+
+
+def report(result):
+    if result.error:
+        print("FAILED {} ({})".format(result.infile, result.error))
+    else:
+        print("ok     {} -> {} ({:.1f} KB in {:.2f}s)".format(
+            result.infile, result.outfile, result.size / 1024.0, result.seconds))
+
+
+def summary(results, elapsed):
+    failed = len([r for r in results if r.error])
+    total = sum(r.size for r in results if not r.error) / (1024.0 * 1024.0)
+    elapsed = max(elapsed, 1e-6)
+    print("{} files converted, {} failed, {:.1f} MB in {:.2f}s ({:.1f} files/s, {:.1f} MB/s)".format(
+        len(results) - failed, failed, total, elapsed, len(results) / elapsed, total / elapsed))
@@ -0,0 +1,150 @@
+import logging
+import os
+import shutil
+import hashlib
+import tempfile
+
+log = logging.getLogger(__name__)
+
+
+class ConversionCache(object):
+    """
+    On-disk store of converted files, keyed by a hash of the input
+    file and the conversion settings.
+
+    Entries are evicted least recently used first once the cache is
+    larger than max_size bytes. Hit and miss counts are kept in the
+    cache directory as one byte per lookup, appended with O_APPEND so
+    processes sharing the cache don't lose each other's counts.
+    """
+    # Bump when conversion output changes for the same input
+    FormatVersion = 1
+    DefaultMaxSize = 1024 * 1024 * 1024
+    StatsFile = "lookups"
+    Hit = b"h"
+    Miss = b"m"
+
+    def __init__(self, directory, max_size=DefaultMaxSize):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @classmethod
+    def key(cls, inpath, model, slicer, outname, options=()):
+        """
+        Return the cache key for converting inpath to outname,
+        with any other options changing the output.
+        """
+        digest = hashlib.sha256()
+        with open(inpath, 'rb') as f:
+            for block in iter(lambda: f.read(0x100000), b""):
+                digest.update(block)
+        settings = [str(cls.FormatVersion), model, getattr(slicer, "name", slicer), outname] + list(options)
+        digest.update("\0".join(settings).encode("utf-8"))
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def fetch(self, key, dest):
+        """
+        Copy the cached output for key to dest. Returns False
+        if there is no entry.
+        """
+        entry = self.entry_path(key)
+        try:
+            shutil.copyfile(entry, dest)
+        except FileNotFoundError:
+            self._record(hit=False)
+            return False
+        # Mark as recently used
+        os.utime(entry, None)
+        self._record(hit=True)
+        return True
+
+    def store(self, key, src):
+        """
+        Add the file src to the cache as the output for key.
+        """
+        entry = self.entry_path(key)
+        if not os.path.isdir(os.path.dirname(entry)):
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(entry))
+        os.close(fd)
+        try:
+            shutil.copyfile(src, tmp)
+            os.replace(tmp, entry)
+        except Exception:
+            os.unlink(tmp)
+            raise
+        self.evict()
+
+    def entries(self):
+        """
+        Return (mtime, size, path) for each entry, oldest first.
+        """
+        found = []
+        for sub in os.scandir(self.directory):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.startswith("tmp"):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    # Evicted by another process meanwhile
+                    continue
+                found.append((st.st_mtime, st.st_size, entry.path))
+        return sorted(found)
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            log.debug("Evicting cache entry {}".format(path))
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for mtime, size, path in self.entries():
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def _record(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        path = os.path.join(self.directory, self.StatsFile)
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, self.Hit if hit else self.Miss)
+        finally:
+            os.close(fd)
+
+    def stats(self):
+        """
+        Return the total hits and misses recorded in the
+        cache directory, and its entry count and size.
+        """
+        try:
+            with open(os.path.join(self.directory, self.StatsFile), 'rb') as f:
+                lookups = f.read()
+        except IOError:
+            lookups = b""
+        stats = {"hits": lookups.count(self.Hit), "misses": lookups.count(self.Miss)}
+        entries = self.entries()
+        stats["entries"] = len(entries)
+        stats["size"] = sum(size for mtime, size, path in entries)
+        return stats
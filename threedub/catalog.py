@@ -0,0 +1,169 @@
+import logging
+import os
+import re
+import sqlite3
+from .filepath import FilePath
+from .batch import expand_inputs
+
+log = logging.getLogger(__name__)
+
+
+class Catalog(object):
+    """
+    SQLite index of the metadata of a library of gcode and .3w
+    files, keyed by path and refreshed from the files' mtime and
+    size, so rescans only read files that changed.
+
+    Metadata is read the cheap way: from the header block of .3w
+    files, and from the head and tail of gcode files through the
+    Slicer implementations. It is stored as key and value pairs,
+    so any header field can be searched.
+    """
+    Schema = """
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            mtime REAL NOT NULL,
+            size INTEGER NOT NULL,
+            slicer TEXT,
+            error TEXT
+        );
+        CREATE TABLE IF NOT EXISTS fields (
+            path TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+            key TEXT NOT NULL,
+            value TEXT,
+            PRIMARY KEY (path, key)
+        );
+        CREATE INDEX IF NOT EXISTS fields_key_value ON fields(key, value);
+    """
+    # Condition operators for find(); ~ matches a substring
+    Operators = ("<=", ">=", "!=", "=", "<", ">", "~")
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.executescript(self.Schema)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc, msg, tb):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    @staticmethod
+    def extract(path):
+        """
+        Return the slicer name and header values of the file at
+        path. .3w files are reported with the slicer "3w".
+        """
+        if FilePath(path).file_type == FilePath.XYZ3wFile:
+            from .davinci import ThreeWHeader
+            return "3w", dict(ThreeWHeader.from_file(path).values)
+        from .translator import GCodeTranslator
+        slicer, meta = GCodeTranslator(None, "auto", analyze=False).probe(path)
+        values = dict(meta)
+        values.setdefault("filename", os.path.basename(path))
+        return slicer.name if slicer else None, values
+
+    def scan(self, paths):
+        """
+        Bring the catalog up to date with files, directories and
+        glob patterns. Files with the mtime and size on record are
+        skipped, and entries for files that are gone are removed.
+        Returns the counts of (updated, unchanged, removed) files.
+        """
+        known = dict((row[0], (row[1], row[2])) for row in self.db.execute("SELECT path, mtime, size FROM files"))
+        found = set()
+        updated = unchanged = 0
+        with self.db:
+            for path in expand_inputs(paths):
+                path = os.path.abspath(path)
+                found.add(path)
+                st = os.stat(path)
+                if known.get(path) == (st.st_mtime, st.st_size):
+                    unchanged += 1
+                    continue
+                self.store(path, st)
+                updated += 1
+        removed = 0
+        with self.db:
+            for path in set(known) - found:
+                if not os.path.exists(path):
+                    self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+                    removed += 1
+        return updated, unchanged, removed
+
+    def store(self, path, st):
+        slicer, values, error = None, {}, None
+        try:
+            slicer, values = self.extract(path)
+        except Exception as e:
+            log.warning("Can't read metadata of {}: {}".format(path, e))
+            error = str(e) or e.__class__.__name__
+        self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+        self.db.execute("INSERT INTO files (path, mtime, size, slicer, error) VALUES (?, ?, ?, ?, ?)",
+                        (path, st.st_mtime, st.st_size, slicer, error))
+        self.db.executemany("INSERT INTO fields (path, key, value) VALUES (?, ?, ?)",
+                            [(path, key, str(value)) for key, value in values.items()])
+
+    @classmethod
+    def parse_condition(cls, text):
+        """
+        Split a condition such as "total_filament<500" into
+        (key, operator, value).
+        """
+        match = re.match(r"\s*([^<>=!~\s]+)\s*({})\s*(.*)$".format("|".join(map(re.escape, cls.Operators))), text)
+        if not match:
+            raise ValueError("Bad condition: {}".format(text))
+        return match.groups()
+
+    def find(self, conditions=()):
+        """
+        Return a list of (path, values) for files matching all of
+        the (key, operator, value) conditions. <, >, <= and >=
+        compare the leading number of the value, as in "599.7mm".
+        """
+        where = []
+        params = []
+        for key, op, value in conditions:
+            if op not in self.Operators:
+                raise ValueError("Unknown operator: {}".format(op))
+            if op == "~":
+                test = "instr(f.value, ?) > 0"
+            elif op in ("=", "!="):
+                test = "f.value {} ?".format(op)
+            else:
+                test = "CAST(f.value AS REAL) {} ?".format(op)
+                value = float(value)
+            where.append("EXISTS (SELECT 1 FROM fields f WHERE f.path = files.path AND f.key = ? AND {})".format(test))
+            params += [key, value]
+        sql = "SELECT files.path, fields.key, fields.value FROM files LEFT JOIN fields ON fields.path = files.path"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        results = []
+        for path, key, value in self.db.execute(sql + " ORDER BY files.path", params):
+            if not results or results[-1][0] != path:
+                results.append((path, {}))
+            if key is not None:
+                results[-1][1][key] = value
+        return results
+
+
+def run_catalog(database, paths=None, conditions=None):
+    """
+    Scan paths into the catalog in database, if given, then print
+    the files matching conditions if any were given.
+    """
+    with Catalog(database) as catalog:
+        if paths:
+            updated, unchanged, removed = catalog.scan(paths)
+            log.info("Catalog {}: {} files updated, {} unchanged, {} removed".format(database, updated, unchanged, removed))
+        if conditions is not None:
+            for path, values in catalog.find([Catalog.parse_condition(c) for c in conditions]):
+                print("{}\t{}".format(path, " ".join(
+                    "{}={}".format(key, values[key]) for key in ("print_time", "total_layers", "total_filament", "dimension")
+                    if key in values)))
+    return 0
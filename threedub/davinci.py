@@ -2,54 +2,70 @@ import logging
 import os
 import struct
 import binascii
+import mmap
+from concurrent.futures import ThreadPoolExecutor
 import Padding
 from .gcode import GCodeFile
+from .timings import Timings
 from io import BytesIO
+from contextlib import nullcontext
 from Crypto.Cipher.AES import AESCipher, MODE_ECB, MODE_CBC
 
 log = logging.getLogger(__name__)
 
 class ThreeWFile(object):
+    BodyKey = b"@xyzprinting.com@xyzprinting.com"
+    HeaderKey = "@xyzprinting.com"
+    Magic = b"3DPFNKG13WTW"
+    BlockSize = 16
+    HeaderSize = 0x2000
+    # Offsets of the body CRC32 and the encrypted header in the header block
+    CrcOffset = 4716
+    HeaderOffset = 4784
+    # Plaintext bytes collected before each encryption step
+    ChunkSize = 0x10000
+    # Threads encrypting or decrypting the body; 1 to use one core
+    Workers = 1
+    # Bytes of body each worker handles at a time
+    SegmentSize = 0x100000
+
     @classmethod
-    def from_file(cls, path):
-        with open(path, 'rb') as f:
-            return cls.from_string(f.read())
+    def from_file(cls, path, workers=None):
+        inst = cls(workers=workers)
+        with ThreeWReader(path, workers=inst.Workers) as reader:
+            inst.gcode = GCodeFile.from_lines(reader.lines())
+        return inst
 
     @classmethod
-    def from_string(cls, string):
-        inst = cls()
+    def from_string(cls, string, workers=None):
+        inst = cls(workers=workers)
         inst.decrypt(string)
         return inst
 
     def decrypt(self, string):
         enc_gcode = string[0x2000:]
-        aes = AESCipher("@xyzprinting.com@xyzprinting.com", mode=MODE_ECB, IV=chr(0)*16)
-        gcode = aes.decrypt(enc_gcode).decode("utf-8")
+        with crypt_pool(self.Workers) as pool:
+            gcode = b"".join(crypt_body(enc_gcode, pool, self.SegmentSize, decrypt=True)).decode("utf-8")
         self.gcode = GCodeFile.from_string(gcode)
 
     def encrypt_header(self):
-        key = "@xyzprinting.com"
         iv = chr(0)*16
-        aes = AESCipher(key, mode=MODE_CBC, IV=iv)
+        aes = AESCipher(self.HeaderKey, mode=MODE_CBC, IV=iv)
         text = self.gcode.header_text
         header = Padding.appendPadding(text)
         return aes.encrypt(header)
 
-    def encrypt(self):
-        key = "@xyzprinting.com@xyzprinting.com"
-        iv = chr(0)*16
-        aes = AESCipher(key, mode=MODE_ECB, IV=iv)
-        fulltext = self.gcode.text
-        padded = Padding.appendPadding(fulltext)
-        enc_text = aes.encrypt(padded)
-
-        magic = b"3DPFNKG13WTW"
+    def header_block(self, crc32):
+        """
+        Return the 8 KB block at the start of the file, including
+        the CRC32 of the encrypted body and the encrypted header.
+        """
+        magic = self.Magic
         magic2 = struct.pack("8B", 1, 2, 0, 0, 0, 0, 18, 76)
         blanks = b"\0"*4684
         tag = b"TagEJ256"
         magic3 = struct.pack("4B", 0, 0, 0, 68)
-        crc32 = binascii.crc32(enc_text)
-        crcstr = struct.pack(">L", crc32)
+        crcstr = struct.pack(">L", crc32 & 0xffffffff)
         encrypted_header = self.encrypt_header()
         bio = BytesIO()
         bio.write(magic)
@@ -60,19 +76,301 @@ class ThreeWFile(object):
         bio.write(crcstr)
         bio.write((b"\0"*(68 - len(crcstr))))
         log.debug("Length of encrypted header: {}".format(len(encrypted_header)))
-        if len(encrypted_header) > (8192 - bio.tell()):
+        if len(encrypted_header) > (self.HeaderSize - bio.tell()):
             log.error("Header is too big to fit file format!")
         bio.write(encrypted_header)
-        left = 8192 - bio.tell()
+        left = self.HeaderSize - bio.tell()
         bio.write((b"\0"*left))
-        bio.write(enc_text)
         return bio.getvalue()
 
-    def __init__(self, gcode=None):
+    def iter_text(self):
+        """
+        Yield the file content as encoded pieces of text, the same
+        bytes as GCodeFile.text without building it all at once.
+        """
+        for chunk in self.gcode.text_chunks(self.ChunkSize):
+            yield chunk.encode("utf-8")
+
+    def iter_body(self, text=None):
+        """
+        Yield the encrypted body in block aligned pieces, encrypting
+        the text, from iter_text unless given, as it is produced.
+        """
+        with crypt_pool(self.Workers) as pool:
+            # With workers, collect a segment for each of them per step
+            step = self.SegmentSize * self.Workers if pool else self.ChunkSize
+            pending = bytearray()
+            for piece in text or self.iter_text():
+                pending += piece
+                if len(pending) < step:
+                    continue
+                aligned = len(pending) - len(pending) % self.BlockSize
+                for enc in crypt_body(bytes(pending[:aligned]), pool, self.SegmentSize):
+                    yield enc
+                del pending[:aligned]
+            # CMS padding, as Padding.appendPadding does
+            pad = self.BlockSize - len(pending) % self.BlockSize
+            pending += bytes([pad])*pad
+            for enc in crypt_body(bytes(pending), pool, self.SegmentSize):
+                yield enc
+
+    def encrypt_to(self, f):
+        """
+        Write the encrypted file to the seekable file object f.
+
+        The body is encrypted in block aligned chunks as the text is
+        produced, and the header block is written last once the CRC32
+        is known. Returns the number of bytes written.
+        """
+        start = f.tell()
+        # Reserve room for the header block; it is written at the end,
+        # when the header text of a GCodeStream is known too
+        f.write(b"\0"*self.HeaderSize)
+        crc32 = 0
+        timings = self.timings or Timings(enabled=False)
+        body = self.iter_body(timings.timed("format", self.iter_text(), size=len))
+        for enc in timings.timed("encrypt", body, size=len):
+            crc32 = binascii.crc32(enc, crc32)
+            f.write(enc)
+        end = f.tell()
+        header = self.header_block(crc32)
+        if len(header) != self.HeaderSize:
+            raise ValueError("Header is too big to fit file format")
+        f.seek(start)
+        f.write(header)
+        f.seek(end)
+        return end - start
+
+    def stream(self, chunk_size=8192):
+        """
+        Prepare to produce the encrypted file in order, for sending
+        it without writing it out first.
+
+        The header holds the CRC32 of the whole body, so the body is
+        encrypted once up front to find it and the size; nothing is
+        kept from that pass. Returns a tuple of the file size and a
+        generator of chunk_size pieces that encrypts as it goes.
+        """
+        crc32 = 0
+        size = 0
+        for enc in self.iter_body():
+            crc32 = binascii.crc32(enc, crc32)
+            size += len(enc)
+        header = self.header_block(crc32)
+
+        def chunks():
+            buf = bytearray(header)
+            for enc in self.iter_body():
+                buf += enc
+                while len(buf) >= chunk_size:
+                    yield bytes(buf[:chunk_size])
+                    del buf[:chunk_size]
+            if buf:
+                yield bytes(buf)
+        return len(header) + size, chunks()
+
+    def encrypt(self):
+        bio = BytesIO()
+        self.encrypt_to(bio)
+        return bio.getvalue()
+
+    def __init__(self, gcode=None, workers=None, timings=None):
         self.gcode = gcode
+        # Records the format and encrypt steps of encrypt_to
+        self.timings = timings
+        if workers:
+            self.Workers = workers
 
-    def write(self, path):
+    def write(self, path, cache=None, key=None):
+        """
+        Write the encrypted file to path. With a ConversionCache
+        and a key from ConversionCache.key, a cached copy is used
+        if there is one, and a new file is added to the cache.
+        """
+        if cache and key and cache.fetch(key, path):
+            return
         with open(path, 'wb') as f:
-            f.write(self.encrypt())
+            self.encrypt_to(f)
+        if cache and key:
+            cache.store(key, path)
+
+
+class ThreeWHeader(object):
+    """
+    The values of a .3w file's header and the CRC32 of its body,
+    read from the header block alone. Only the encrypted header
+    is decrypted; the body is never read unless verifying.
+    """
+    def __init__(self, crc32, text):
+        self.crc32 = crc32
+        self.text = text
+        self.values = GCodeFile.from_string(text).header_values("=")
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, 'rb') as f:
+            return cls.from_block(f.read(ThreeWFile.HeaderSize))
+
+    @classmethod
+    def from_block(cls, block):
+        """
+        Parse a header block. Raises ValueError if it isn't one.
+        """
+        if len(block) < ThreeWFile.HeaderSize or not block.startswith(ThreeWFile.Magic):
+            raise ValueError("Not a 3w file")
+        crc32, = struct.unpack_from(">L", block, ThreeWFile.CrcOffset)
+        encrypted = block[ThreeWFile.HeaderOffset:ThreeWFile.HeaderSize]
+        # The rest of the block is zero filled
+        end = len(encrypted)
+        while end and not any(encrypted[end - ThreeWFile.BlockSize:end]):
+            end -= ThreeWFile.BlockSize
+        aes = AESCipher(ThreeWFile.HeaderKey, mode=MODE_CBC, IV=chr(0)*16)
+        text = ThreeWReader.strip_padding(aes.decrypt(encrypted[:end]))
+        return cls(crc32, text.decode("utf-8", "replace"))
+
+    @staticmethod
+    def body_crc32(path, chunk_size=0x100000):
+        """
+        Return the CRC32 of the encrypted body of the file at path.
+        """
+        crc32 = 0
+        with open(path, 'rb') as f:
+            f.seek(ThreeWFile.HeaderSize)
+            for block in iter(lambda: f.read(chunk_size), b""):
+                crc32 = binascii.crc32(block, crc32)
+        return crc32 & 0xffffffff
+
+    def verify(self, path):
+        """
+        Return True if the body of the file at path matches the
+        CRC32 in this header.
+        """
+        return self.body_crc32(path) == self.crc32
+
+
+def crypt_pool(workers):
+    """
+    Return a thread pool for crypt_body, or a context that
+    gives None when workers is 1.
+    """
+    if workers and workers > 1:
+        return ThreadPoolExecutor(max_workers=workers)
+    return nullcontext()
+
+
+def crypt_body(data, pool=None, segment_size=ThreeWFile.SegmentSize, decrypt=False):
+    """
+    Encrypt or decrypt block aligned body data with the body key.
+
+    ECB blocks are independent, so with a pool the data is split
+    into segment_size pieces that are processed in parallel.
+    Returns the results in order.
+    """
+    def crypt(segment):
+        aes = AESCipher(ThreeWFile.BodyKey, mode=MODE_ECB, IV=b"\0"*16)
+        return aes.decrypt(segment) if decrypt else aes.encrypt(segment)
+    if not pool or len(data) <= segment_size:
+        return [crypt(data)]
+    segment_size -= segment_size % ThreeWFile.BlockSize
+    return list(pool.map(crypt, [data[pos:pos+segment_size] for pos in range(0, len(data), segment_size)]))
 
 
+class ThreeWReader(object):
+    """
+    Decrypt the body of a .3w file on demand.
+
+    The file is memory-mapped and decrypted a chunk at a time, so
+    lines can be consumed in constant memory and the caller can stop
+    reading at any point.
+    """
+    def __init__(self, path, chunk_size=ThreeWFile.ChunkSize, workers=1):
+        self.path = path
+        self.chunk_size = chunk_size - chunk_size % ThreeWFile.BlockSize
+        self.workers = workers
+        self._file = None
+        self._map = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc, msg, tb):
+        self.close()
+
+    def open(self):
+        if self._file:
+            return
+        self._file = open(self.path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        if size > ThreeWFile.HeaderSize:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            log.warning("No encrypted body in {}".format(self.path))
+            self._map = b""
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        if self._file:
+            self._file.close()
+        self._map = None
+        self._file = None
+
+    @staticmethod
+    def strip_padding(data):
+        """
+        Remove CMS padding from the final block, if present.
+        """
+        pad = data[-1] if data else 0
+        if 0 < pad <= ThreeWFile.BlockSize and data[-pad:] == bytes([pad])*pad:
+            return data[:-pad]
+        return data
+
+    def chunks(self):
+        """
+        Yield decrypted chunks of the body, with padding removed.
+        """
+        self.open()
+        data = self._map
+        start = ThreeWFile.HeaderSize
+        end = len(data)
+        end -= max(end - start, 0) % ThreeWFile.BlockSize
+        with crypt_pool(self.workers) as pool:
+            # With workers, decrypt a chunk for each of them per step
+            step = self.chunk_size * self.workers if pool else self.chunk_size
+            for pos in range(start, end, step):
+                stop = min(pos + step, end)
+                plains = crypt_body(data[pos:stop], pool, self.chunk_size, decrypt=True)
+                for n, plain in enumerate(plains):
+                    if stop == end and n == len(plains) - 1:
+                        plain = self.strip_padding(plain)
+                    yield plain
+
+    def lines(self):
+        """
+        Yield the decoded lines of the body, split on newlines.
+        """
+        rest = b""
+        for chunk in self.chunks():
+            chunk = rest + chunk
+            cut = chunk.rfind(b"\n") + 1
+            rest = chunk[cut:]
+            if cut:
+                for line in chunk[:cut - 1].decode("utf-8").split("\n"):
+                    yield line
+        if rest:
+            yield rest.decode("utf-8")
+
+    def statements(self):
+        """
+        Yield the body as GCode objects.
+        """
+        for line in self.lines():
+            yield GCodeFile.parse_line(line)
+
+    def write(self, path):
+        log.debug("Writing output file: {}".format(path))
+        with self, open(path, "w") as f:
+            for item in self.statements():
+                f.write(str(item))
+                f.write(os.linesep)
@@ -0,0 +1,262 @@
+import logging
+import os
+import time
+import shutil
+import asyncio
+import tempfile
+from .filepath import FilePath
+from .printers import XYZStatus
+from .asyncprinters import AsyncDaVinciJr10
+from .batch import expand_inputs
+
+log = logging.getLogger(__name__)
+
+
+class PrintJob(object):
+    """
+    A file to print: encoded .3w data, a .3w file sent from a memory
+    map, or a gcode file converted with options when a printer takes
+    it. size is the number of bytes uploaded, once known.
+    """
+    def __init__(self, path, data=None, options=None):
+        self.path = path
+        self.data = data
+        self.options = list(options or [])
+        self.size = None
+        self.device = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def needs_conversion(self):
+        return self.data is None and FilePath(self.path).file_type != FilePath.XYZ3wFile
+
+    @property
+    def queue_wait(self):
+        return (self.started or time.time()) - self.submitted
+
+    @property
+    def upload_seconds(self):
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+
+class PrinterStats(object):
+    def __init__(self, device):
+        self.device = device
+        self.jobs = 0
+        self.failed = 0
+        self.bytes = 0
+        self.upload_seconds = 0.0
+        self.queue_waits = []
+
+    def add(self, job):
+        self.queue_waits.append(job.queue_wait)
+        if job.error:
+            self.failed += 1
+            return
+        self.jobs += 1
+        self.bytes += job.size
+        self.upload_seconds += job.upload_seconds
+
+    def as_dict(self):
+        waits = self.queue_waits or [0.0]
+        return {
+            "device": self.device,
+            "jobs": self.jobs,
+            "failed": self.failed,
+            "bytes": self.bytes,
+            "upload_seconds": self.upload_seconds,
+            "upload_rate": self.bytes / self.upload_seconds if self.upload_seconds else 0.0,
+            "queue_wait_mean": sum(waits) / len(waits),
+            "queue_wait_max": max(waits),
+        }
+
+
+class PrintFarm(object):
+    """
+    Hand print jobs from one queue to many printers.
+
+    Each printer polls its status and takes the next job as soon as
+    its printer_state reports idle, so uploads to different printers
+    run in parallel on one event loop. Jobs go out in the order they
+    were submitted. After sending a job, a printer only takes another
+    once it has left idle, or settle_time seconds have passed.
+
+    Failed jobs are not requeued: uploads already retry failed
+    chunks, and a job that fails to convert would fail on every
+    printer. They are reported with their error instead.
+    """
+    # Seconds between status queries while a printer is busy
+    PollInterval = 5.0
+    # Longest wait for a printer to start a job it was sent
+    SettleTime = 30.0
+    # printer_state status codes of a printer ready for a job
+    IdleStates = ("9511",)
+
+    def __init__(self, devices, poll_interval=PollInterval, printer_cls=AsyncDaVinciJr10,
+                 settle_time=SettleTime):
+        self.devices = list(devices)
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.printer_cls = printer_cls
+        self.jobs = []
+        self.printer_stats = dict((device, PrinterStats(device)) for device in self.devices)
+
+    def submit(self, path, data=None, options=None):
+        """
+        Queue a .3w file, or its encoded data, for printing. A gcode
+        file is converted with the threedub command line options
+        only when a printer is ready for it.
+        """
+        job = PrintJob(path, data, options)
+        self.jobs.append(job)
+        return job
+
+    def run(self):
+        """
+        Print every submitted job and return the list of jobs.
+        """
+        asyncio.run(self.run_async())
+        return self.jobs
+
+    async def run_async(self):
+        queue = asyncio.Queue()
+        for job in self.jobs:
+            queue.put_nowait(job)
+        await asyncio.gather(*(self.worker(device, queue) for device in self.devices))
+
+    def is_idle(self, status):
+        state = status.instances["j"].value
+        return bool(state) and state[0] in self.IdleStates
+
+    async def query_idle(self, printer):
+        status = XYZStatus()
+        status.parse(await printer.query_cmd("j", expect="$"))
+        return self.is_idle(status)
+
+    async def wait_idle(self, printer, queue):
+        """
+        Poll the printer until it is idle and return True, or
+        return False once other printers have taken every job.
+        """
+        while not queue.empty():
+            if await self.query_idle(printer):
+                return True
+            await asyncio.sleep(self.poll_interval)
+        return False
+
+    async def wait_started(self, printer, device):
+        """
+        Poll the printer until it leaves idle after being sent a
+        job, for at most settle_time seconds.
+        """
+        deadline = time.time() + self.settle_time
+        while await self.query_idle(printer):
+            if time.time() >= deadline:
+                log.warning("Printer {} still idle {:.0f}s after a job was sent".format(device, self.settle_time))
+                return
+            await asyncio.sleep(self.poll_interval)
+
+    async def worker(self, device, queue):
+        stats = self.printer_stats[device]
+        try:
+            async with self.printer_cls(device) as printer:
+                while await self.wait_idle(printer, queue):
+                    try:
+                        job = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        break
+                    await self.upload(printer, device, job)
+                    stats.add(job)
+                    if queue.empty():
+                        break
+                    elif job.error:
+                        await asyncio.sleep(self.poll_interval)
+                    else:
+                        await self.wait_started(printer, device)
+        except Exception:
+            log.exception("Printer {} failed".format(device))
+
+    async def upload(self, printer, device, job):
+        job.device = device
+        log.info("Printing {} on {}".format(job.path, device))
+        try:
+            if job.needs_conversion:
+                await self.upload_converted(printer, job)
+            else:
+                job.started = time.time()
+                job.size = len(job.data) if job.data is not None else os.path.getsize(job.path)
+                await printer.print_data(job.path, job.data)
+        except Exception as e:
+            log.debug("Printing {} failed".format(job.path), exc_info=True)
+            job.error = str(e) or e.__class__.__name__
+        job.started = job.started or time.time()
+        job.finished = time.time()
+
+    async def upload_converted(self, printer, job):
+        """
+        Convert a gcode job to a temporary .3w file in a thread, then
+        send it from a memory map, so no job is held in memory. The
+        header names the .3w file the command line would have written.
+        """
+        filename = FilePath(job.path)
+        filename.file_type = FilePath.XYZ3wFile
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, os.path.basename(filename.path))
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, convert_job, job.path, job.options, path, filename.path)
+            job.started = time.time()
+            job.size = os.path.getsize(path)
+            await printer.print_stream(job.path, job.size, printer.printer.file_chunks(path))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def stats(self):
+        """
+        Return throughput and queue wait metrics for each printer.
+        """
+        return [self.printer_stats[device].as_dict() for device in self.devices]
+
+
+def convert_job(path, options, outfile, filename=None):
+    """
+    Translate and encode the gcode file at path to the .3w file
+    outfile, as the threedub command would if writing to filename.
+    """
+    from .main import build_argparse, process_file, make_optimizer
+    args = build_argparse().parse_args(options + ["-f", FilePath.XYZ3wFile, path, filename or outfile])
+    twfile, intermediate, result = process_file(args, optimizer=make_optimizer(args))
+    result.write(outfile)
+
+
+def run_farm(devices, paths, options=None, poll_interval=PrintFarm.PollInterval):
+    """
+    Print files, directories or glob patterns on a farm of printers,
+    then print the per-printer metrics. Returns the list of PrintJobs.
+    """
+    farm = PrintFarm(devices, poll_interval)
+    for path in expand_inputs(paths):
+        farm.submit(path, options=options)
+    start = time.time()
+    jobs = farm.run()
+    elapsed = max(time.time() - start, 1e-6)
+    for job in jobs:
+        if job.error:
+            print("FAILED {} on {} ({})".format(job.path, job.device, job.error))
+        elif job.device:
+            print("ok     {} on {} (waited {:.1f}s, uploaded in {:.1f}s)".format(
+                job.path, job.device, job.queue_wait, job.upload_seconds))
+        else:
+            print("SKIPPED {} (no printer available)".format(job.path))
+    for stats in farm.stats():
+        print("{device}: {jobs} jobs, {failed} failed, {upload_rate:.0f} B/s upload, "
+              "queue wait mean {queue_wait_mean:.1f}s max {queue_wait_max:.1f}s".format(**stats))
+    printed = len([job for job in jobs if job.device and not job.error])
+    print("{} of {} jobs printed in {:.1f}s ({:.2f} jobs/min)".format(
+        printed, len(jobs), elapsed, printed * 60.0 / elapsed))
+    return jobs
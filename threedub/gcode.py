@@ -1,33 +1,25 @@
 import logging
+import mmap
 import os
 from io import StringIO
-from collections import namedtuple
+from array import array
+from itertools import accumulate, chain, compress, islice, repeat
+from operator import add
+from collections.abc import Sequence
+from .filepath import FilePath
 
 log = logging.getLogger(__name__)
 
 class GCodeBlankLine(object):
+    __slots__ = ()
+
     def __str__(self):
         return ""
 
 
-class GCodeTranslations(object):
-    @classmethod
-    def translate_davincijr10(cls, gcode, keywords):
-        newcode = []
-        for code in gcode:
-            if not hasattr(code, "statement"):
-                newcode.append(code)
-                continue
-            if code.statement.startswith("G0 "):
-                # DaVinci doesn't use G0 so we make them G1
-                statement = code.statement.replace("G0 ", "G1 ")
-            else:
-                statement = code.statement
-            newcode.append(GCodeStatement(statement))
-        return newcode
-
-
 class GCodeComment(object):
+    __slots__ = ("line",)
+
     @classmethod
     def from_string(cls, string):
         return cls(string)
@@ -40,6 +32,8 @@ class GCodeComment(object):
 
 
 class GCodeStatement(object):
+    __slots__ = ("statement",)
+
     @classmethod
     def from_string(cls, string):
         return cls(string)
@@ -50,64 +44,413 @@ class GCodeStatement(object):
     def __str__(self):
         return self.statement
 
+
+class GCodeLines(Sequence):
+    """
+    Read-only view of lines in a GCodeFile.
+
+    GCode objects are created as they are accessed, so changing
+    them doesn't change the file; assign to GCodeFile.statements
+    instead.
+    """
+    def __init__(self, gcode, index=None):
+        self._gcode = gcode
+        self._index = index
+
+    def __len__(self):
+        if self._index is None:
+            return len(self._gcode)
+        return len(self._index)
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return [self[i] for i in range(*n.indices(len(self)))]
+        if n < 0:
+            n += len(self)
+        if not 0 <= n < len(self):
+            raise IndexError("line index out of range")
+        if self._index is not None:
+            n = self._index[n]
+        return self._gcode.line(n)
+
+    def __iter__(self):
+        lines = range(len(self._gcode)) if self._index is None else self._index
+        line = self._gcode.line
+        for n in lines:
+            yield line(n)
+
+    def texts(self):
+        """
+        Yield the text of each line in the view.
+        """
+        lines = range(len(self._gcode)) if self._index is None else self._index
+        text = self._gcode.line_text
+        for n in lines:
+            yield text(n)
+
+
 class GCodeFile(object):
+    """
+    A GCode file, stored as one text buffer with an offset and
+    a kind for each line.
+    """
+    Blank = 0
+    Comment = 1
+    Statement = 2
+    Kinds = {
+        Blank: lambda text: GCodeBlankLine(),
+        Comment: GCodeComment,
+        Statement: GCodeStatement,
+    }
+    # Lines parsed at a time when building the buffer
+    LineBatch = 0x10000
+
     @classmethod
     def from_file(cls, path):
         with open(path, 'r') as f:
-            return cls.from_string(f.read())
+            return cls.from_lines(f)
 
     @classmethod
     def from_string(cls, string):
-        gcode = []
-        for line in StringIO(string):
+        return cls.from_lines(StringIO(string))
+
+    @classmethod
+    def from_lines(cls, lines):
+        """
+        Build a file from an iterable of lines, such as
+        an open file or a ThreeWReader.
+        """
+        inst = cls()
+        inst._pack(lines)
+        return inst
+
+    @classmethod
+    def probe(cls, path, window=0x10000):
+        """
+        Build a file from only the first and last window bytes of
+        the file at path, enough to find slicer headers quickly.
+        """
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= 2*window:
+                return cls.from_lines(f.read().decode("utf-8", "replace").splitlines())
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                head = data[:window]
+                tail = data[size - window:]
+        # Drop the lines cut by either window
+        head = head[:head.rfind(b"\n")].decode("utf-8", "replace").splitlines()
+        tail = tail[tail.find(b"\n") + 1:].decode("utf-8", "replace").splitlines()
+        return cls.from_lines(head + tail)
+
+    @classmethod
+    def parse_line(cls, line):
+        line = line.strip()
+        if not line:
+            return GCodeBlankLine()
+        if line.startswith(";"):
+            return GCodeComment.from_string(line)
+        return GCodeStatement.from_string(line)
+
+    @classmethod
+    def classify(cls, lines):
+        """
+        Yield a (kind, text) pair for each line, with the
+        text stripped.
+        """
+        for line in lines:
             line = line.strip()
             if not line:
-                gcode.append(GCodeBlankLine())
-                continue
-            if line.startswith(";"):
-                gcode.append(GCodeComment.from_string(line))
-            elif line:
-                gcode.append(GCodeStatement.from_string(line))
-        return cls(gcode)
+                yield cls.Blank, line
+            elif line[0] == ";":
+                yield cls.Comment, line
+            else:
+                yield cls.Statement, line
+
+    @classmethod
+    def kind_of(cls, code):
+        if isinstance(code, GCodeComment):
+            return cls.Comment
+        elif isinstance(code, GCodeBlankLine):
+            return cls.Blank
+        return cls.Statement
 
+    def __init__(self, statements=None):
+        self.statements = statements if statements is not None else []
 
-    def __init__(self, statements):
-        self.statements = statements
+    def __len__(self):
+        return len(self._kinds)
+
+    def _pack(self, lines, objects=False, items=False):
+        """
+        Store stripped lines into the buffer. If objects is set, lines
+        are GCode objects and keep their kind instead of being classified;
+        if items is set, they are (kind, text) pairs.
+        """
+        parts = []
+        offsets = array("q", [0])
+        kinds = bytearray()
+        lines = iter(lines)
+        while True:
+            batch = list(islice(lines, self.LineBatch))
+            if not batch:
+                break
+            if objects:
+                kinds.extend(map(self.kind_of, batch))
+                batch = [str(code).strip() for code in batch]
+            elif items:
+                kinds.extend(kind for kind, text in batch)
+                batch = [text for kind, text in batch]
+            else:
+                batch = [line.strip() for line in batch]
+                kinds.extend(
+                    self.Blank if not line else
+                    self.Comment if line[0] == ";" else
+                    self.Statement
+                    for line in batch
+                )
+            ends = accumulate((len(line) + 1 for line in batch), initial=offsets[-1])
+            next(ends)
+            offsets.extend(ends)
+            parts.append("\n".join(batch))
+        self._buffer = "\n".join(parts)
+        self._offsets = offsets
+        self._kinds = kinds
+        self._cache = {}
+
+    def _cached(self, key, build):
+        """
+        Return a value derived from the buffer, building it on first
+        use. The cache is dropped whenever the statements change.
+        """
+        if key not in self._cache:
+            self._cache[key] = build()
+        return self._cache[key]
+
+    @property
+    def statements(self):
+        return GCodeLines(self)
+
+    @statements.setter
+    def statements(self, statements):
+        if isinstance(statements, GCodeLines) and statements._gcode is self \
+                and statements._index is None:
+            return
+        self._pack(statements, objects=True)
+
+    @property
+    def items(self):
+        """
+        Yield a (kind, text) pair for each line, the form the
+        translation stages work on.
+        """
+        buffer, offsets, kinds = self._buffer, self._offsets, self._kinds
+        for n in range(len(kinds)):
+            yield kinds[n], buffer[offsets[n]:offsets[n + 1] - 1]
+
+    @items.setter
+    def items(self, items):
+        self._pack(items, items=True)
+
+    def replace_headers(self, lines):
+        """
+        Replace the comment lines of the file with lines, put at its
+        start, moving the other lines in one slice each between
+        comments.
+        """
+        parts = []
+        offsets = array("q", [0])
+        kinds = bytearray()
+        for kind, text in self.classify(lines):
+            parts.append(text + "\n")
+            offsets.append(offsets[-1] + len(text) + 1)
+            kinds.append(kind)
+        buffer, old = self._buffer + "\n", self._offsets
+        start = 0
+        for end in chain(self.kind_index(self.Comment), [len(self)]):
+            if end > start:
+                parts.append(buffer[old[start]:old[end]])
+                offsets.extend(map(add, old[start + 1:end + 1], repeat(offsets[-1] - old[start])))
+                kinds += self._kinds[start:end]
+            start = end + 1
+        self._buffer = "".join(parts)[:-1]
+        self._offsets = offsets
+        self._kinds = kinds
+        self._cache = {}
+
+    def rewrite(self, rewrite):
+        """
+        Rewrite the whole text of the file at once. rewrite is called
+        with the lines, each ending in a newline, and returns the new
+        text and whether any line may have changed length or kind,
+        as RuleSet.rewrite does. Only then are the lines indexed again.
+        """
+        if not len(self):
+            return
+        text, reshaped = rewrite(self._buffer + "\n")
+        if reshaped:
+            self._pack(text.split("\n")[:-1])
+        else:
+            self._buffer = text[:-1]
+            self._cache = {}
+
+    def line(self, n):
+        """
+        Return line n as a GCode object.
+        """
+        return self.Kinds[self._kinds[n]](self.line_text(n))
+
+    def line_text(self, n):
+        return self._buffer[self._offsets[n]:self._offsets[n + 1] - 1]
+
+    def kind_index(self, *kinds):
+        """
+        Return an array of the line numbers of the given kinds.
+        """
+        def build():
+            mask = bytes(1 if n in kinds else 0 for n in range(256))
+            return array("q", compress(range(len(self)), self._kinds.translate(mask)))
+        return self._cached(("kind_index",) + kinds, build)
+
+    def header_values(self, separator):
+        """
+        Return a dict of the "; key <separator> value" comments in the
+        file; later keys override earlier ones. The dict is shared
+        between callers and must not be changed.
+        """
+        def build():
+            values = {}
+            for line in self.headers.texts():
+                parts = line.strip("; ").split(separator, 1)
+                if len(parts) > 1:
+                    values[parts[0].strip()] = parts[1].strip()
+            return values
+        return self._cached(("header_values", separator), build)
 
     @property
     def headers(self):
-        return [code for code in self.statements if isinstance(code, GCodeComment)]
+        return GCodeLines(self, self.kind_index(self.Comment))
 
     @property
     def gcode(self):
-        return [code for code in self.statements if not isinstance(code, GCodeComment)]
+        return GCodeLines(self, self.kind_index(self.Blank, self.Statement))
 
     @property
     def text(self):
         """
         Return the content of the GCode file as a string.
         """
-        return os.linesep.join(str(s) for s in self.statements)
+        if os.linesep == "\n":
+            return self._buffer
+        return self._buffer.replace("\n", os.linesep)
+
+    def text_chunks(self, size=0x100000):
+        """
+        Yield the content of the file as a series of strings
+        of about size characters.
+        """
+        for start in range(0, len(self._buffer), size):
+            chunk = self._buffer[start:start + size]
+            if os.linesep != "\n":
+                chunk = chunk.replace("\n", os.linesep)
+            yield chunk
+
+    def line_chunks(self, lines=LineBatch):
+        """
+        Yield the content of the file in pieces of whole lines,
+        each piece joined by newlines.
+        """
+        for start in range(0, len(self), lines):
+            end = min(start + lines, len(self))
+            yield self._buffer[self._offsets[start]:self._offsets[end] - 1]
 
     @property
     def header_text(self):
         """
         Return the headers of the file as a string.
         """
-        return os.linesep.join(map(str, self.headers))
+        return self._cached("header_text", lambda: os.linesep.join(self.headers.texts()))
 
     @property
     def gcode_text(self):
         """
         Return the gcode statements of the file as a string.
         """
-        return os.linesep.join(map(str, self.gcode))
+        return os.linesep.join(self.gcode.texts())
 
     def write(self, path):
         log.debug("Writing output file: {}".format(path))
         with open(path, "w") as f:
-            for item in self.statements:
-                f.write(str(item))
+            for chunk in self.text_chunks():
+                f.write(chunk)
+            if len(self):
                 f.write(os.linesep)
 
 
+
+class GCodeStream(object):
+    """
+    GCode produced one line at a time from (kind, text) pairs, such
+    as the output of the translation stages, for writing out in a
+    single pass.
+
+    It can only be read once. Only the comment lines are kept, so
+    header_text is complete once the text has been read.
+    """
+    def __init__(self, items):
+        self._items = items
+        self._headers = []
+        self.lines = 0
+
+    @classmethod
+    def from_file(cls, path, workers=1):
+        return cls(cls.read(path, workers))
+
+    @staticmethod
+    def read(path, workers=1):
+        """
+        Yield the classified lines of the gcode or .3w file at path,
+        decrypting a .3w body a chunk at a time.
+        """
+        if FilePath(path).file_type == FilePath.XYZ3wFile:
+            from .davinci import ThreeWReader
+            with ThreeWReader(path, workers=workers) as reader:
+                for item in GCodeFile.classify(reader.lines()):
+                    yield item
+            return
+        with open(path, 'r') as f:
+            for item in GCodeFile.classify(f):
+                yield item
+
+    def text_chunks(self, size=0x100000):
+        """
+        Yield the content as a series of strings of about size
+        characters, with the same text as GCodeFile.text_chunks.
+        """
+        parts = []
+        length = 0
+        for kind, text in self._items:
+            if self.lines:
+                parts.append(os.linesep)
+            parts.append(text)
+            length += len(text) + 1
+            self.lines += 1
+            if kind == GCodeFile.Comment:
+                self._headers.append(text)
+            if length >= size:
+                yield "".join(parts)
+                parts = []
+                length = 0
+        if parts:
+            yield "".join(parts)
+
+    @property
+    def header_text(self):
+        return os.linesep.join(self._headers)
+
+    def write(self, path):
+        log.debug("Writing output file: {}".format(path))
+        with open(path, "w") as f:
+            for chunk in self.text_chunks():
+                f.write(chunk)
+            if self.lines:
+                f.write(os.linesep)
@@ -1,15 +1,13 @@
 import logging
 import os
 import sys
-from . import slicers
-from . import models
-from . import printers
-from .gcode import GCodeFile
-from .davinci import ThreeWFile
+from .gcode import GCodeFile, GCodeStream
 from .bases import Slicer, ModelTranslator, PrinterInterface
 from .filepath import FilePath
-from .translator import GCodeTranslator
+from .cache import ConversionCache
+from .timings import Timings
 from argparse import ArgumentParser
+from contextlib import ExitStack
 
 log = logging.getLogger(__name__)
 
@@ -28,6 +26,8 @@ output filename ends with .3w, or conversion is specifically requested.
     ap.add_argument("-m", "--model", default="davincijr", help="Machine to translate headers for. Set to 'none' for no translation.")
     ap.add_argument("-s", "--slicer", default="auto", help="Flavor of Slicer gcode being read. Tries to autodetect if not given.")
     ap.add_argument("-l", "--list", default=False, action="store_true", help="List known models (for -m) and slicers (for -s)")
+    ap.add_argument("-i", "--inspect", default=False, action="store_true", help="Show the detected slicer and metadata of the input file (or --batch files) without converting it")
+    ap.add_argument("--verify", default=False, action="store_true", help="With --inspect, also check the body CRC32 of .3w files")
     ap.add_argument("-e", "--device", default="/dev/ttyACM0", help="Printer device name or address")
     ap.add_argument("-q", "--status", dest="status", default=False, action="store_true", help="Show printer status")
     ap.add_argument("-r", "--raw", dest="raw", default=False, action="store_true", help="Show raw status values")
@@ -35,6 +35,27 @@ output filename ends with .3w, or conversion is specifically requested.
     ap.add_argument("-c", "--console", dest="console", default=False, action="store_true", help="Open a console for direct communication.")
     ap.add_argument("-u", "--unlock", dest="unlock", default=False, action="store_true", help="Unlock filament")
     ap.add_argument("-F", "--firmware", dest="firmware", default=False, action="store_true", help="Write firmware (exclusive with other options)")
+    ap.add_argument("-b", "--batch", nargs="+", metavar="PATH", default=None, help="Convert many files, directories or glob patterns in parallel (exclusive with other options)")
+    ap.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes for --batch (default: number of CPUs)")
+    ap.add_argument("--farm", nargs="+", metavar="DEVICE", default=None, help="Print the --batch files on these printers, each taking the next job when idle")
+    ap.add_argument("--poll-interval", type=float, default=5.0, help="Seconds between printer status queries for --farm (default: 5)")
+    ap.add_argument("-O", "--optimize", default=False, action="store_true",
+                    help="Make translated gcode smaller for faster uploads: drop comments, repeated words and trailing zeros, and merge straight moves")
+    ap.add_argument("--optimize-tolerance", type=float, default=0.01, help="Distance in mm moves may be off a straight line and still merge (default: 0.01)")
+    ap.add_argument("--crypt-workers", type=int, default=1, help="Threads encrypting or decrypting .3w bodies (default: 1)")
+    ap.add_argument("--timings", "--profile", dest="timings", default=False, action="store_true",
+                    help="Print the time and CPU of each stage")
+    ap.add_argument("--timings-json", metavar="FILE", default=None, help="Write the time and CPU of each stage to FILE as JSON")
+    ap.add_argument("--timings-memory", default=False, action="store_true",
+                    help="Also trace the peak Python memory of each stage, which slows the run")
+    ap.add_argument("--catalog", metavar="DB", default=None, help="SQLite catalog of file metadata; updated from the --batch paths, searched with --find")
+    ap.add_argument("--find", nargs="*", metavar="COND", default=None,
+                    help="List catalog files matching all conditions such as machine=daVinciJR10, total_filament<500 or filename~tube")
+    ap.add_argument("--output-dir", default=".", help="Output directory for --batch (default: current directory)")
+    ap.add_argument("--cache-dir", default=os.environ.get("THREEDUB_CACHE_DIR"), help="Reuse earlier conversions stored in this directory (default: $THREEDUB_CACHE_DIR)")
+    ap.add_argument("--cache-size", type=int, default=1024, help="Maximum size of the conversion cache in MB (default: 1024)")
+    ap.add_argument("--no-cache", default=False, action="store_true", help="Don't use the conversion cache")
+    ap.add_argument("--cache-stats", default=False, action="store_true", help="Show conversion cache statistics")
     return ap
 
 
@@ -71,14 +92,48 @@ def list_support():
         print("  {}".format(t.replace(".", "")))
     print()
 
-def process_file(args):
+def inspect_file(args, path):
     """
-    Take requested actions on the input file.
-    Returns a 3-tuple of (3w file, intermediate file, outfile).
-    Input file may be none if input was gcode.
+    Print the slicer and metadata found in the head and tail of
+    a gcode file, or in the header block of a .3w file.
+    Returns False if the file is bad.
+    """
+    print("File: {}".format(path))
+    if FilePath(path).file_type == FilePath.XYZ3wFile:
+        from .davinci import ThreeWHeader
+        try:
+            header = ThreeWHeader.from_file(path)
+        except (ValueError, OSError) as e:
+            print("Error: {}".format(e))
+            return False
+        meta = header.values
+        ok = True
+        if args.verify:
+            ok = header.verify(path)
+            print("CRC32: {:08x} {}".format(header.crc32, "ok" if ok else "MISMATCH"))
+    else:
+        from .translator import GCodeTranslator
+        slicer, meta = GCodeTranslator(args.model, args.slicer).probe(path)
+        print("Slicer: {}".format(slicer.name if slicer else "unknown"))
+        ok = True
+    for key, value in sorted(meta.items()):
+        print("  {} = {}".format(key, value))
+    return ok
+
+def inspect_files(args):
+    if args.batch:
+        from .batch import expand_inputs
+        paths = expand_inputs(args.batch)
+    else:
+        paths = [args.infile]
+    results = [inspect_file(args, path) for path in paths]
+    return 0 if all(results) else 1
+
+def resolve_output(args):
+    """
+    Fill in the output path and format from each other
+    or from the input file.
     """
-    # Figure out output path and/or format.
-    inpath = FilePath(args.infile)
     if args.outfile:
         # Infer output_format if not set from file path
         outpath = FilePath(args.outfile)
@@ -93,6 +148,67 @@ def process_file(args):
         outpath.file_type = args.output_format
         args.outfile = outpath.path
 
+def make_optimizer(args):
+    if not args.optimize:
+        return None
+    from .optimize import GCodeOptimizer
+    return GCodeOptimizer(args.optimize_tolerance)
+
+def optimize_options(args):
+    """
+    Return the command line options for optimizing, to pass on.
+    """
+    if not args.optimize:
+        return []
+    return ["--optimize", "--optimize-tolerance", str(args.optimize_tolerance)]
+
+def open_cache(args):
+    if args.no_cache or not args.cache_dir:
+        return None
+    return ConversionCache(args.cache_dir, args.cache_size * 1024 * 1024)
+
+def convert(args, cache=None, timings=None, optimizer=None):
+    """
+    Process the input file and write the output file, copying
+    it from the cache instead if it was converted before.
+    Returns the process_file tuple, or None on a cache hit.
+    """
+    timings = timings or Timings(enabled=False)
+    resolve_output(args)
+    key = None
+    if cache:
+        with timings.stage("cache") as stage:
+            key = cache.key(args.infile, args.model, args.slicer, args.outfile, optimize_options(args))
+            hit = cache.fetch(key, args.outfile)
+        if hit:
+            log.debug("Using cached conversion of '{}'".format(args.infile))
+            return None
+    result = process_file(args, timings, optimizer)
+    with timings.stage("write") as stage:
+        result[2].write(args.outfile)
+        stage.bytes = os.path.getsize(args.outfile)
+    if key:
+        cache.store(key, args.outfile)
+    return result
+
+def same_file(path, other):
+    return os.path.exists(other) and os.path.samefile(path, other)
+
+def process_file(args, timings=None, optimizer=None):
+    """
+    Take requested actions on the input file.
+    Returns a 3-tuple of (3w file, intermediate file, outfile).
+    Input file may be none if input was gcode.
+    Each stage is recorded in timings, if given. Translated
+    gcode is run through optimizer, if given.
+    """
+    # Crypto, numpy and the translators load slowly; only import them to convert
+    from .davinci import ThreeWFile, ThreeWReader
+    from .translator import GCodeTranslator
+    timings = timings or Timings(enabled=False)
+    # Figure out output path and/or format.
+    inpath = FilePath(args.infile)
+    resolve_output(args)
     if args.output_format.replace(".", "") not in [t.replace(".", "") for t in FilePath.Types]:
         print("Unknown output format: {}".format(args.output_format), file=sys.stderr)
         return 1
@@ -107,23 +223,49 @@ def process_file(args):
     twfile = None
     intermediate = None
     outfile = None
-    if decode:
+    if decode and not encode and model == "none" and not args.start_print:
+        # Nothing to translate; decode straight to the output file
+        log.debug("Streaming '{}' as 3w to gcode".format(args.infile))
+        return None, None, ThreeWReader(args.infile, workers=args.crypt_workers)
+    elif not args.start_print and not same_file(args.infile, args.outfile):
+        # Translate line by line from the input file to the output
+        log.debug("Streaming '{}' as {}".format(args.infile, "3w" if decode else "gcode"))
+        if model != "none":
+            translator = GCodeTranslator(args.model, args.slicer, optimizer=optimizer)
+            values = translator.header_values(args.infile, args.outfile, args.crypt_workers, timings)
+            intermediate = translator.stream(args.infile, values, args.crypt_workers, timings)
+        else:
+            intermediate = GCodeStream(timings.timed("read", GCodeStream.read(args.infile, args.crypt_workers)))
+        outfile = ThreeWFile(intermediate, args.crypt_workers, timings) if encode else intermediate
+        return None, intermediate, outfile
+    elif decode:
         log.debug("Decoding '{}' as 3w".format(args.infile))
-        twfile = ThreeWFile.from_file(args.infile)
-        intermediate = twfile.gcode
+        with timings.stage("decode", bytes=os.path.getsize(args.infile)) as stage:
+            twfile = ThreeWFile.from_file(args.infile, args.crypt_workers)
+            intermediate = twfile.gcode
+            stage.lines = len(intermediate)
     else:
         log.debug("Reading '{}' as gcode".format(args.infile))
-        intermediate = GCodeFile.from_file(args.infile)
+        with timings.stage("parse", bytes=os.path.getsize(args.infile)) as stage:
+            intermediate = GCodeFile.from_file(args.infile)
+            stage.lines = len(intermediate)
 
     # Translate
     if args.model != "none":
         log.debug("Translating to model '{}' with slicer setting '{}'".format(args.model, args.slicer))
-        GCodeTranslator(args.model, args.slicer).translate(intermediate, filename=args.outfile)
+        translator = GCodeTranslator(args.model, args.slicer, optimizer=optimizer)
+        found = None
+        if args.slicer == "auto" and not decode:
+            # Slicer headers are at the start or end of the file
+            with timings.stage("detect"):
+                slicer, found = translator.probe_values(args.infile)
+        with timings.stage("translate", lines=len(intermediate)):
+            translator.translate(intermediate, filename=args.outfile, found=found)
 
     # Encode/write
     if encode:
         log.debug("Encoding to 3w: '{}'".format(args.outfile))
-        outfile = ThreeWFile(intermediate)
+        outfile = ThreeWFile(intermediate, args.crypt_workers)
     else:
         log.debug("Encoding to gcode: '{}'".format(args.outfile))
         outfile = intermediate
@@ -143,6 +285,41 @@ def threedub(argv=None):
         list_support()
         return 0
 
+    if args.inspect:
+        if not args.infile and not args.batch:
+            ap.print_help()
+            return 0
+        return inspect_files(args)
+
+    if args.cache_stats:
+        cache = open_cache(args)
+        if not cache:
+            log.error("No conversion cache in use")
+            return 1
+        for key, value in sorted(cache.stats().items()):
+            print("{}: {}".format(key, value))
+        return 0
+
+    if args.catalog:
+        from .catalog import run_catalog
+        return run_catalog(args.catalog, args.batch, args.find)
+
+    if args.batch and args.farm:
+        from .farm import run_farm
+        jobs = run_farm(args.farm, args.batch, ["-m", args.model, "-s", args.slicer] + optimize_options(args), args.poll_interval)
+        return 1 if any(job.error or not job.device for job in jobs) else 0
+
+    if args.batch:
+        from .batch import run_batch
+        options = ["-m", args.model, "-s", args.slicer, "--cache-size", str(args.cache_size),
+                   "--crypt-workers", str(args.crypt_workers)] + optimize_options(args)
+        if args.no_cache:
+            options.append("--no-cache")
+        elif args.cache_dir:
+            options += ["--cache-dir", args.cache_dir]
+        results = run_batch(args.batch, args.output_dir, args.jobs, args.output_format, options)
+        return 1 if any(r.error for r in results) else 0
+
     # Validate args
     printhandler = None
     if args.start_print and args.model == "none":
@@ -176,33 +353,55 @@ def threedub(argv=None):
         printhandler.write_firmware(args.infile)
         return 0
 
-    # Status?
-    if args.status:
-        print(printhandler.status(args.raw))
-
-    # Process file and write it if we're not just printing
-    # If output file is same as input, don't update it unless user specified the name
-    if args.infile:
-        pathgiven = args.outfile
-        twfile, intermediate, outfile = process_file(args)
-        if args.infile != args.outfile or pathgiven:
-            outfile.write(args.outfile)
-        else:
-            log.info("Not overwriting input file: {}. If this is really what you want, specify the output file path".format(args.infile))
-
-    # Unlock?
-    if args.unlock:
-        log.debug("Sending unlock commands")
-        printhandler.unlock_filament()
-
-    # Print?
-    if args.start_print:
-        log.debug("Printing file to device '{}'".format(args.device))
-        # If we didn't convert before, we need to now
-        print_data = None
-        if args.output_format == FilePath.XYZ3wFile:
-            print_file = outfile
-        else:
-            print_file = ThreeWFile(intermediate)
-            print_data = print_file.encrypt()
-        printhandler.print_data(args.outfile, print_data)
+    timings = Timings(enabled=args.timings or bool(args.timings_json), memory=args.timings_memory)
+    optimizer = make_optimizer(args)
+    with ExitStack() as stack:
+        if printhandler:
+            # Keep one connection open for all printer commands
+            stack.enter_context(printhandler.session())
+        # Status?
+        if args.status:
+            with timings.stage("status"):
+                print(printhandler.status(args.raw))
+
+        # Process file and write it if we're not just printing
+        # If output file is same as input, don't update it unless user specified the name
+        if args.infile:
+            pathgiven = args.outfile
+            resolve_output(args)
+            if args.infile != args.outfile or pathgiven:
+                # Printing needs the converted file in memory
+                cache = None if args.start_print else open_cache(args)
+                twfile, intermediate, outfile = convert(args, cache, timings, optimizer) or (None, None, None)
+            else:
+                twfile, intermediate, outfile = process_file(args, timings, optimizer)
+                log.info("Not overwriting input file: {}. If this is really what you want, specify the output file path".format(args.infile))
+
+        # Unlock?
+        if args.unlock:
+            log.debug("Sending unlock commands")
+            with timings.stage("unlock"):
+                printhandler.unlock_filament()
+
+        # Print?
+        if args.start_print:
+            log.debug("Printing file to device '{}'".format(args.device))
+            # If we didn't convert before, we need to now
+            if args.output_format == FilePath.XYZ3wFile:
+                with timings.stage("upload", bytes=os.path.getsize(args.outfile)):
+                    printhandler.print_data(args.outfile)
+            else:
+                # Encrypt while uploading
+                from .davinci import ThreeWFile
+                with timings.stage("upload", lines=len(intermediate)) as stage:
+                    size, chunks = ThreeWFile(intermediate, args.crypt_workers).stream(printhandler.BlockSize)
+                    stage.bytes = size
+                    printhandler.print_stream(args.outfile, size, chunks)
+
+    if optimizer and optimizer.lines_in:
+        log.info(optimizer.summary())
+
+    if args.timings:
+        timings.report()
+    if args.timings_json:
+        timings.write(args.timings_json)
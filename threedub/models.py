@@ -1,7 +1,8 @@
 import logging
 from io import StringIO
-from .gcode import GCodeComment
+from .gcode import GCodeFile
 from .bases import ModelTranslator
+from .rewrite import Rule, RuleSet
 from string import Formatter
 
 log = logging.getLogger(__name__)
@@ -12,10 +13,13 @@ class DaVinciJr10(ModelTranslator):
     defaults = {
         "filename": "test.gcode",
         "total_filament": 1,
+        "print_time": 1,
+        "total_layers": 1,
+        "dimension": "1.00:1.00:1.00",
     }
     header_template = """\
 ; filename = {filename}
-; print_time = 1
+; print_time = {print_time}
 ; machine = daVinciJR10
 ; filamentid = 50,50
 ; layer_height = 0.10
@@ -27,41 +31,64 @@ class DaVinciJr10(ModelTranslator):
 ; shells = 1
 ; speed = 10
 ; brim_width = 0
-; total_layers = 1
+; total_layers = {total_layers}
 ; version = 15062609
 ; total_filament = {total_filament}
 ; nozzle_diameter = 0.40
 ; extruder_filament = 1.00:0.00
-; dimension = 1.00:1.00:1.00
+; dimension = {dimension}
 ; extruder = 1
 """
 
+    def stages(self):
+        return [self.translate_headers, self.translate_gcode]
+
     def translate(self, gcode, meta):
-        self.translate_headers(gcode, meta)
-        self.translate_gcode(gcode, meta)
+        """
+        Translate a GCodeFile in place, through the same stages as
+        translate_lines but on its whole buffer at once.
+        """
+        gcode.replace_headers(self.header_lines(meta))
+        gcode.rewrite(self.ruleset().rewrite)
 
-    def translate_headers(self, gcode, meta):
+    def header_lines(self, meta):
+        """
+        Return the lines of the model's header, filling in meta
+        with defaults for the values it doesn't have.
+        """
         names = [n[1] for n in Formatter().parse(self.header_template) if n[1] is not None]
         for name in names:
             if not name in meta:
-                log.warning("GCode header value '{}' not found; default '{}' used".format(self.defaults[name]))
+                log.warning("GCode header value '{}' not found; default '{}' used".format(name, self.defaults.get(name)))
                 meta[name] = self.defaults.get(name, None)
-            
+
         header = self.header_template.format(**meta)
-        comments = []
-        for line in StringIO(header):
-            comments.append(GCodeComment(line.strip()))
-        gcode.statements = comments + gcode.gcode
+        return [line.strip() for line in StringIO(header)]
+
+    def translate_headers(self, lines, meta):
+        """
+        Replace the comments in the file with the model's header.
+        """
+        for line in self.header_lines(meta):
+            yield GCodeFile.Comment, line
+        for kind, text in lines:
+            if kind != GCodeFile.Comment:
+                yield kind, text
+
+    # Statement rewrites, applied together in one pass
+    rules = [
+        # DaVinci can't use G0's (Cura), so we make these G1's
+        Rule.replace_code("G0", "G1"),
+    ]
+
+    @classmethod
+    def ruleset(cls):
+        if "_ruleset" not in vars(cls):
+            cls._ruleset = RuleSet(cls.rules)
+        return cls._ruleset
 
-    def translate_gcode(self, gcode, meta):
+    def translate_gcode(self, lines, meta):
         """
-        Fix up gcode to work with Da Vinci Jr.
-        Particularly, translate G0 from Cura to G1.
+        Fix up gcode to work with Da Vinci Jr. by applying rules.
         """
-        for code in gcode.statements:
-            if not hasattr(code, "statement"):
-                continue
-            if code.statement.startswith("G0 "):
-                # DaVinci can't use G0's (Cura),
-                # so we make these G1's
-                code.statement = code.statement.replace("G0 ", "G1 ")
+        return self.ruleset().stage(lines, meta)
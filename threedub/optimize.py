@@ -0,0 +1,243 @@
+import logging
+import math
+from .gcode import GCodeFile
+from .rewrite import format_number
+
+log = logging.getLogger(__name__)
+
+
+class MoveRun(object):
+    """
+    Consecutive moves being considered for merging into one:
+    the position they start from and each point they reach.
+    """
+    def __init__(self, code, start, point, words):
+        self.code = code
+        self.start = start
+        self.points = [point]
+        # Cumulative path length to each point
+        self.lengths = [math.hypot(point[0] - start[0], point[1] - start[1])]
+        self.words = words
+        self.feed = dict(words).get("F")
+
+    def accepts(self, point, tolerance):
+        """
+        Return True if every point of the run lies within tolerance
+        of the straight move from the start to point, in order, and
+        the extrusion along it grows evenly.
+        """
+        sx, sy, se = self.start
+        dx, dy = point[0] - sx, point[1] - sy
+        straight = math.hypot(dx, dy)
+        last = self.points[-1]
+        length = self.lengths[-1] + math.hypot(point[0] - last[0], point[1] - last[1])
+        if straight == 0 or length - straight > tolerance:
+            return False
+        e_tolerance = 0
+        if se is not None:
+            e_tolerance = tolerance * abs(point[2] - se) / length
+        for (x, y, e), at in zip(self.points, self.lengths):
+            # Distance from the line, in either direction
+            if abs((x - sx) * dy - (y - sy) * dx) / straight > tolerance:
+                return False
+            if se is not None and abs(e - (se + (point[2] - se) * at / length)) > e_tolerance:
+                return False
+        return True
+
+    def add(self, point):
+        last = self.points[-1]
+        self.lengths.append(self.lengths[-1] + math.hypot(point[0] - last[0], point[1] - last[1]))
+        self.points.append(point)
+
+
+class GCodeOptimizer(object):
+    """
+    Translation stage making gcode smaller without changing the
+    toolpath, so that it uploads faster:
+
+    - comments after the header, inline comments and blank lines
+      are dropped
+    - numbers lose their trailing zeros
+    - F and Z words repeating the current value are dropped
+    - runs of moves along a straight line, within tolerance in
+      file units, are merged into one move
+
+    Moves are only merged in absolute positioning and extrusion
+    mode. The sizes going in and out are counted for summary().
+    """
+    # Codes taking only numeric words, which can be reformatted
+    NumericCodes = {"M82", "M83", "M84", "M104", "M106", "M107", "M109", "M140", "M190", "M220", "M221"}
+    Moves = {"G0", "G1"}
+    # Other G codes modeled here; any other one, such as an arc,
+    # leaves the position unknown
+    KnownCodes = {"G4", "G21", "G28", "G90", "G91", "G92"}
+    Axes = "XYZE"
+    # Most moves considered for one merge
+    MaxRun = 256
+
+    def __init__(self, tolerance=0.01):
+        self.tolerance = tolerance
+        self.lines_in = self.lines_out = 0
+        self.bytes_in = self.bytes_out = 0
+        self.merged = 0
+        self.reset()
+
+    def reset(self):
+        self.absolute = True
+        self.absolute_e = True
+        self.run = None
+        self.forget()
+
+    def forget(self):
+        """
+        Stop relying on the position and feed rate, after a statement
+        whose effect on them isn't modeled.
+        """
+        self.position = dict.fromkeys(self.Axes)
+        self.feed = None
+
+    @staticmethod
+    def parse(text):
+        """
+        Split a statement into its code and (letter, value) words.
+        Returns None if the words aren't all numeric.
+        """
+        tokens = text.split()
+        words = []
+        for token in tokens[1:]:
+            try:
+                words.append((token[0].upper(), float(token[1:])))
+            except (ValueError, IndexError):
+                return None
+        return tokens[0].upper(), words
+
+    @staticmethod
+    def format(code, words):
+        return " ".join([code] + [letter + format_number(value) for letter, value in words])
+
+    def stage(self, lines, meta=None):
+        header = True
+        for kind, text in lines:
+            self.lines_in += 1
+            self.bytes_in += len(text) + 1
+            if kind == GCodeFile.Statement:
+                header = False
+                out = self.statement(text)
+            elif kind == GCodeFile.Comment and header:
+                out = [(kind, text)]
+            else:
+                continue
+            for item in out:
+                self.lines_out += 1
+                self.bytes_out += len(item[1]) + 1
+                yield item
+        for item in self.flush():
+            self.lines_out += 1
+            self.bytes_out += len(item[1]) + 1
+            yield item
+
+    def flush(self):
+        """
+        Return the line ending the current run of moves, if any.
+        """
+        run, self.run = self.run, None
+        if run is None:
+            return []
+        if len(run.points) == 1:
+            return [(GCodeFile.Statement, self.format(run.code, run.words))]
+        self.merged += len(run.points) - 1
+        x, y, e = run.points[-1]
+        words = [("F", run.feed)] if run.feed is not None else []
+        words += [("X", x), ("Y", y)]
+        if e is not None:
+            words.append(("E", e))
+        return [(GCodeFile.Statement, self.format(run.code, words))]
+
+    def statement(self, text):
+        """
+        Return the (kind, text) lines to write for a statement.
+        """
+        text = text.split(";", 1)[0].strip()
+        if not text:
+            return []
+        parsed = self.parse(text)
+        if parsed is None:
+            out = self.flush()
+            if text[0] in "Gg":
+                # Unknown effect on position
+                self.forget()
+            return out + [(GCodeFile.Statement, text)]
+        code, words = parsed
+        if code in self.Moves:
+            return self.move(code, words)
+        out = self.flush()
+        if code[0] == "G" and code not in self.KnownCodes:
+            self.forget()
+        elif code == "G90":
+            self.absolute = True
+        elif code == "G91":
+            self.absolute = False
+        elif code == "M82":
+            self.absolute_e = True
+        elif code == "M83":
+            self.absolute_e = False
+        elif code == "G92":
+            for letter, value in words or [(axis, 0.0) for axis in self.Axes]:
+                if letter in self.position:
+                    self.position[letter] = value
+        elif code == "G28":
+            for letter in [letter for letter, value in words] or self.Axes:
+                if letter in self.position:
+                    self.position[letter] = None
+        if code[0] == "G" or code in self.NumericCodes:
+            text = self.format(code, words)
+        return out + [(GCodeFile.Statement, text)]
+
+    def move(self, code, words):
+        position = self.position
+        kept = []
+        for letter, value in words:
+            if letter == "F" and value == self.feed:
+                continue
+            if letter == "Z" and self.absolute and value == position["Z"]:
+                continue
+            kept.append((letter, value))
+        if not kept:
+            return []
+
+        letters = set(letter for letter, value in kept)
+        start = (position["X"], position["Y"], position["E"])
+        mergeable = (self.absolute and self.absolute_e and letters <= set("XYEF")
+                     and letters & set("XY") and None not in start[:2]
+                     and ("E" not in letters or start[2] is not None))
+
+        # Move, then see where it ended up
+        for letter, value in kept:
+            if letter == "F":
+                self.feed = value
+            elif letter in position:
+                absolute = self.absolute_e if letter == "E" else self.absolute
+                if absolute:
+                    position[letter] = value
+                elif position[letter] is not None:
+                    position[letter] += value
+        point = (position["X"], position["Y"], position["E"] if "E" in letters else None)
+        if "E" not in letters:
+            start = start[:2] + (None,)
+
+        run = self.run
+        if (mergeable and run is not None and "F" not in letters and run.code == code
+                and (run.start[2] is None) == (point[2] is None) and len(run.points) < self.MaxRun
+                and run.accepts(point, self.tolerance)):
+            run.add(point)
+            return []
+        out = self.flush()
+        if mergeable:
+            self.run = MoveRun(code, start, point, kept)
+            return out
+        return out + [(GCodeFile.Statement, self.format(code, kept))]
+
+    def summary(self):
+        saved = 1 - float(self.bytes_out) / self.bytes_in if self.bytes_in else 0
+        return "Optimized gcode from {} to {} bytes ({:.1%} smaller), {} to {} lines, {} moves merged".format(
+            self.bytes_in, self.bytes_out, saved, self.lines_in, self.lines_out, self.merged)
@@ -1,5 +1,6 @@
 import serial
 import stat
+import mmap
 import struct
 import os
 import logging
@@ -7,8 +8,9 @@ import time
 import sys
 import json
 from io import BytesIO
-from threading import Thread, Event
-from queue import Queue, Empty
+from threading import Thread, Event, RLock
+from contextlib import contextmanager
+from queue import Queue, Empty, Full
 from datetime import datetime, timedelta
 from .filepath import FilePath
 from .bases import PrinterInterface
@@ -171,30 +173,29 @@ class XYZStatus(object):
         "l": ("language", "Language", None),
     }
 
+    # Handler class for each key, found on first use
+    _handlers = None
+
+    @classmethod
+    def handlers(cls):
+        if cls._handlers is None:
+            classes = XYZStatusLine.__subclasses__()
+            bykey = {}
+            while classes:
+                subcls = classes.pop(0)
+                bykey.setdefault(subcls.key, subcls)
+                classes.extend(subcls.__subclasses__())
+            cls._handlers = dict((key, bykey.get(key, XYZStatusLine)) for key in cls.Keys)
+        return cls._handlers
+
     def __init__(self):
         self.data = {}
         self.instances = {}
-        # Set up lookup dictionary of handlers for each key
-        classes = XYZStatusLine.__subclasses__()
-        subclss = []
-        while classes:
-            cls = classes.pop(0)
-            subclss.append(cls)
-            classes.extend(cls.__subclasses__())
-        for key, data in list(self.Keys.items()):
-            for c in subclss:
-                print("Checking {} for {}".format(c, key))
-                if c.key == key:
-                    print("Selected {}".format(c))
-                    subcls = c
-                    break
-            else:
-                subcls = XYZStatusLine
-            inst = subcls(key, *data)
-            self.instances[key] = inst
+        for key, subcls in self.handlers().items():
+            self.instances[key] = subcls(key, *self.Keys[key])
 
     def parse(self, data):
-        for line in BytesIO(data).readlines():
+        for line in data.splitlines():
             line = line.strip()
             if not line or line == "$":
                 continue
@@ -220,7 +221,56 @@ class ConnectionError(Exception):
 class PrinterError(Exception):
     pass
 
+class UploadError(PrinterError):
+    """
+    An upload chunk was not acknowledged after all retries.
+    Pass state back to print_data or print_stream to resume
+    from that chunk.
+    """
+    def __init__(self, message, state):
+        super(UploadError, self).__init__(message)
+        self.state = state
+
+
+class UploadState(object):
+    """
+    Progress of an upload: the index of the next chunk to
+    send and how many bytes the printer has acknowledged.
+    """
+    def __init__(self, filename, size):
+        self.filename = filename
+        self.size = size
+        self.chunk = 0
+        self.sent = 0
+        self.started = False
+        self.finished = False
+
+class ChunkFramer(object):
+    """
+    Frames upload chunks into one preallocated buffer: the chunk
+    index and block size, the data, then four zero bytes.
+    """
+    def __init__(self, blocksize):
+        self.blocksize = blocksize
+        self.buf = bytearray(8 + blocksize + 4)
+        self.view = memoryview(self.buf)
+
+    def frame(self, n, chunk):
+        """
+        Return a view of the frame for chunk n, valid until
+        the next call.
+        """
+        length = len(chunk)
+        struct.pack_into(">ll", self.buf, 0, n, self.blocksize)
+        self.view[8:8+length] = chunk
+        self.view[8+length:12+length] = b"\x00\x00\x00\x00"
+        return self.view[:12+length]
+
+
 class SerialConnection(Thread):
+    # Seconds of silence that end a drain after opening
+    DrainQuiet = 0.1
+
     def __init__(self, device, callback=None, drain=False):
         super(SerialConnection, self).__init__()
         self.device = device
@@ -230,54 +280,60 @@ class SerialConnection(Thread):
         self.callback = callback
         self.event = Event()
         self.can_send = True
+        # Held by each command; nested uses share one open port
+        self.lock = RLock()
+        self._depth = 0
 
     def __enter__(self):
-        self.open()
-        if self._drain:
-            self.drain()
+        self.lock.acquire()
+        try:
+            if self._depth == 0:
+                self.open()
+                if self._drain:
+                    self.drain(self.DrainQuiet)
+                if callable(self.callback):
+                    self.start()
+            elif self._drain:
+                self.discard()
+        except Exception:
+            self.lock.release()
+            raise
+        self._depth += 1
         return self
 
     def __exit__(self, exc, msg, tb):
         if exc:
             log.error("Exiting with exception: {} {}".format(exc, msg))
-        self.close()
+        self._depth -= 1
+        try:
+            if self._depth == 0:
+                self.close()
+        finally:
+            self.lock.release()
 
     def run(self):
         log.debug("Starting reader thread")
+        buf = bytearray()
         try:
             while not self.event.is_set() and self.ser.isOpen():
-                log.debug("checking...")
-                avail = self.ser.inWaiting()
-                log.debug("{} bytes available".format(avail))
-                if not avail:
-                    log.debug("Sleeping")
-                    self.event.wait(0.1)
-                else:
-                    line = None
-                    buf = ""
-                    while avail and self.ser.isOpen():
-                        log.debug("{} bytes avail".format(avail))
-                        try:
-                            buf += self.ser.read(avail)
-                            log.debug("serial readline gave us: {!r}".format(line))
-                            while '\n' in buf:
-                                pos = buf.index('\n')+1
-                                avail -= pos
-                                line = buf[:pos]
-                                buf = buf[pos:]
-                                log.debug("got line {!r}".format(line))
-                                if callable(self.callback):
-                                    log.debug("calling callback")
-                                    self.callback(line)
-                                else:
-                                    log.debug("putting {}".format(line))
-                                    self._inq.put(line)
-                        except Exception as e:
-                            log.debug("Serial read failed")
-                            line = ""
+                # Block until a byte arrives, then take whatever else is waiting
+                data = self.ser.read(self.ser.in_waiting or 1)
+                if not data:
+                    continue
+                buf += data
+                pos = buf.find(b"\n")
+                while pos >= 0:
+                    line = buf[:pos+1].decode("utf-8", "replace")
+                    del buf[:pos+1]
+                    if callable(self.callback):
+                        self.callback(line)
+                    else:
+                        self._inq.put(line)
+                    pos = buf.find(b"\n")
             log.debug("Exited. Serial: {}, Event: {}".format(self.ser.isOpen(), self.event.is_set()))
         except Exception as e:
-            log.exception("Failed to read from serial device")
+            if not self.event.is_set():
+                log.exception("Failed to read from serial device")
 
     def open(self):
         if self.ser:
@@ -295,28 +351,43 @@ class SerialConnection(Thread):
             bytesize=serial.EIGHTBITS,
         )
         if not self.ser.isOpen():
-            raise PrinterError("Serial connection to {} failed".format(device))
-        #self.start()
+            raise PrinterError("Serial connection to {} failed".format(self.device))
 
     def close(self):
         log.debug("Close called")
         self.event.set()
         if self.ser and self.ser.isOpen():
+            if self.is_alive():
+                # Wake the reader thread out of its blocking read
+                self.ser.cancel_read()
+                self.join()
             self.ser.close()
 
-    def drain(self):
+    def drain(self, quiet=DrainQuiet):
+        """
+        Discard input until nothing has arrived for quiet seconds.
+        """
         log.debug("Drain...")
-        line = None
-        while line is None or line:
-            line = self.ser.readline()
+        timeout = self.ser.timeout
+        self.ser.timeout = quiet
+        try:
+            while self.ser.read(4096):
+                pass
+        finally:
+            self.ser.timeout = timeout
+
+    def discard(self):
+        """
+        Discard input that has already arrived, without waiting.
+        """
+        waiting = self.ser.in_waiting
+        if waiting:
+            log.debug("Discarding {} bytes".format(waiting))
+            self.ser.read(waiting)
 
     def clear(self):
         log.debug("Clearing buffer")
-        data = None
-        while data is None or data:
-            data = self.drain()
-            if data:
-                log.debug("Cleared line {!r}".format(data))
+        self.drain()
 
     def dumpformat(self, string):
         if len(string) > 32:
@@ -328,6 +399,8 @@ class SerialConnection(Thread):
  
     def write(self, data):
         log.debug(">>> {} bytes".format(len(data)))
+        if isinstance(data, str):
+            data = data.encode("ascii")
         self.ser.write(data)
         self.ser.flush()
 
@@ -335,13 +408,21 @@ class SerialConnection(Thread):
         self.write(data+"\n")
 
     def readline(self):
-        return self.ser.readline()
+        return self.ser.readline().decode("utf-8", "replace")
 
-    def wait_for_ok(self, expect="ok"):
+    def wait_for_ok(self, expect="ok", timeout=None):
         log.debug("waiting for ok")
-        resp = self.readlines(expect=expect)
+        if timeout is None:
+            resp = self.readlines(expect=expect)
+        else:
+            previous = self.ser.timeout
+            self.ser.timeout = timeout
+            try:
+                resp = self.readlines(expect=expect)
+            finally:
+                self.ser.timeout = previous
         if not resp or resp.strip() != "ok":
-            raise Exception("Expected token not found: {}".format(expect))
+            raise PrinterError("Expected token not found: {}".format(expect))
 
     def readlines(self, expect=None):
         buf = ""
@@ -373,9 +454,18 @@ class DaVinciJr10(PrinterInterface):
     PauseCmd = "M84 P"
     ResumeCmd = "M84 R"
     CancelCmd = "M84"
+    # Upload chunks produced ahead of sending
+    QueueSize = 16
+    # Seconds to wait for each chunk's "ok"
+    ChunkTimeout = 2
+    # Times to resend an unacknowledged chunk
+    ChunkRetries = 3
+    # Seconds before the first resend, doubling for each one after
+    RetryBackoff = 0.5
 
     def __init__(self, device="/dev/ttyACM0"):
         self.device = device
+        self._session = None
        
     def hexformat(self, string):
         out = "".join("{:x}".format(ord(x)) for x in string)
@@ -386,8 +476,27 @@ class DaVinciJr10(PrinterInterface):
         sys.stdout.write(line)
 
     def connect(self, callback=None):
+        if self._session and callback is None:
+            return self._session
         return SerialConnection(self.device, callback, drain=True)
 
+    @contextmanager
+    def session(self):
+        """
+        Keep one connection open for every command inside the
+        with block, instead of opening the port for each one.
+        """
+        if self._session:
+            yield self._session
+            return
+        conn = SerialConnection(self.device, drain=True)
+        with conn:
+            self._session = conn
+            try:
+                yield conn
+            finally:
+                self._session = None
+
     def console(self):
         with self.connect(self._console_print) as h:
             line = None
@@ -438,7 +547,8 @@ class DaVinciJr10(PrinterInterface):
 
     def config_cmd(self, value):
         with self.connect() as conn:
-            return self.generic_cmd(conn, self.ConfigCmd, value)
+            self.generic_cmd(conn, self.ConfigCmd, value)
+            return self.read_response(conn, "ok")
 
     def pause(self):
         self.writeline(self.PauseCmd)
@@ -454,82 +564,188 @@ class DaVinciJr10(PrinterInterface):
             self._print_continue = True
 
     def unlock_filament(self):
-        self.config_cmd("pda:[1591]")
-        self.config_cmd("pdb:[4387]")
-        self.config_cmd("pdc:[7264]")
-        self.config_cmd("pde:[8046]")
+        with self.session():
+            self.config_cmd("pda:[1591]")
+            self.config_cmd("pdb:[4387]")
+            self.config_cmd("pdc:[7264]")
+            self.config_cmd("pde:[8046]")
 
     def write_firmware(self, filename):
         """
-        Print the given data or file.
+        Write the given firmware file to the printer.
         """
         print("Firmware update disabled - highly experimental!")
         return
 
         with open(filename, 'rb') as f:
-            data = f.read()
+            header = f.read(16).decode("ascii", "replace")
             size = os.fstat(f.fileno()).st_size - 16
-            header = data[:16]
-            body = data[16:]
-            model = header.split("+")[0]
-            newversion = header.split("+")[1]
+        model = header.split("+")[0]
+        newversion = header.split("+")[1]
         log.info("Writing firmware for model {}, version {}, {} bytes".format(model, newversion, size))
-        # Start upload
-        with self.connect() as conn:
-            opts = ""
-            cmd = self.FirmwareCmd.format(filename=os.path.basename(filename), size=size)
-            cmd += ",Downgrade"
-            conn.writeline(cmd)
-            conn.wait_for_ok()
-            # Send file data
-            chunks = (len(body)+8191) / 8192
-            prev = ""
-            blocksize = 8192
-            for n in range(0, chunks):
-                log.debug("Sending file chunk {}/{}".format(n, chunks))
-                chunk = struct.pack(">l", n) + struct.pack(">l", blocksize)
-                start = 8192*n
-                chunk += body[start:start+8192]
-                chunk += "\x00\x00\x00\x00"
-                conn.write(chunk)
-                # Expect "ok\n"
-                conn.wait_for_ok()
-            # Send finish; expect no response
-            conn.write(self.UploadDidFinishCmd)
-            
-    def print_data(self, filename, data=None, savetosd=False):
+        name = os.path.basename(filename)
+        cmd = self.FirmwareCmd.format(filename=name, size=size)
+        cmd += ",Downgrade"
+        self.upload(cmd, self.file_chunks(filename, 16), UploadState(name, size))
+
+    def file_chunks(self, filename, offset=0):
+        """
+        Yield BlockSize slices of the file from offset on, as
+        memoryviews of a memory map so none of them is copied.
+        Each slice is only valid until the next one is taken, so
+        print_stream() copies them as it queues them ahead.
+        """
+        with open(filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size <= offset:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    for start in range(offset, len(view), self.BlockSize):
+                        chunk = view[start:start+self.BlockSize]
+                        try:
+                            yield chunk
+                        finally:
+                            # Also when the upload stops partway
+                            chunk.release()
+                finally:
+                    view.release()
+
+    def print_data(self, filename, data=None, savetosd=False, state=None):
         """
         Print the given data or file.
+
+        Files are sent straight from a memory map instead of
+        being read into memory first.
         """
         if not data and os.path.exists(filename):
-            with open(filename, 'rb') as f:
-                data = f.read()
-                size = os.fstat(f.fileno()).st_size
+            size = os.path.getsize(filename)
+            chunks = self.file_chunks(filename)
         else:
             size = len(data)
+            view = memoryview(data)
+            chunks = (view[start:start+self.BlockSize] for start in range(0, size, self.BlockSize))
+        cmd, state = self.upload_cmd(filename, size, savetosd, state)
+        self.upload(cmd, chunks, state)
+
+    def upload_cmd(self, filename, size, savetosd=False, state=None):
         path = FilePath(filename)
         path.file_type = ".gcode"
-        # Start upload
-        with self.connect() as conn:
-            opts = ""
-            if savetosd:
-                opts = self.SaveToSD
-            cmd = self.UploadCmd.format(filename=path.path, size=size, option=opts)
-            conn.writeline(cmd)
-            conn.wait_for_ok()
-            # Send file data
-            chunks = (len(data)+8191) / 8192
-            prev = ""
-            blocksize = 8192
-            for n in range(0, chunks):
-                log.debug("Sending file chunk {}/{}".format(n, chunks))
-                chunk = struct.pack(">l", n) + struct.pack(">l", blocksize)
-                start = 8192*n
-                chunk += data[start:start+8192]
-                chunk += "\x00\x00\x00\x00"
-                conn.write(chunk)
+        opts = ""
+        if savetosd:
+            opts = self.SaveToSD
+        cmd = self.UploadCmd.format(filename=path.path, size=size, option=opts)
+        return cmd, state or UploadState(path.path, size)
+
+    def send_chunk(self, conn, n, frame):
+        """
+        Send one framed chunk and wait for its "ok", resending
+        it with backoff if the acknowledgement doesn't come.
+        """
+        for attempt in range(self.ChunkRetries + 1):
+            try:
+                conn.write(frame)
                 # Expect "ok\n"
+                conn.wait_for_ok(timeout=self.ChunkTimeout)
+                return
+            except PrinterError as e:
+                if attempt == self.ChunkRetries:
+                    raise
+                delay = self.RetryBackoff * 2 ** attempt
+                log.warning("Chunk {} not acknowledged ({}), resending in {:.1f}s".format(n, e, delay))
+                time.sleep(delay)
+                conn.discard()
+
+    def upload(self, cmd, chunks, state):
+        """
+        Send the upload or firmware command cmd, then the data
+        from chunks framed one at a time in a reused buffer.
+
+        If a chunk fails after all retries, UploadError carries
+        the UploadState. Calling again with the same chunks and
+        state=error.state continues the upload from that chunk.
+        """
+        framer = ChunkFramer(self.BlockSize)
+        with self.connect() as conn:
+            if not state.started:
+                conn.writeline(cmd)
                 conn.wait_for_ok()
+                state.started = True
+            else:
+                log.info("Resuming upload of {} at chunk {}".format(state.filename, state.chunk))
+            # Send file data
+            for n, chunk in enumerate(chunks):
+                if n < state.chunk:
+                    # Already acknowledged before resuming
+                    continue
+                log.debug("Sending file chunk {} ({}/{} bytes)".format(n, state.sent, state.size))
+                frame = framer.frame(n, chunk)
+                try:
+                    self.send_chunk(conn, n, frame)
+                except (PrinterError, serial.SerialException, OSError) as e:
+                    raise UploadError("Upload of {} failed at chunk {}: {}".format(state.filename, n, e), state)
+                state.chunk = n + 1
+                state.sent += len(chunk)
 
             # Send finish; expect no response
             conn.write(self.UploadDidFinishCmd)
+            state.finished = True
+
+    def print_stream(self, filename, size, chunks, savetosd=False, state=None):
+        """
+        Print size bytes of data produced by the iterable chunks,
+        such as the generator from ThreeWFile.stream.
+
+        Chunks are produced on a separate thread into a bounded
+        queue, so producing later chunks overlaps with sending
+        earlier ones. They are queued as bytes, since sources such
+        as file_chunks only keep a chunk valid until the next one is
+        taken. Failed uploads resume as with upload().
+        """
+        queue = Queue(maxsize=self.QueueSize)
+        stop = Event()
+
+        def put(item):
+            """
+            Queue item, unless the upload stops first.
+            """
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for chunk in chunks:
+                    if not put(bytes(chunk)):
+                        return
+                put(None)
+            except Exception as e:
+                log.exception("Producing upload data failed")
+                put(e)
+            finally:
+                close = getattr(chunks, "close", None)
+                if close:
+                    close()
+
+        def consume():
+            while True:
+                chunk = queue.get()
+                if chunk is None:
+                    return
+                elif isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+
+        producer = Thread(target=produce, name="upload-producer")
+        producer.daemon = True
+        producer.start()
+        try:
+            cmd, state = self.upload_cmd(filename, size, savetosd, state)
+            self.upload(cmd, consume(), state)
+        finally:
+            stop.set()
+            producer.join()
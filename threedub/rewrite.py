@@ -0,0 +1,283 @@
+import re
+from bisect import bisect_right
+from decimal import Decimal
+from functools import partial
+from itertools import accumulate, chain, count, islice
+from operator import add, itemgetter
+from .gcode import GCodeFile
+
+
+def format_number(value):
+    """
+    Format a gcode word value without trailing zeros.
+    """
+    text = "{:.15g}".format(value)
+    if "e" in text:
+        # Spell out very small or large values, which gcode doesn't
+        # read in exponent form
+        text = "{:f}".format(Decimal(text))
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    return text if text != "-0" else "0"
+
+
+class Rule(object):
+    """
+    A statement rewrite: a regular expression over the text of the
+    file, in multiline mode, and its replacement. replace is either
+    a template for match.expand or a function of the match.
+
+    If codes is given, the rule only applies to matches on lines
+    with one of those codes, outside of inline comments. Codes are
+    those of the original line, before any other rule changed it.
+    """
+    def __init__(self, pattern, replace, codes=None):
+        self.pattern = pattern
+        self.replace = replace
+        self.codes = frozenset(codes) if codes is not None else None
+        self.regex = re.compile(pattern, re.M)
+
+    @classmethod
+    def replace_code(cls, old, new):
+        """
+        Change the code of statements starting with old.
+        """
+        return cls(r"^{}(?= )".format(re.escape(old)), new)
+
+    @classmethod
+    def strip_codes(cls, codes):
+        """
+        Remove statements with any of the given codes.
+        """
+        alternatives = "|".join(re.escape(code) for code in codes)
+        return cls(r"^(?:{})(?![0-9.])[^\n]*\n".format(alternatives), "")
+
+    @classmethod
+    def clamp(cls, codes, word, low=None, high=None):
+        """
+        Limit the value of a word, such as S of M104 or F of G1,
+        to between low and high.
+        """
+        def replace(match):
+            value = float(match.group(2))
+            clamped = value
+            if low is not None:
+                clamped = max(clamped, low)
+            if high is not None:
+                clamped = min(clamped, high)
+            if clamped == value:
+                return match.group(0)
+            return match.group(1) + format_number(clamped)
+        return cls(r"(?<![A-Za-z0-9.])({})(-?[0-9]*\.?[0-9]+)".format(re.escape(word)), replace, codes)
+
+    @property
+    def line_start(self):
+        """
+        True if the pattern only matches at the start of a line: it
+        starts with ^ and has no | outside of groups.
+        """
+        if not self.pattern.startswith("^"):
+            return False
+        depth = 0
+        escaped = in_set = False
+        for char in self.pattern:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif in_set:
+                in_set = char != "]"
+            elif char == "[":
+                in_set = True
+            elif char == "(":
+                depth += 1
+            elif char == ")":
+                depth -= 1
+            elif char == "|" and depth == 0:
+                return False
+        return True
+
+    def apply(self, match):
+        return self.replace(match) if callable(self.replace) else match.expand(self.replace)
+
+
+class RuleSet(object):
+    """
+    Rules compiled into one regular expression, so that every
+    rewrite is applied in a single sweep over the text instead of
+    one loop per rule. Where rules match at the same place, the
+    first one in the list that applies to the line wins.
+
+    If every rule matches only at the start of lines, as those
+    changing or stripping codes do, the expression looks for them
+    after newlines instead, which the regex engine skips to much
+    faster than it tries ^ at every character.
+    """
+    # Lines joined into one text for each sweep
+    LineBatch = 0x10000
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.regex = None
+        self.line_start = bool(self.rules) and all(rule.line_start for rule in self.rules)
+        if self.line_start:
+            self.regex = re.compile("\n(?:{})".format("|".join(
+                "(?P<r{}>{})".format(n, rule.pattern[1:]) for n, rule in enumerate(self.rules)
+            )), re.M)
+        elif self.rules:
+            self.regex = re.compile("|".join(
+                "(?P<r{}>{})".format(n, rule.pattern) for n, rule in enumerate(self.rules)
+            ), re.M)
+
+    @staticmethod
+    def line_code(text, pos):
+        """
+        Return the code of the line containing pos, or None if
+        pos is in a comment.
+        """
+        start = text.rfind("\n", 0, pos) + 1
+        head = text[start:pos]
+        if ";" in head:
+            return None
+        end = text.find(" ", start, pos)
+        return text[start:end if end >= 0 else pos]
+
+    def rule_match(self, text, start, match):
+        """
+        Return the first rule applying at start in text, where the
+        combined expression matched, and its own match, or None.
+        """
+        code = None
+        # Earlier rules didn't match here
+        for rule in self.rules[int(match.lastgroup[1:]):]:
+            found = rule.regex.match(text, start)
+            if not found:
+                continue
+            if rule.codes is not None:
+                if code is None:
+                    code = self.line_code(text, start) or ""
+                if code not in rule.codes:
+                    continue
+            return rule, found
+        return None
+
+    def edits(self, text):
+        """
+        Yield a (start, end, replacement) tuple for each span of text
+        the rules change, in order.
+        """
+        if not self.regex:
+            return
+        # With line_start, a match at the newline before a line is
+        # at the position of the line in text
+        search = partial(self.regex.search, "\n" + text if self.line_start else text)
+        match = search(0)
+        while match:
+            start = match.start()
+            applied = self.rule_match(text, start, match)
+            if applied is None:
+                # Nothing to do here; look again from the next character
+                pos = start + 1
+            else:
+                rule, found = applied
+                pos = found.end()
+                yield start, pos, rule.apply(found)
+                if pos == start:
+                    pos += 1
+            match = search(pos) if pos <= len(text) else None
+
+    @staticmethod
+    def reshapes(old, new):
+        """
+        Return True if replacing old with new may change the length
+        or kind of the line: if their lengths differ, if either has a
+        newline or semicolon, or if new starts or ends with spaces.
+        """
+        return (len(old) != len(new) or "\n" in old or "\n" in new
+                or ";" in old or ";" in new or new != new.strip())
+
+    def rewrite(self, text):
+        """
+        Rewrite text of whole lines, each ending in a newline. Returns
+        the new text, and whether any line may have changed length or
+        kind, for GCodeFile.rewrite.
+        """
+        parts = []
+        pos = 0
+        reshaped = False
+        for start, end, replacement in self.edits(text):
+            parts.append(text[pos:start])
+            parts.append(replacement)
+            reshaped = reshaped or self.reshapes(text[start:end], replacement)
+            pos = end
+        if not parts:
+            return text, False
+        parts.append(text[pos:])
+        return "".join(parts), reshaped
+
+    def apply(self, text):
+        """
+        Rewrite text of whole lines, each ending in a newline.
+        """
+        return self.rewrite(text)[0]
+
+    @staticmethod
+    def regions(text, ends, edits):
+        """
+        Group edits of text by the lines they change, where ends is the
+        position past the newline of each line. Yield the first line
+        and the line after the last of each group, and its new text.
+        """
+        def end_of(line):
+            return ends[min(line, len(ends)) - 1] if line else 0
+        first = None
+        for start, end, replacement in chain(edits, [(None, None, None)]):
+            line = len(ends) + 1 if start is None else bisect_right(ends, start)
+            while first is not None and line >= last:
+                new = "".join(parts) + text[pos:end_of(last)]
+                if new and not new.endswith("\n") and last < len(ends):
+                    # Runs into the next line, as in the joined text
+                    last += 1
+                else:
+                    yield first, last, new
+                    first = None
+            if start is None:
+                return
+            if first is None:
+                first, last, pos, parts = line, line + 1, end_of(line), []
+            parts += [text[pos:start], replacement]
+            pos = end
+            last = max(last, (bisect_right(ends, end - 1) if end > start else line) + 1)
+
+    def stage(self, lines, meta=None):
+        """
+        Translation stage applying the rules to batches of
+        (kind, text) lines. Lines the rules don't change are passed
+        on as they are; the others are classified again.
+        """
+        if not self.regex:
+            for item in lines:
+                yield item
+            return
+        lines = iter(lines)
+        while True:
+            batch = list(islice(lines, self.LineBatch))
+            if not batch:
+                return
+            texts = list(map(itemgetter(1), batch))
+            text = "\n".join(texts) + "\n"
+            edits = list(self.edits(text))
+            if not edits:
+                for item in batch:
+                    yield item
+                continue
+            ends = list(map(add, accumulate(map(len, texts)), count(1)))
+            done = 0
+            for first, last, new in self.regions(text, ends, edits):
+                for item in islice(batch, done, first):
+                    yield item
+                for item in GCodeFile.classify(new.split("\n")[:-1]):
+                    yield item
+                done = last
+            for item in islice(batch, done, None):
+                yield item
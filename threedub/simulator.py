@@ -0,0 +1,218 @@
+import logging
+import os
+import pty
+import tty
+import time
+import struct
+import select
+from argparse import ArgumentParser
+from threading import Thread, Event
+
+log = logging.getLogger(__name__)
+
+
+class SimulatedUpload(object):
+    def __init__(self, filename, size, options):
+        self.filename = filename
+        self.size = size
+        self.options = options
+        self.data = bytearray()
+        self.chunks = 0
+        self.finished = False
+
+
+class SimulatedPrinter(Thread):
+    """
+    A Da Vinci Jr. on a pseudo-terminal, speaking enough of the XYZv3
+    serial protocol for DaVinciJr10 to query, configure and upload.
+
+    Open the printer with DaVinciJr10(sim.device). latency adds a
+    delay before each response, and baudrate throttles both
+    directions to the speed of a real serial link.
+    """
+    IdleState = "9511,0"
+    PrintingState = "9505,0"
+    Status = [
+        ("b", "25"),
+        ("d", "0,0,0"),
+        ("e", "0"),
+        ("f", "1,120000"),
+        ("i", "3F10XPUS5TH1234"),
+        ("L", "1,100,100"),
+        ("n", "simulator"),
+        ("o", "p8,t1,c1,a+"),
+        ("p", "dv1J00A000"),
+        ("s", '{"sd":"yes","dr":{"top":"off","front":"off"}}'),
+        ("t", "1,20"),
+        ("v", "1.1.2"),
+        ("w", "1,PLA0000000000"),
+    ]
+    QueryCmd = b"XYZv3/query="
+    UploadCmd = b"XYZv3/upload="
+    ConfigCmd = b"XYZv3/config="
+    UploadDidFinishCmd = b"XYZv3/uploadDidFinish"
+
+    def __init__(self, latency=0.0, baudrate=None, print_time=0.0):
+        super(SimulatedPrinter, self).__init__()
+        self.daemon = True
+        self.latency = latency
+        self.baudrate = baudrate
+        self.print_time = print_time
+        self.commands = []
+        self.uploads = []
+        self.config = []
+        # Chunk indices whose "ok" is withheld, once per entry
+        self.drop_acks = []
+        self._upload = None
+        self._printing_until = 0
+        self._buf = bytearray()
+        self._halt = Event()
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.device = os.ttyname(self.slave)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc, msg, tb):
+        self.stop()
+
+    def stop(self):
+        self._halt.set()
+        if self.is_alive():
+            self.join()
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    @property
+    def state(self):
+        if time.time() < self._printing_until:
+            return self.PrintingState
+        return self.IdleState
+
+    def run(self):
+        while not self._halt.is_set():
+            ready, _, _ = select.select([self.master], [], [], 0.05)
+            if not ready:
+                continue
+            try:
+                data = os.read(self.master, 0x10000)
+            except OSError:
+                break
+            self._throttle(len(data))
+            self._buf += data
+            self._process()
+
+    def _throttle(self, size):
+        if self.baudrate:
+            # 8N1 framing: 10 bits per byte
+            time.sleep(size * 10.0 / self.baudrate)
+
+    def _respond(self, data):
+        if self.latency:
+            time.sleep(self.latency)
+        self._throttle(len(data))
+        while data:
+            written = os.write(self.master, data)
+            data = data[written:]
+
+    def _process(self):
+        while True:
+            # Frames start with the high byte of the chunk index
+            if self._upload and (not self._upload.finished or self._buf[:1] == b"\0"):
+                if not self._upload_frame():
+                    return
+            elif self._buf.startswith(self.UploadDidFinishCmd):
+                # Sent without a line ending
+                del self._buf[:len(self.UploadDidFinishCmd)]
+                self._finish_upload()
+            elif b"\n" in self._buf:
+                pos = self._buf.index(b"\n") + 1
+                line = bytes(self._buf[:pos]).strip()
+                del self._buf[:pos]
+                if line:
+                    self._command(line)
+            else:
+                return
+
+    def _command(self, line):
+        log.debug("Simulator got {!r}".format(line))
+        self.commands.append(line.decode("ascii", "replace"))
+        if line.startswith(self.QueryCmd):
+            self._respond(self.status_text(line[len(self.QueryCmd):].decode("ascii")))
+        elif line.startswith(self.UploadCmd):
+            parts = line[len(self.UploadCmd):].decode("ascii").split(",")
+            self._upload = SimulatedUpload(parts[0], int(parts[1]), parts[2:])
+            self.uploads.append(self._upload)
+            self._respond(b"ok\n")
+        elif line.startswith(self.ConfigCmd):
+            self.config.append(line[len(self.ConfigCmd):].decode("ascii"))
+            self._respond(b"ok\n")
+        else:
+            self._respond(b"ok\n")
+
+    def _upload_frame(self):
+        upload = self._upload
+        if len(self._buf) < 8:
+            return False
+        index, blocksize = struct.unpack(">ll", bytes(self._buf[:8]))
+        # Resent after a lost "ok" if it's the chunk already stored last
+        resent = index == upload.chunks - 1
+        if resent:
+            length = len(upload.data) - index * blocksize
+        else:
+            length = min(blocksize, upload.size - len(upload.data))
+        if len(self._buf) < 8 + length + 4:
+            return False
+        if not resent:
+            if index != upload.chunks:
+                log.warning("Simulator expected chunk {}, got {}".format(upload.chunks, index))
+            upload.data += self._buf[8:8 + length]
+            upload.chunks += 1
+        del self._buf[:8 + length + 4]
+        if len(upload.data) >= upload.size:
+            upload.finished = True
+        if index in self.drop_acks:
+            self.drop_acks.remove(index)
+            return True
+        self._respond(b"ok\n")
+        return True
+
+    def _finish_upload(self):
+        self.commands.append(self.UploadDidFinishCmd.decode("ascii"))
+        self._upload = None
+        self._printing_until = time.time() + self.print_time
+
+    def status_text(self, query):
+        """
+        Return the response to a status query: all values
+        for "a", otherwise the requested keys.
+        """
+        lines = list(self.Status) + [("j", self.state)]
+        if query != "a":
+            lines = [(key, value) for key, value in lines if key in query]
+        text = "".join("{}:{}\n".format(key, value) for key, value in lines)
+        return (text + "$\n").encode("ascii")
+
+
+def main(argv=None):
+    ap = ArgumentParser(description="Run a simulated Da Vinci Jr. on a pseudo-terminal")
+    ap.add_argument("-l", "--latency", type=float, default=0.0, help="Seconds to wait before each response")
+    ap.add_argument("-b", "--baudrate", type=int, default=None, help="Throttle traffic to this baud rate")
+    ap.add_argument("-t", "--print-time", type=float, default=0.0, help="Seconds each uploaded job 'prints' for")
+    ap.add_argument("-d", "--debug", action="store_true", help="Debug logging")
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    with SimulatedPrinter(args.latency, args.baudrate, args.print_time) as sim:
+        print("Simulated printer on {}".format(sim.device))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+    return 0
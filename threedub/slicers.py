@@ -3,33 +3,17 @@ from .bases import Slicer
 class Slic3r(Slicer):
     name = "slic3r"
     description = "Slic3r"
+    # Slic3r splits on =
+    separator = "="
 
     def detect(self, gcode):
         """
         Slic3r is detected if comments use filament_used =
         or contain "Slic3r"
         """
-        for stmt in gcode.headers:
-            if "Slic3r" in stmt.line:
-                return True
-            elif "filament_used =" in stmt.line:
-                return True
-        return False
+        text = gcode.header_text
+        return "Slic3r" in text or "filament_used =" in text
 
-    def header_values(self, gcode):
-        """
-        Return all header values that could
-        be extracted from the file.
-        """
-        values = {}
-        for cmt in gcode.headers:
-            string = cmt.line.strip("; ")
-            # Slic3r splits on =
-            parts = [s.strip() for s in string.split("=", 1)]
-            if len(parts) > 1:
-                values[parts[0]] = parts[1]
-        return values
-        
     def metadata(self, gcode):
         info = self.header_values(gcode)
         meta = {}
@@ -43,29 +27,14 @@ class Slic3r(Slicer):
 class XYZSlicer(Slicer):
     name = "xyz"
     description = "XYZ"
+    # XYZ splits on =
+    separator = "="
 
     def detect(self, gcode):
         """
         Look for 'total_filament'
         """
-        for stmt in gcode.headers:
-            if "total_filament" in stmt.line:
-                return True
-        return False
-
-    def header_values(self, gcode):
-        """
-        Return all header values that could
-        be extracted from the file.
-        """
-        values = {}
-        for cmt in gcode.headers:
-            string = cmt.line.strip("; ")
-            # XYZ splits on =
-            parts = [s.strip() for s in string.split("=", 1)]
-            if len(parts) > 1:
-                values[parts[0]] = parts[1]
-        return values
+        return "total_filament" in gcode.header_text
 
     def metadata(self, gcode):
         info = self.header_values(gcode)
@@ -75,35 +44,18 @@ class XYZSlicer(Slicer):
             filament = filament.replace("mm", "")
         meta['total_filament'] = filament
         return meta
-    
+
 class Cura(Slicer):
     name = "cura"
     description = "Ultimaker Cura"
+    # Cura splits on :
+    separator = ":"
 
     def detect(self, gcode):
         """
-        Slic3r is detected if comments use filament_used =
-        or contain "Slic3r"
-        """
-        for stmt in gcode.headers:
-            if "Filament used:" in stmt.line:
-                return True
-        return False
-
-
-    def header_values(self, gcode):
-        """
-        Return all header values that could
-        be extracted from the file.
+        Cura is detected if comments use "Filament used:"
         """
-        values = {}
-        for cmt in gcode.headers:
-            string = cmt.line.strip("; ")
-            # Cura splits on :
-            parts = [s.strip() for s in string.split(":", 1)]
-            if len(parts) > 1:
-                values[parts[0]] = parts[1]
-        return values
+        return "Filament used:" in gcode.header_text
 
     def metadata(self, gcode):
         info = self.header_values(gcode)
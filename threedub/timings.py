@@ -0,0 +1,167 @@
+import json
+import logging
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+
+class Stage(object):
+    """
+    Measurements of one stage. lines and bytes are filled in by
+    the code being timed, when it knows how much it processed.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak_memory = None
+        self.lines = None
+        self.bytes = None
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class Timings(object):
+    """
+    Record wall time and CPU time for each stage run inside stage(),
+    and peak Python memory use if memory is set. A disabled instance
+    records nothing, so callers can time unconditionally.
+
+    Steps of a generator pipeline run interleaved, so they are
+    timed with timed() instead, which adds up the time spent in each
+    step. Time spent in a timed step is not counted again in the
+    stage or step that consumes it.
+
+    Peak memory is traced with tracemalloc, which only sees Python
+    allocations and slows the run down, so it is only started when
+    asked for. The process's maximum resident size is always given
+    in as_dict().
+    """
+    def __init__(self, enabled=True, memory=False):
+        self.enabled = enabled
+        self.memory = enabled and memory
+        self.stages = []
+        # Wall and CPU time of timed steps, for each stage or step running
+        self._nested = []
+        # Highest traced memory seen so far by each stage running
+        self._peaks = []
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _enter(self):
+        self._nested.append([0.0, 0.0])
+        return time.perf_counter(), time.process_time()
+
+    def _exit(self, stage, started):
+        wall = time.perf_counter() - started[0]
+        cpu = time.process_time() - started[1]
+        nested = self._nested.pop()
+        stage.wall += wall - nested[0]
+        stage.cpu += cpu - nested[1]
+        if self._nested:
+            self._nested[-1][0] += wall
+            self._nested[-1][1] += cpu
+
+    def _enter_memory(self):
+        current, peak = tracemalloc.get_traced_memory()
+        if self._peaks:
+            # Resetting the peak for this stage would lose the outer one's
+            self._peaks[-1] = max(self._peaks[-1], peak)
+        tracemalloc.reset_peak()
+        self._peaks.append(current)
+        return current
+
+    def _exit_memory(self, stage, base):
+        peak = max(tracemalloc.get_traced_memory()[1], self._peaks.pop())
+        stage.peak_memory = max(peak - base, 0)
+        if self._peaks:
+            self._peaks[-1] = max(self._peaks[-1], peak)
+
+    @contextmanager
+    def stage(self, name, lines=None, bytes=None):
+        stage = Stage(name)
+        stage.lines = lines
+        stage.bytes = bytes
+        if not self.enabled:
+            yield stage
+            return
+        base = self._enter_memory() if self.memory else None
+        started = self._enter()
+        try:
+            yield stage
+        finally:
+            self._exit(stage, started)
+            if self.memory:
+                self._exit_memory(stage, base)
+            self.stages.append(stage)
+
+    def timed(self, name, items, size=None):
+        """
+        Return an iterator over items that records the time spent
+        producing them as the stage name. Items are counted as lines,
+        or as bytes with size(item) if size is given.
+        """
+        if not self.enabled:
+            return iter(items)
+        stage = Stage(name)
+        self.stages.append(stage)
+        return self._timed(stage, iter(items), size)
+
+    def _timed(self, stage, items, size):
+        if size:
+            stage.bytes = 0
+        else:
+            stage.lines = 0
+        while True:
+            started = self._enter()
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            finally:
+                self._exit(stage, started)
+            if size:
+                stage.bytes += size(item)
+            else:
+                stage.lines += 1
+            yield item
+
+    def as_dict(self):
+        try:
+            import resource
+            # Kilobytes on Linux, bytes on macOS
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        except ImportError:
+            # Not available on Windows
+            max_rss = None
+        return {
+            "stages": [stage.as_dict() for stage in self.stages],
+            "wall": sum(stage.wall for stage in self.stages),
+            "cpu": sum(stage.cpu for stage in self.stages),
+            "max_rss": max_rss,
+        }
+
+    def report(self, f=None):
+        f = f or sys.stderr
+        f.write("{:18s} {:>9s} {:>9s} {:>10s} {:>10s} {:>12s}\n".format(
+            "stage", "wall (s)", "cpu (s)", "peak (MB)", "lines", "bytes"))
+        for stage in self.stages:
+            f.write("{:18s} {:9.3f} {:9.3f} {:>10s} {:>10s} {:>12s}\n".format(
+                stage.name, stage.wall, stage.cpu,
+                "" if stage.peak_memory is None else "{:.1f}".format(stage.peak_memory / (1024.0 * 1024.0)),
+                "" if stage.lines is None else str(stage.lines),
+                "" if stage.bytes is None else str(stage.bytes)))
+        total = self.as_dict()
+        f.write("{:18s} {:9.3f} {:9.3f}\n".format("total", total["wall"], total["cpu"]))
+
+    def write(self, path):
+        """
+        Write the measurements to path as JSON.
+        """
+        with open(path, "w") as f:
+            json.dump(self.as_dict(), f, indent=2)
+            f.write("\n")
@@ -1,7 +1,15 @@
 import logging
-from collections import MutableMapping
+import os
+from collections import deque
+from functools import partial
+from collections.abc import MutableMapping
 from .models import ModelTranslator
+from . import slicers
 from .bases import Slicer
+from .gcode import GCodeFile, GCodeStream
+from .filepath import FilePath
+from .timings import Timings
+from . import analysis
 
 log = logging.getLogger(__name__)
 
@@ -29,39 +37,182 @@ class Metadata(MutableMapping):
         
         
 class GCodeTranslator(object):
-    def __init__(self, model, slicer):
+    # Lines kept from each end of a .3w body for slicer detection
+    ProbeLines = 1000
+
+    def __init__(self, model, slicer, analyze=True, optimizer=None):
         self.model = model
         self.slicer = slicer
+        self.analyze = analyze
+        # Optional last stage, such as a GCodeOptimizer
+        self.optimizer = optimizer
+
+    def find_slicer(self, gcode):
+        """
+        Return an instance of the requested slicer, or of the first
+        one that detects the file when set to auto.
+        """
+        slicers = {s.name: s for s in Slicer.implementations()}
+        if self.slicer != "auto":
+            name = getattr(self.slicer, "name", self.slicer)
+            if name in slicers:
+                return slicers[name]()
+            raise Exception("Slicer {} not found".format(self.slicer))
+        for slicer in list(slicers.values()):
+            inst = slicer()
+            try:
+                if inst.detect(gcode):
+                    log.debug("Appears to be {} output".format(inst.name))
+                    return inst
+            except Exception as e:
+                log.exception("Slicer translation '{}' failed".format(inst))
+        return None
+
+    def slicer_values(self, gcode, slicer):
+        """
+        Return the slicer's metadata for the file, or an empty dict.
+        """
+        if slicer is None:
+            return {}
+        try:
+            return dict(slicer.metadata(gcode))
+        except Exception as e:
+            if self.slicer != "auto":
+                raise
+            log.exception("Slicer translation '{}' failed".format(slicer))
+        return {}
+
+    def metadata(self, gcode, slicer, defaults=None):
+        """
+        Return the slicer's metadata for the file, on top of
+        the given defaults.
+        """
+        values = dict(defaults or {})
+        values.update(self.slicer_values(gcode, slicer))
+        return Metadata(values)
+
+    def needs_analysis(self, values):
+        """
+        Return True if toolpath analysis is on and would fill in
+        header values missing from the slicer's values.
+        """
+        return self.analyze and not all(name in values for name in analysis.ToolpathAnalyzer.Fields)
+
+    def probe(self, path):
+        """
+        Detect the slicer and read its metadata from the head and
+        tail of the file at path, without parsing the whole file.
+        Returns a (slicer, metadata) tuple; slicer may be None.
+        """
+        slicer, found = self.probe_values(path)
+        return slicer, Metadata(found)
+
+    def probe_values(self, path):
+        """
+        As probe(), but return the slicer's values as slicer_values()
+        does, for passing on to translate().
+        """
+        gcode = GCodeFile.probe(path)
+        slicer = self.find_slicer(gcode)
+        return slicer, self.slicer_values(gcode, slicer)
+
+    def model_translator(self):
+        model = [t for t in ModelTranslator.implementations() if t.model == self.model]
+        if not model:
+            log.error("Model translator not found: {}".format(self.model))
+            return None
+        return model[0]()
 
-    def translate(self, gcode, filename):
+    def translate(self, gcode, filename, slicer=None, found=None):
         # Translate from slicer    
         log.debug("Translating gcode to model {} using slicer {}".format(self.model, self.slicer))
-        slicers = {s.name: s for s in Slicer.implementations()}
-        values = Metadata()
-        if self.slicer == "auto":
-            for slicer in list(slicers.values()):
-                inst = slicer()
-                try:
-                    if inst.detect(gcode):
-                        values = Metadata(inst.metadata(gcode))
-                        log.debug("Appears to be {} output".format(inst.name))
-                        break
-                except Exception as e:
-                    log.exception("Slicer translation '{}' failed".format(inst))
-        else:
-            if self.slicer.name in slicers:
-                slicer = slicers[self.slicer.name]()
-                values = Metadata(slicer.metadata(gcode))
-            else:
-                raise Exception("Slicer {} not found".format(self.slicer))
+        # Slicer values already read, as by probe_values(), aren't looked for again
+        if found is None:
+            if slicer is None:
+                slicer = self.find_slicer(gcode)
+            found = self.slicer_values(gcode, slicer)
+        # Values measured from the moves, unless the slicer has them
+        toolpath = analysis.analyze(gcode) if self.needs_analysis(found) else {}
+        values = Metadata(dict(toolpath, **found))
 
         # Set filename
         values['filename'] = filename
         log.debug("Values for translation: {}".format(values))
 
         # Translate to model
-        model = [t for t in ModelTranslator.implementations() if t.model == self.model]
+        model = self.model_translator()
         if model:
-            model[0]().translate(gcode, values)
+            model.translate(gcode, values)
+        if self.optimizer:
+            gcode.items = self.optimizer.stage(gcode.items, values)
+
+    def header_values(self, path, filename, workers=1, timings=None):
+        """
+        Return the values for the model header of the gcode or .3w
+        file at path: the slicer's metadata from the head and tail of
+        the file, over values measured from its moves if the slicer
+        doesn't provide them all. Gcode files are probed, and only
+        read whole for that analysis. A .3w body is decrypted once,
+        keeping only its first and last ProbeLines lines for slicer
+        detection while it is analyzed. The detect and analyze stages
+        are recorded in timings, if given.
+        """
+        log.debug("Reading header values for model {} using slicer {}".format(self.model, self.slicer))
+        timings = timings or Timings(enabled=False)
+        toolpath = {}
+        if FilePath(path).file_type == FilePath.XYZ3wFile:
+            from .davinci import ThreeWReader
+            head = []
+            tail = deque(maxlen=self.ProbeLines)
+            def pieces(reader):
+                for piece in analysis.line_pieces(reader.chunks()):
+                    lines = piece.split(b"\n")
+                    if piece.endswith(b"\n"):
+                        lines.pop()
+                    if len(head) < self.ProbeLines:
+                        count = self.ProbeLines - len(head)
+                        head.extend(lines[:count])
+                        lines = lines[count:]
+                    tail.extend(lines)
+                    yield piece
+            with timings.stage("analyze", bytes=os.path.getsize(path)), \
+                    ThreeWReader(path, workers=workers) as reader:
+                if self.analyze:
+                    toolpath = analysis.analyze_pieces(pieces(reader))
+                else:
+                    deque(pieces(reader), maxlen=0)
+            with timings.stage("detect"):
+                probed = GCodeFile.from_lines(line.decode("utf-8") for line in head + list(tail))
+                slicer = self.find_slicer(probed)
+            found = self.slicer_values(probed, slicer)
         else:
-            log.error("Model translator not found: {}".format(self.model))
+            with timings.stage("detect"):
+                probed = GCodeFile.probe(path)
+                slicer = self.find_slicer(probed)
+            found = self.slicer_values(probed, slicer)
+            if self.needs_analysis(found):
+                with timings.stage("analyze", bytes=os.path.getsize(path)), open(path, 'rb') as f:
+                    blocks = iter(partial(f.read, 0x100000), b"")
+                    toolpath = analysis.analyze_pieces(analysis.line_pieces(blocks))
+        values = Metadata(dict(toolpath, **found))
+        values['filename'] = filename
+        log.debug("Values for translation: {}".format(values))
+        return values
+
+    def stream(self, path, values, workers=1, timings=None):
+        """
+        Return a GCodeStream translating the gcode or .3w file at
+        path line by line as it is read: read, classify, then each
+        stage of the model translator, then the optimizer if set.
+        Nothing is read until the stream is. The time spent in each
+        step is recorded in timings, if given, under its name.
+        """
+        timings = timings or Timings(enabled=False)
+        lines = timings.timed("read", GCodeStream.read(path, workers))
+        model = self.model_translator()
+        if model:
+            for stage in model.stages():
+                lines = timings.timed(stage.__name__, stage(lines, values))
+        if self.optimizer:
+            lines = timings.timed("optimize", self.optimizer.stage(lines, values))
+        return GCodeStream(lines)